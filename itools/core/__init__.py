@@ -20,7 +20,7 @@
 from sys import platform
 
 # Import from itools
-from cache import LRUCache
+from cache import LRUCache, SizedLRUCache
 from freeze import freeze, frozendict, frozenlist
 from lazy import lazy
 from mimetypes_ import add_type, guess_all_extensions, guess_extension
@@ -55,6 +55,7 @@ __all__ = [
     # Ordered dict and caching
     'OrderedDict',
     'LRUCache',
+    'SizedLRUCache',
     # Mimetypes
     'add_type',
     'guess_all_extensions',
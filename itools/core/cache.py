@@ -20,6 +20,9 @@ This module implements a LRU (Least Recently Used) Cache.
 http://en.wikipedia.org/wiki/Cache_algorithms
 """
 
+# Import from the Standard Library
+from sys import getsizeof
+
 # Import from itools
 from odict import OrderedDict
 
@@ -116,3 +119,140 @@ class LRUCache(OrderedDict):
         self.last.next = node
         self.last = node
 
+
+
+
+class SizedLRUCache(LRUCache):
+    """A LRU cache that, besides the number of values, bounds the memory
+    they use.
+
+    Every value belongs to a kind (as returned by the 'get_kind' function,
+    by default there is only one kind: None), and every kind may have its
+    own budget in bytes: the 'budgets' argument is a mapping from kind to
+    the number of bytes, a kind without budget is not limited.
+
+    The memory used by a value is computed once, when it is added to the
+    cache, by the 'get_sizeof' function (by default 'sys.getsizeof').  If
+    the function returns None the size is not known yet (the value may be
+    loaded lazily); these values count as zero bytes until the size is
+    computed again by 'update_sizes'.  Use 'resize' when a value changes.
+
+    When automatic, the least-recently used values of the kinds over budget
+    are removed when a new value is added (except the value just added).
+    Otherwise use 'get_overflow' to know how many bytes should be freed.
+    """
+
+    def __init__(self, size_min, size_max=None, automatic=True, budgets=None,
+                 get_kind=None, get_sizeof=None):
+        super(SizedLRUCache, self).__init__(size_min, size_max, automatic)
+        self.budgets = budgets or {}
+        self.get_kind = get_kind or (lambda value: None)
+        self.get_sizeof = get_sizeof or getsizeof
+        # Map from key to (kind, size)
+        self.sizes = {}
+        # Bytes used by every kind
+        self.bytes = {}
+        # The keys whose size is not known yet
+        self.unsized = set()
+        # The number of values removed to make room
+        self.evictions = 0
+
+
+    def _measure(self, key, value):
+        kind = self.get_kind(value)
+        size = self.get_sizeof(value)
+        if size is None:
+            size = 0
+            self.unsized.add(key)
+        else:
+            self.unsized.discard(key)
+        self.sizes[key] = (kind, size)
+        self.bytes[kind] = self.bytes.get(kind, 0) + size
+
+
+    def _forget(self, key):
+        kind, size = self.sizes.pop(key)
+        self.bytes[kind] -= size
+        self.unsized.discard(key)
+
+
+    def __setitem__(self, key, value):
+        if key in self:
+            del self[key]
+        self._measure(key, value)
+        super(SizedLRUCache, self).__setitem__(key, value)
+
+
+    def _remove(self, key):
+        super(SizedLRUCache, self)._remove(key)
+        self._forget(key)
+
+
+    def _append(self, key):
+        n = len(self)
+        super(SizedLRUCache, self)._append(key)
+        self.evictions += n - len(self)
+
+        # Free memory if needed
+        if self.automatic is True and self.budgets:
+            overflow = self.get_overflow()
+            if overflow:
+                self.free(overflow, keep=key)
+
+
+    def clear(self):
+        super(SizedLRUCache, self).clear()
+        self.sizes.clear()
+        self.bytes.clear()
+        self.unsized.clear()
+
+
+    def get_size(self, key):
+        return self.sizes[key][1]
+
+
+    def resize(self, key):
+        """Computes again the size of the value identified by the given key.
+        """
+        self._forget(key)
+        self._measure(key, self[key])
+
+
+    def update_sizes(self):
+        """Computes the size of the values whose size was not known.
+        """
+        for key in list(self.unsized):
+            self.resize(key)
+
+
+    def get_overflow(self):
+        """Returns a mapping from kind to the number of bytes to free, for
+        the kinds over budget.
+        """
+        overflow = {}
+        for kind, budget in self.budgets.iteritems():
+            if budget is not None:
+                extra = self.bytes.get(kind, 0) - budget
+                if extra > 0:
+                    overflow[kind] = extra
+        return overflow
+
+
+    def free(self, overflow, keep=None):
+        """Removes the least-recently used values until the given number of
+        bytes per kind (see 'get_overflow') have been freed.
+        """
+        node = self.first
+        while node is not None and overflow:
+            key = node.key
+            node = node.next
+            if key == keep:
+                continue
+            kind, size = self.sizes[key]
+            if kind not in overflow:
+                continue
+            del self[key]
+            self.evictions += 1
+            overflow[kind] -= size
+            if overflow[kind] <= 0:
+                del overflow[kind]
@@ -0,0 +1,172 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module implements a second level cache for the parsed state of the
+handlers, shared by all the processes that open the same database.  It
+lives in the 'cache/v<version>' folder of the database (see 'RODatabase'),
+and is bounded by size.
+"""
+
+# Import from the Standard Library
+from errno import EEXIST
+from hashlib import sha1
+from os import fdopen, listdir, makedirs, remove, rename, stat, utime
+from os.path import exists
+from tempfile import mkstemp
+from time import time
+
+
+
+def get_blob_oid(data):
+    """Returns the oid git gives to a blob with the given contents.
+    """
+    return sha1('blob %d\0%s' % (len(data), data)).hexdigest()
+
+
+
+class BlobCache(object):
+    """A mapping from git blob oid to a byte string (typically the parsed
+    state of a handler, serialized), stored in the filesystem the same way
+    git stores its loose objects.
+
+    Blobs are immutable, so are the entries of this cache: there is nothing
+    to invalidate, and any process can reuse what another process stored.
+    Entries are written to a temporary file and then renamed, so readers
+    never see partial entries.
+
+    The cache is bounded by 'max_size' (in bytes): once a process has
+    written a tenth of it, the least recently used entries are removed
+    (see 'prune').  The mtime of the entries is their last use, updated on
+    read at most once per 'touch_interval' seconds.
+    """
+
+    touch_interval = 3600
+
+
+    def __init__(self, path, max_size=256 * 2**20):
+        self.path = path
+        self.max_size = max_size
+        # Bytes written since the last time the cache was pruned
+        self.written = 0
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+
+    def _get_path(self, oid):
+        return '%s/%s/%s' % (self.path, oid[:2], oid[2:])
+
+
+    def get(self, oid):
+        path = self._get_path(oid)
+        try:
+            file = open(path, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+
+        try:
+            data = file.read()
+            # Used (the entry may have been removed meanwhile)
+            now = time()
+            if now - stat(path).st_mtime > self.touch_interval:
+                utime(path, (now, now))
+        except OSError:
+            pass
+        finally:
+            file.close()
+        self.hits += 1
+        return data
+
+
+    def set(self, oid, data):
+        path = self._get_path(oid)
+        if exists(path):
+            return
+
+        folder = '%s/%s' % (self.path, oid[:2])
+        try:
+            makedirs(folder)
+        except OSError, e:
+            if e.errno != EEXIST:
+                raise
+
+        fd, tmp_path = mkstemp(dir=folder)
+        file = fdopen(fd, 'wb')
+        try:
+            file.write(data)
+        except Exception:
+            file.close()
+            remove(tmp_path)
+            raise
+        file.close()
+        rename(tmp_path, path)
+
+        # Prune from time to time
+        self.written += len(data)
+        if self.max_size is not None and self.written > self.max_size / 10:
+            self.prune()
+
+
+    def prune(self, max_size=None):
+        """Removes the least recently used entries until the cache is 80%
+        of 'max_size' (by default the size of the cache), if bigger.
+        Returns the number of entries removed.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        self.written = 0
+
+        # The entries, the oldest first
+        entries = []
+        total = 0
+        try:
+            folders = listdir(self.path)
+        except OSError:
+            return 0
+        for folder in folders:
+            folder = '%s/%s' % (self.path, folder)
+            try:
+                names = listdir(folder)
+            except OSError:
+                continue
+            for name in names:
+                path = '%s/%s' % (folder, name)
+                try:
+                    st = stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total <= max_size:
+            return 0
+
+        # Remove (other processes may be doing the same)
+        entries.sort()
+        target = max_size * 8 / 10
+        n = 0
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                remove(path)
+            except OSError:
+                pass
+            total -= size
+            n += 1
+        return n
@@ -29,13 +29,14 @@ from xapian import Document, Query, QueryParser, Enquire
 from xapian import sortable_serialise, sortable_unserialise, TermGenerator
 
 # Import from itools
-from itools.core import fixed_offset, lazy
+from itools.core import LRUCache, fixed_offset, get_pipe, lazy
 from itools.datatypes import Decimal, Integer, Unicode, String
 from itools.fs import lfs
 from itools.i18n import is_punctuation
 from itools.log import log_warning
 from queries import AllQuery, _AndQuery, NotQuery, _OrQuery, PhraseQuery
 from queries import RangeQuery, StartQuery, TextQuery, _MultipleQuery
+from queries import get_query_key
 
 try:
     from xapian import MultiValueSorter
@@ -94,12 +95,49 @@ def warn_not_indexed_nor_stored(name):
 
 
 
+def _get_languages(metadata):
+    """Returns a dict from the name of every multilingual field to the list
+    of its languages, built from the given catalog metadata.
+    """
+    languages = {}
+    for name, info in metadata.iteritems():
+        if 'from' in info:
+            base = info['from']
+            languages.setdefault(base, []).append(name[len(base)+1:])
+    return languages
+
+
+
 class Doc(object):
 
-    def __init__(self, xdoc, fields, metadata):
+    def __init__(self, xdoc, fields, metadata, languages=None):
         self._xdoc = xdoc
         self._fields = fields
         self._metadata = metadata
+        if languages is None:
+            languages = _get_languages(metadata)
+        self._languages = languages
+
+
+    def _negotiate(self, name, field_cls):
+        """Language negotiation, returns the value of the given multilingual
+        field, or None if it is empty in every language.
+        """
+        languages = []
+        values = {}
+        for language in self._languages.get(name, ()):
+            value = getattr(self, '%s_%s' % (name, language))
+            if not field_cls.is_empty(value):
+                languages.append(language)
+                values[language] = value
+
+        if not languages:
+            return None
+
+        language = select_language(languages)
+        if language is None:
+            language = languages[0]
+        return values[language]
 
 
     def __getattr__(self, name):
@@ -122,24 +160,9 @@ class Doc(object):
 
         # 3. Special Case: multilingual field (language negotiation)
         if issubclass(field_cls, Unicode) and 'from' not in info:
-            prefix = '%s_' % name
-            n = len(prefix)
-
-            languages = []
-            values = {}
-            for k in self._metadata:
-                if k[:n] == prefix:
-                    language = k[n:]
-                    value = getattr(self, '%s_%s' % (name, language))
-                    if not field_cls.is_empty(value):
-                        languages.append(language)
-                        values[language] = value
-
-            if languages:
-                language = select_language(languages)
-                if language is None:
-                    language = languages[0]
-                return values[language]
+            value = self._negotiate(name, field_cls)
+            if value is not None:
+                return value
 
         # 4. Default
         # FIXME Xapian does not make the difference between the empty string
@@ -170,33 +193,55 @@ class Doc(object):
                 if self._metadata.get(name):
                     return getattr(self, name)
             else:
-                prefix = '%s_' % name
-                n = len(prefix)
                 # Language negotiation
-                languages = []
-                values = {}
-                for k in self._metadata:
-                    if k[:n] == prefix:
-                        language = k[n:]
-                        value = getattr(self, '%s_%s' % (name, language))
-                        if not field_cls.is_empty(value):
-                            languages.append(language)
-                            values[language] = value
-                if languages:
-                    language = select_language(languages)
-                    if language is None:
-                        language = languages[0]
-                    return values[language]
+                value = self._negotiate(name, field_cls)
+                if value is not None:
+                    return value
         # Default
         return field_cls.get_default()
 
 
 
+class Brain(object):
+    """A compact document, the values of some fields are decoded upfront
+    and kept in slots (see 'SearchResults.get_documents'), the other
+    attributes are resolved by the document.
+    """
+
+    __slots__ = ('_doc',)
+
+
+    def __getattr__(self, name):
+        return getattr(self._doc, name)
+
+
+    def get_value(self, name, language=None):
+        return self._doc.get_value(name, language)
+
+
+
+brain_classes = {}
+
+def get_brain_class(names):
+    """Returns the subclass of Brain with a slot for every given field name
+    (a tuple).
+    """
+    cls = brain_classes.get(names)
+    if cls is None:
+        cls = type('Brain', (Brain,), {'__slots__': names})
+        brain_classes[names] = cls
+    return cls
+
+
+
 class SearchResults(object):
 
-    def __init__(self, database, xquery):
+    def __init__(self, database, xquery, key=None):
         self._database = database
         self._xquery = xquery
+        # The canonical form of the query, used as the key of the cache
+        # (None if the results are not to be cached)
+        self._key = key
 
 
     @lazy
@@ -208,10 +253,26 @@ class SearchResults(object):
 
     @lazy
     def _max(self):
+        catalog = self._database.catalog
+        # Cache hit
+        key = self._key
+        if key is not None:
+            key = ('len', key)
+            value = catalog._cache_get(key)
+            if value is not None:
+                return value
+
+        # The mset is not materialized (no document is asked for), but
+        # xapian is asked to check all the documents, so the estimation is
+        # exact
         enquire = self._enquire
-        db = self._database.catalog._db
-        doccount = db.get_doccount()
-        return enquire.get_mset(0, doccount).size()
+        doccount = catalog._db.get_doccount()
+        value = enquire.get_mset(0, 0, doccount).get_matches_estimated()
+
+        # Cache miss
+        if key is not None:
+            catalog._cache_set(key, value)
+        return value
 
 
     def __len__(self):
@@ -219,18 +280,124 @@ class SearchResults(object):
         return self._max
 
 
+    def get_n_documents(self, check_at_least=0):
+        """Returns an estimation of the number of documents found, cheaper
+        than 'len'.  The estimation is exact if it is not greater than the
+        given 'check_at_least' number.
+        """
+        if '_max' in self.__dict__:
+            return self._max
+        mset = self._enquire.get_mset(0, 0, check_at_least)
+        return mset.get_matches_estimated()
+
+
     def search(self, query=None, **kw):
         database = self._database
 
-        xquery = _get_xquery(database.catalog, query, **kw)
+        key, xquery = _get_key_and_xquery(database.catalog, query, **kw)
         query = Query(Query.OP_AND, [self._xquery, xquery])
-        return self.__class__(database, query)
+        if key is not None and self._key is not None:
+            key = ('and', frozenset([self._key, key]))
+        else:
+            key = None
+        return self.__class__(database, query, key)
+
 
+    def _set_sort(self, enquire, sort_by, reverse):
+        metadata = self._database.catalog._metadata
+        if sort_by is None:
+            enquire.set_sort_by_relevance()
+        elif isinstance(sort_by, list):
+            if XAPIAN_VERSION == '1.4':
+                sorter = MultiValueKeyMaker()
+                for name in sort_by:
+                    # If there is a problem, ignore this field
+                    if name not in metadata:
+                        warn_not_stored(name)
+                        continue
+                    sorter.add_value(metadata[name]['value'], reverse)
+            else:
+                sorter = MultiValueSorter()
+                for name in sort_by:
+                    # If there is a problem, ignore this field
+                    if name not in metadata:
+                        warn_not_stored(name)
+                        continue
+                    sorter.add(metadata[name]['value'])
+            enquire.set_sort_by_key_then_relevance(sorter, reverse)
+        else:
+            # If there is a problem, ignore the sort
+            if sort_by in metadata:
+                value = metadata[sort_by]['value']
+                enquire.set_sort_by_value_then_relevance(value, reverse)
+            else:
+                warn_not_stored(sort_by)
+
+
+    def _make_documents(self, mset, fields=None):
+        """Returns the list of documents for the given mset.
+
+        If the field names are given, the documents are Brain instances, and
+        the values of these fields are decoded upfront for all the documents
+        at once.
+        """
+        catalog = self._database.catalog
+        catalog_fields = catalog._fields
+        metadata = catalog._metadata
+        languages = catalog._languages
+
+        # Case 1: Doc
+        if not fields:
+            return [ Doc(x.document, catalog_fields, metadata, languages)
+                     for x in mset ]
+
+        # Case 2: Brain, find out where and how are stored the fields
+        names = tuple(fields)
+        cls = get_brain_class(names)
+        columns = []
+        for name in names:
+            info = metadata.get(name)
+            if info is None or 'value' not in info:
+                # Not stored, accessing the attribute will raise an error
+                continue
+            field_cls = _get_field_cls(name, catalog_fields, info)
+            decode = _decode if field_cls.multiple else _decode_simple_value
+            multilingual = (issubclass(field_cls, Unicode)
+                            and 'from' not in info)
+            columns.append((name, info['value'], field_cls, decode,
+                            multilingual))
+
+        new = object.__new__
+        results = []
+        for x in mset:
+            xdoc = x.document
+            doc = Doc(xdoc, catalog_fields, metadata, languages)
+            brain = new(cls)
+            brain._doc = doc
+            get_value = xdoc.get_value
+            for name, slot, field_cls, decode, multilingual in columns:
+                raw_value = get_value(slot)
+                if raw_value:
+                    value = decode(field_cls, raw_value)
+                elif multilingual:
+                    # The language is negotiated every time the value is
+                    # accessed, as the brains are shared by the requests
+                    # (see the cache of 'get_documents')
+                    continue
+                else:
+                    # Default value
+                    value = getattr(doc, name)
+                setattr(brain, name, value)
+            results.append(brain)
 
-    def get_documents(self, sort_by=None, reverse=False, start=0, size=0):
+        return results
+
+
+    def get_documents(self, sort_by=None, reverse=False, start=0, size=0,
+                      fields=None):
         """Returns the documents for the search, sorted by weight.
 
-        Four optional arguments are accepted, which will modify the documents
+        Five optional arguments are accepted, which will modify the documents
         returned.
 
         First, it is possible to sort by a field, or a list of fields, instead
@@ -253,60 +420,84 @@ class SearchResults(object):
           - "size": returns at most documents as specified by this parameter.
 
         By default all the documents are returned.
+
+        Finally, to render many documents, it is faster to ask upfront for
+        the stored fields that will be used:
+
+          - "fields", a list of names of stored fields. Their values will be
+            decoded at once for all the documents returned.
         """
-        enquire = self._enquire
         catalog = self._database.catalog
 
-        # sort_by != None
-        metadata = catalog._metadata
-        if sort_by is not None:
-            if isinstance(sort_by, list):
-                if XAPIAN_VERSION == '1.4':
-                    sorter = MultiValueKeyMaker()
-                    for name in sort_by:
-                        # If there is a problem, ignore this field
-                        if name not in metadata:
-                            warn_not_stored(name)
-                            continue
-                        sorter.add_value(metadata[name]['value'], reverse)
-                else:
-                    sorter = MultiValueSorter()
-                    for name in sort_by:
-                        # If there is a problem, ignore this field
-                        if name not in metadata:
-                            warn_not_stored(name)
-                            continue
-                        sorter.add(metadata[name]['value'])
-                enquire.set_sort_by_key_then_relevance(sorter, reverse)
-            else:
-                # If there is a problem, ignore the sort
-                if sort_by in metadata:
-                    value = metadata[sort_by]['value']
-                    enquire.set_sort_by_value_then_relevance(value, reverse)
-                else:
-                    warn_not_stored(sort_by)
-        else:
-            enquire.set_sort_by_relevance()
+        # Cache hit
+        key = self._key
+        if key is not None:
+            sort_key = tuple(sort_by) if type(sort_by) is list else sort_by
+            fields_key = tuple(fields) if fields else None
+            key = ('documents', key, sort_key, reverse, start, size,
+                   fields_key)
+            results = catalog._cache_get(key)
+            if results is not None:
+                return list(results)
 
         # start/size
         if size == 0:
-            size = self._database.catalog._db.get_doccount()
+            size = len(self) - start
+            if size <= 0:
+                return []
 
         # Construction of the results
-        fields = catalog._fields
-        results = [ Doc(x.document, fields, metadata)
-                    for x in enquire.get_mset(start, size) ]
+        enquire = self._enquire
+        self._set_sort(enquire, sort_by, reverse)
+        results = self._make_documents(enquire.get_mset(start, size), fields)
 
         # sort_by=None/reverse=True
         if sort_by is None and reverse:
             results.reverse()
 
+        # Cache miss (big results are not kept)
+        if key is not None and len(results) <= catalog.cache_max_documents:
+            catalog._cache_set(key, list(results))
         return results
 
 
-    def get_resources(self, sort_by=None, reverse=False, start=0, size=0):
+    def iter_documents(self, sort_by=None, reverse=False, start=0, size=0,
+                       page_size=100, fields=None):
+        """Same as 'get_documents', but returns a generator.  The documents
+        are fetched from the catalog by pages of 'page_size' documents, so
+        at most one page is kept in memory.
+        """
+        # sort_by=None/reverse=True, there is no way but to load everything
+        if sort_by is None and reverse:
+            documents = self.get_documents(sort_by, reverse, start, size,
+                                           fields)
+            for doc in documents:
+                yield doc
+            return
+
+        # A dedicated enquire, so other calls do not change the sort
+        catalog = self._database.catalog
+        enquire = Enquire(catalog._db)
+        enquire.set_query(self._xquery)
+        self._set_sort(enquire, sort_by, reverse)
+
+        end = (start + size) if size else None
+        while end is None or start < end:
+            n = page_size if end is None else min(page_size, end - start)
+            mset = enquire.get_mset(start, n)
+            for doc in self._make_documents(mset, fields):
+                yield doc
+            # Last page
+            if mset.size() < n:
+                return
+            start += n
+
+
+    def get_resources(self, sort_by=None, reverse=False, start=0, size=0,
+                      fields=None):
         database = self._database
-        brains = list(self.get_documents(sort_by, reverse, start, size))
+        brains = self.iter_documents(sort_by, reverse, start, size,
+                                     fields=fields)
         for brain in brains:
             yield database.get_resource_from_brain(brain)
 
@@ -314,7 +505,11 @@ class SearchResults(object):
 
 class Catalog(object):
 
-    def __init__(self, ref, fields, read_only=False, asynchronous_mode=True):
+    # The search results with more documents than this are not cached
+    cache_max_documents = 1000
+
+    def __init__(self, ref, fields, read_only=False, asynchronous_mode=True,
+                 cache_size=200):
         # Load the database
         if isinstance(ref, (Database, WritableDatabase)):
             self._db = ref
@@ -339,6 +534,11 @@ class Catalog(object):
         self._prefix_nb = 0
         self._load_all_internal()
 
+        # The cache of search results (see '_cache_get'), the generation
+        # is incremented every time the catalog changes
+        self.generation = 0
+        self._cache = LRUCache(cache_size) if cache_size else None
+
 
     #######################################################################
     # API / Public / Transactions
@@ -352,6 +552,7 @@ class Catalog(object):
         db.commit_transaction()
         db.flush()
         db.begin_transaction(False)
+        self._changed()
 
 
     def abort_changes(self):
@@ -363,6 +564,16 @@ class Catalog(object):
         db.cancel_transaction()
         self._load_all_internal()
         db.begin_transaction(False)
+        self._changed()
+
+
+    def reopen(self):
+        """Read-only catalogs see the changes committed by the writer only
+        once reopened.
+        """
+        self._db.reopen()
+        self._load_all_internal()
+        self._changed()
 
 
     def close(self):
@@ -375,87 +586,57 @@ class Catalog(object):
     def index_document(self, document):
         """Add a new document.
         """
-        db = self._db
-        metadata = self._metadata
-        fields = self._fields
-
-        # Check the input
-        if type(document) is dict:
-            doc_values = document
-        else:
-            doc_values = document.get_catalog_values()
-
-        # Make the xapian document
-        metadata_modified = False
-        xdoc = Document()
-        for name, value in doc_values.iteritems():
-            if name not in fields:
-                warn_not_indexed_nor_stored(name)
-            field_cls = fields[name]
-
-            # New field ?
-            if name not in metadata:
-                info = metadata[name] = self._get_info(field_cls, name)
-                metadata_modified = True
-            else:
-                info = metadata[name]
-
-            # XXX This comment is no longer valid, now the key field is
-            #     always abspath with field_cls = String
-            # Store the key field with the prefix 'Q'
-            # Comment: the key field is indexed twice, but we must do it
-            #          one => to index (as the others)
-            #          two => to index without split
-            #          the problem is that "_encode != _index"
-            if name == 'abspath':
-                key_value = _reduce_size(_encode(field_cls, value))
-                xdoc.add_term('Q' + key_value)
-
-            # A multilingual value?
-            if isinstance(value, dict):
-                for language, lang_value in value.iteritems():
-                    lang_name = name + '_' + language
-
-                    # New field ?
-                    if lang_name not in metadata:
-                        lang_info = self._get_info(field_cls, lang_name)
-                        lang_info['from'] = name
-                        metadata[lang_name] = lang_info
-                        metadata_modified = True
-                    else:
-                        lang_info = metadata[lang_name]
-
-                    # The value can be None
-                    if lang_value is not None:
-                        # Is stored ?
-                        if 'value' in lang_info:
-                            xdoc.add_value(lang_info['value'],
-                                           _encode(field_cls, lang_value))
-                        # Is indexed ?
-                        if 'prefix' in lang_info:
-                            # Comment: Index twice
-                            _index(xdoc, field_cls, lang_value,
-                                   info['prefix'], language)
-                            _index(xdoc, field_cls, lang_value,
-                                   lang_info['prefix'], language)
-            # The value can be None
-            elif value is not None:
-                # Is stored ?
-                if 'value' in info:
-                    xdoc.add_value(info['value'], _encode(field_cls, value))
-                # Is indexed ?
-                if 'prefix' in info:
-                    # By default language='en'
-                    _index(xdoc, field_cls, value, info['prefix'], 'en')
+        xdoc, metadata_modified = self._make_xdoc(document, {})
 
         # TODO: Don't store two documents with the same key field!
 
         # Save the doc
+        db = self._db
         db.add_document(xdoc)
+        self._changed()
 
         # Store metadata ?
         if metadata_modified:
-            db.set_metadata('metadata', dumps(metadata))
+            db.set_metadata('metadata', dumps(self._metadata))
+
+
+    def index_documents(self, documents, batch_size=1000):
+        """Add the given documents, this is the bulk version of
+        'index_document'.  The documents may be given as any iterable (for
+        instance a generator), of resources or dicts of values.
+
+        The field informations are looked up once for all, and the documents
+        are written by batches of 'batch_size' documents: the metadata is
+        stored once per batch and, in asynchronous mode, the transaction is
+        committed after every batch, so memory usage stays bounded.
+
+        Returns the number of documents indexed.
+        """
+        db = self._db
+        make_xdoc = self._make_xdoc
+        infos = {}
+
+        n = 0
+        batch = 0
+        metadata_modified = False
+        for document in documents:
+            xdoc, modified = make_xdoc(document, infos)
+            db.add_document(xdoc)
+            self._changed()
+            metadata_modified = metadata_modified or modified
+            n += 1
+            batch += 1
+            # End of batch
+            if batch == batch_size:
+                self._flush_batch(metadata_modified)
+                batch = 0
+                metadata_modified = False
+
+        # The last batch
+        if batch:
+            self._flush_batch(metadata_modified)
+
+        return n
 
 
     def unindex_document(self, abspath):
@@ -464,6 +645,7 @@ class Catalog(object):
         """
         data = _reduce_size(_encode(self._fields['abspath'], abspath))
         self._db.delete_document('Q' + data)
+        self._changed()
 
 
     #######################################################################
@@ -508,6 +690,137 @@ class Catalog(object):
         return info
 
 
+    def _changed(self):
+        """To be called every time the catalog is modified, invalidates the
+        cache of search results.
+        """
+        self.generation += 1
+        if self._cache:
+            self._cache.clear()
+
+
+    def _cache_get(self, key):
+        cache = self._cache
+        if cache is None:
+            return None
+
+        key = (self.generation, key)
+        value = cache.get(key)
+        if value is not None:
+            cache.touch(key)
+        return value
+
+
+    def _cache_set(self, key, value):
+        if self._cache is not None:
+            self._cache[(self.generation, key)] = value
+
+
+    def _flush_batch(self, metadata_modified):
+        db = self._db
+        if metadata_modified:
+            db.set_metadata('metadata', dumps(self._metadata))
+
+        if self._asynchronous:
+            self.save_changes()
+        else:
+            db.flush()
+
+
+    def _make_xdoc(self, document, infos):
+        """Build and return the xapian document for the given resource (or
+        dict of values), and whether the metadata has been modified.
+
+        The 'infos' dict is a cache from field name to the couple (field_cls,
+        info), it may be shared by several calls.
+        """
+        metadata = self._metadata
+        fields = self._fields
+
+        # Check the input
+        if type(document) is dict:
+            doc_values = document
+        else:
+            doc_values = document.get_catalog_values()
+
+        # Make the xapian document
+        metadata_modified = False
+        xdoc = Document()
+        for name, value in doc_values.iteritems():
+            cached = infos.get(name)
+            if cached is None:
+                if name not in fields:
+                    warn_not_indexed_nor_stored(name)
+                field_cls = fields[name]
+
+                # New field ?
+                if name not in metadata:
+                    info = metadata[name] = self._get_info(field_cls, name)
+                    metadata_modified = True
+                else:
+                    info = metadata[name]
+                infos[name] = field_cls, info
+            else:
+                field_cls, info = cached
+
+            # XXX This comment is no longer valid, now the key field is
+            #     always abspath with field_cls = String
+            # Store the key field with the prefix 'Q'
+            # Comment: the key field is indexed twice, but we must do it
+            #          one => to index (as the others)
+            #          two => to index without split
+            #          the problem is that "_encode != _index"
+            if name == 'abspath':
+                key_value = _reduce_size(_encode(field_cls, value))
+                xdoc.add_term('Q' + key_value)
+
+            # A multilingual value?
+            if isinstance(value, dict):
+                for language, lang_value in value.iteritems():
+                    lang_name = name + '_' + language
+
+                    cached = infos.get(lang_name)
+                    if cached is not None:
+                        lang_info = cached[1]
+                    else:
+                        # New field ?
+                        if lang_name not in metadata:
+                            lang_info = self._get_info(field_cls, lang_name)
+                            lang_info['from'] = name
+                            metadata[lang_name] = lang_info
+                            metadata_modified = True
+                            languages = self._languages
+                            languages.setdefault(name, []).append(language)
+                        else:
+                            lang_info = metadata[lang_name]
+                        infos[lang_name] = field_cls, lang_info
+
+                    # The value can be None
+                    if lang_value is not None:
+                        # Is stored ?
+                        if 'value' in lang_info:
+                            xdoc.add_value(lang_info['value'],
+                                           _encode(field_cls, lang_value))
+                        # Is indexed ?
+                        if 'prefix' in lang_info:
+                            # Comment: Index twice
+                            _index(xdoc, field_cls, lang_value,
+                                   info['prefix'], language)
+                            _index(xdoc, field_cls, lang_value,
+                                   lang_info['prefix'], language)
+            # The value can be None
+            elif value is not None:
+                # Is stored ?
+                if 'value' in info:
+                    xdoc.add_value(info['value'], _encode(field_cls, value))
+                # Is indexed ?
+                if 'prefix' in info:
+                    # By default language='en'
+                    _index(xdoc, field_cls, value, info['prefix'], 'en')
+
+        return xdoc, metadata_modified
+
+
     def _load_all_internal(self):
         """Load the metadata from the database
         """
@@ -525,6 +838,9 @@ class Catalog(object):
                 if 'prefix' in info:
                     self._prefix_nb += 1
 
+        # The languages of the multilingual fields
+        self._languages = _get_languages(self._metadata)
+
 
     def _query2xquery(self, query):
         """take a "itools" query and return a "xapian" query
@@ -708,6 +1024,43 @@ def make_catalog(uri, fields):
 
 
 
+def merge_catalogs(sources, target):
+    """Merges the given catalogs (a list of paths) into a new catalog at the
+    given target path.  This is used to build a catalog from several shards,
+    indexed in parallel.
+
+    The source catalogs must agree on the fields they share (same value
+    slots and prefixes), otherwise a ValueError is raised.
+    """
+    # The metadata
+    metadata = {}
+    for source in sources:
+        data = Database(source).get_metadata('metadata')
+        if not data:
+            continue
+        for name, info in loads(data).iteritems():
+            if metadata.setdefault(name, info) != info:
+                msg = 'cannot merge catalogs, the "%s" field differs'
+                raise ValueError, msg % name
+
+    # Compact
+    target = lfs.get_absolute_path(target)
+    if XAPIAN_VERSION == '1.4':
+        db = Database()
+        for source in sources:
+            db.add_database(Database(source))
+        db.compact(target)
+    else:
+        get_pipe(['xapian-compact'] + list(sources) + [target])
+
+    # Store the metadata
+    db = WritableDatabase(target, DB_OPEN)
+    db.set_metadata('metadata', dumps(metadata))
+    db.flush()
+    db.close()
+
+
+
 #############
 # Private API
 
@@ -924,6 +1277,41 @@ def _make_PhraseQuery(field_cls, value, prefix):
 
 
 
+def _get_key_and_xquery(catalog, query=None, **kw):
+    """Returns the canonical form of the given query (None if it cannot be
+    cached) and the xapian query, from the cache if possible.
+    """
+    # The key
+    if query is not None:
+        key = get_query_key(query)
+    elif kw:
+        keys = [ get_query_key(PhraseQuery(name, value))
+                 for name, value in kw.iteritems() ]
+        if None in keys:
+            key = None
+        elif len(keys) == 1:
+            key = keys[0]
+        else:
+            key = ('and', frozenset(keys))
+    else:
+        key = ('all',)
+
+    # Not to be cached
+    if key is None:
+        return None, _get_xquery(catalog, query, **kw)
+
+    # Cache hit
+    xquery = catalog._cache_get(('xquery', key))
+    if xquery is not None:
+        return key, xquery
+
+    # Cache miss
+    xquery = _get_xquery(catalog, query, **kw)
+    catalog._cache_set(('xquery', key), xquery)
+    return key, xquery
+
+
+
 def _get_xquery(catalog, query=None, **kw):
     # Case 1: a query is given
     if query is not None:
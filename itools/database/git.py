@@ -27,10 +27,14 @@ import time
 
 # Import from pygit2
 from pygit2 import Repository, Signature, GitError, init_repository
-from pygit2 import GIT_SORT_REVERSE, GIT_SORT_TIME, GIT_OBJ_TREE
+from pygit2 import IndexEntry
+from pygit2 import Oid
+from pygit2 import GIT_SORT_REVERSE, GIT_SORT_TIME
+from pygit2 import GIT_OBJ_BLOB, GIT_OBJ_TREE
 
 # Import from itools
-from itools.core import lazy
+from itools.core import SizedLRUCache, lazy
+from history import HistoryIndex
 
 
 def message_short(commit):
@@ -48,6 +52,189 @@ def message_short(commit):
     return message.rstrip()
 
 
+def get_hex(sha):
+    """Returns the hexadecimal form of the given SHA, an oid or a string
+    (byte string or unicode).
+    """
+    if isinstance(sha, Oid):
+        return sha.hex
+    return str(sha)
+
+
+def get_object_kind(obj):
+    """The objects in the cache of the worktree are of three kinds, trees
+    and blobs have their own memory budgets.
+    """
+    obj_type = obj.type
+    if obj_type == GIT_OBJ_BLOB:
+        return 'blob'
+    elif obj_type == GIT_OBJ_TREE:
+        return 'tree'
+    return 'other'
+
+
+
+def get_object_sizeof(obj):
+    """Returns an approximation of the memory used by the given object.
+    """
+    obj_type = obj.type
+    if obj_type == GIT_OBJ_BLOB:
+        return 100 + obj.size
+    elif obj_type == GIT_OBJ_TREE:
+        return 100 + 80 * len(obj)
+    return 1000
+
+
+
+def match_paths(path, paths):
+    """Returns whether the given path is one of the given paths, or is
+    within one of them (like the paths given to 'git diff').
+    """
+    for x in paths:
+        if path == x or path.startswith(x + '/'):
+            return True
+    return False
+
+
+
+# The oid of the files that do not exist, in a diff
+zero_sha = '0' * 40
+
+c_escapes = {'\a': '\\a', '\b': '\\b', '\t': '\\t', '\n': '\\n',
+             '\v': '\\v', '\f': '\\f', '\r': '\\r', '"': '\\"',
+             '\\': '\\\\'}
+
+def quote_path(path):
+    """Quotes the given path the way git does (with 'core.quotePath' on):
+    paths with control characters, double quotes, backslashes or non ASCII
+    characters are quoted, C style.
+    """
+    if type(path) is unicode:
+        path = path.encode('utf-8')
+
+    quoted = False
+    chars = []
+    for c in path:
+        if c in c_escapes:
+            c = c_escapes[c]
+            quoted = True
+        elif c < ' ' or c >= '\x7f':
+            c = '\\%03o' % ord(c)
+            quoted = True
+        chars.append(c)
+
+    if quoted:
+        return '"%s"' % ''.join(chars)
+    return path
+
+
+def scale_linear(n, width, max_change):
+    """Scales the given number of changes to the width of the graph, at
+    least one column if not zero (like git).
+    """
+    if not n:
+        return 0
+    return 1 + (n * (width - 1) / max_change)
+
+
+def format_stats(changes, width=80):
+    """Returns the given changes (see 'Worktree.get_changes') in the format
+    of 'git diff --stat' (for an output that is not a terminal, hence 80
+    columns), following the algorithm of git's 'show_stats'.
+    """
+    if not changes:
+        return ''
+
+    # The widths wanted
+    files = []
+    max_len = max_change = bin_width = number_width = 0
+    for change in changes:
+        name = quote_path(change['path'])
+        max_len = max(max_len, len(name))
+        if change['binary']:
+            # "Bin XXX -> YYY bytes"
+            added, removed = change['new_size'], change['old_size']
+            w = 14 + len(str(added)) + len(str(removed))
+            bin_width = max(bin_width, w)
+            # The change counts are aligned with "Bin"
+            number_width = 3
+        else:
+            added, removed = change['added'], change['removed']
+            max_change = max(max_change, added + removed)
+        files.append((name, change['binary'], added, removed))
+    number_width = max(number_width, len(str(max_change)))
+
+    # Fit in the total width: 3/8 for the graph, 5/8 for the names
+    width = max(width, 16 + 6 + number_width)
+    if max_change + 4 > bin_width:
+        graph_width = max_change
+    else:
+        graph_width = bin_width - 4
+    name_width = max_len
+    if name_width + number_width + 6 + graph_width > width:
+        if graph_width > width * 3 / 8 - number_width - 6:
+            graph_width = max(width * 3 / 8 - number_width - 6, 6)
+        if name_width > width - number_width - 6 - graph_width:
+            name_width = width - number_width - 6 - graph_width
+        else:
+            graph_width = width - number_width - 6 - name_width
+
+    # Files
+    lines = []
+    insertions = deletions = 0
+    for name, binary, added, removed in files:
+        # Scale the name, keep the end (from a slash if any)
+        prefix = ''
+        size = name_width
+        if name_width < len(name):
+            prefix = '...'
+            size = max(size - 3, 0)
+            name = name[len(name) - size:]
+            slash = name.find('/')
+            if slash != -1:
+                name = name[slash:]
+        line = ' %s%-*s |' % (prefix, size, name)
+
+        # Binary
+        if binary:
+            line += ' %*s' % (number_width, 'Bin')
+            if added or removed:
+                line += ' %d -> %d bytes' % (removed, added)
+            lines.append(line + '\n')
+            continue
+
+        # Scale the graph
+        insertions += added
+        deletions += removed
+        total = added + removed
+        plus, minus = added, removed
+        if graph_width <= max_change:
+            scaled = scale_linear(total, graph_width, max_change)
+            if scaled < 2 and plus and minus:
+                scaled = 2
+            if plus < minus:
+                plus = scale_linear(plus, graph_width, max_change)
+                minus = scaled - plus
+            else:
+                minus = scale_linear(minus, graph_width, max_change)
+                plus = scaled - minus
+        line += ' %*d%s' % (number_width, total, ' ' if total else '')
+        lines.append('%s%s%s\n' % (line, '+' * plus, '-' * minus))
+
+    # Summary
+    n = len(changes)
+    summary = ' %d file%s changed' % (n, 's' if n != 1 else '')
+    if insertions or not deletions:
+        plural = 's' if insertions != 1 else ''
+        summary += ', %d insertion%s(+)' % (insertions, plural)
+    if deletions or not insertions:
+        plural = 's' if deletions != 1 else ''
+        summary += ', %d deletion%s(-)' % (deletions, plural)
+    lines.append(summary + '\n')
+    return ''.join(lines)
+
+
+
 def make_parent_dirs(path):
     folder = dirname(path)
     if not exists(folder):
@@ -55,12 +242,55 @@ def make_parent_dirs(path):
 
 
 
+class StatIndexEntry(IndexEntry):
+    """An index entry with the stat data of the file (the result of
+    'os.lstat'), as 'git add' would write it, so git does not hash the file
+    again to know it has not changed.
+
+    XXX pygit2 (0.24) does not expose the stat data of the entries, so it is
+    set on the C structure.  Python 2 gives the times as floats, the
+    nanoseconds may not be exact (only libgit2 built with GIT_USE_NSEC
+    compares them).
+    """
+
+    __slots__ = ['stat']
+
+    def __init__(self, path, object_id, mode, stat):
+        super(StatIndexEntry, self).__init__(path, object_id, mode)
+        self.stat = stat
+
+
+    def _to_c(self):
+        centry, path = super(StatIndexEntry, self)._to_c()
+        stat = self.stat
+        for name, value in ('ctime', stat.st_ctime), ('mtime', stat.st_mtime):
+            c_time = getattr(centry, name)
+            c_time.seconds = int(value)
+            c_time.nanoseconds = int((value - int(value)) * 1e9)
+        centry.dev = stat.st_dev & 0xFFFFFFFF
+        centry.ino = stat.st_ino & 0xFFFFFFFF
+        centry.uid = stat.st_uid
+        centry.gid = stat.st_gid
+        centry.file_size = stat.st_size & 0xFFFFFFFF
+        return centry, path
+
+
+
 class Worktree(object):
 
-    def __init__(self, path, repo):
+    def __init__(self, path, repo, cache_size_min=900, cache_size_max=1100,
+                 trees_max_bytes=16*2**20, blobs_max_bytes=64*2**20):
         self.path = abspath(path) + '/'
         self.repo = repo
-        self.cache = {} # {sha: object}
+        # The objects cache {sha: object}, bounded by the number of objects,
+        # and by the memory used by the trees and the blobs
+        budgets = {'tree': trees_max_bytes, 'blob': blobs_max_bytes}
+        self.cache = SizedLRUCache(cache_size_min, cache_size_max,
+                                   budgets=budgets,
+                                   get_kind=get_object_kind,
+                                   get_sizeof=get_object_sizeof)
+        self.cache_hits = 0
+        self.cache_misses = 0
         # FIXME These two fields are already available by libgit2. TODO
         # expose them through pygit2 and use them here.
         self.index_path = '%s/.git/index' % path
@@ -165,15 +395,38 @@ class Worktree(object):
 
 
     def lookup(self, sha):
-        """Return the object by the given SHA. We use a cache to warrant that
-        two calls with the same SHA will resolve to the same object, so the
-        'is' operator will work.
+        """Return the object by the given SHA (hex or oid).  Objects are
+        kept in a bounded cache, so two calls with the same SHA do not always
+        resolve to the same object: to compare objects compare their oids.
         """
+        sha = get_hex(sha)
+
         cache = self.cache
-        if sha not in cache:
-            cache[sha] = self.repo[sha]
+        obj = cache.get(sha)
+        if obj is not None:
+            cache.touch(sha)
+            self.cache_hits += 1
+            return obj
+
+        self.cache_misses += 1
+        obj = self.repo[sha]
+        cache[sha] = obj
+        return obj
+
 
-        return cache[sha]
+    def get_cache_stats(self):
+        """Returns a dict with the state of the objects cache: the number of
+        objects, the memory used by the trees and by the blobs, and the
+        counters of hits, misses and evictions.
+        """
+        cache = self.cache
+        return {
+            'objects': len(cache),
+            'trees_bytes': cache.bytes.get('tree', 0),
+            'blobs_bytes': cache.bytes.get('blob', 0),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': cache.evictions}
 
 
     def lookup_from_commit_by_path(self, commit, path):
@@ -195,6 +448,20 @@ class Worktree(object):
         return obj
 
 
+    @lazy
+    def history(self):
+        return HistoryIndex('%s.git/itools-history' % self.path)
+
+
+    def update_history(self):
+        """Updates the history index (used by 'git_log' to filter by paths)
+        up to HEAD.  If the index does not exist, it is built.
+        """
+        sha = self._resolve_reference('HEAD')
+        if sha is not None:
+            self.history.update(self.repo, self.repo[sha])
+
+
     @property
     def index(self):
         """Gives access to the index file. Reloads the index file if it has
@@ -219,12 +486,14 @@ class Worktree(object):
 
 
     def update_tree_cache(self):
-        """libgit2 is able to read the tree cache, but not to write it.
-        To speed up 'git_commit' this method should be called from time to
-        time, it updates the tree cache by calling 'git write-tree'.
+        """To speed up 'git_commit' this method should be called from time
+        to time, it updates the tree cache of the index file (the equivalent
+        of 'git write-tree').
         """
-        command = ['git', 'write-tree']
-        self._call(command)
+        index = self.index
+        index.write_tree()
+        index.write()
+        self.index_mtime = getmtime(self.index_path)
 
 
     def git_add(self, *args):
@@ -395,9 +664,23 @@ class Worktree(object):
         if reverse is True:
             sort |= GIT_SORT_REVERSE
 
+        # Use the history index if it is up to date, to get only the commits
+        # that changed the given paths
+        walk = None
+        if paths:
+            head = get_hex(sha)
+            walk = self.history.get_commits(paths, head)
+        if walk is None:
+            walk = self.repo.walk(sha, GIT_SORT_TIME)
+        else:
+            # The index gives the commits by time, as the walk does, and
+            # lazily: only the commits used are loaded
+            walk = ( self.repo[x] for x in walk )
+            paths = None
+
         # Go
         commits = []
-        for commit in self.repo.walk(sha, GIT_SORT_TIME):
+        for commit in walk:
             # --author=<pattern>
             if author:
                 commit_author = commit.author
@@ -421,7 +704,9 @@ class Worktree(object):
                             break
                     else:
                         b = self.lookup_from_commit_by_path(parent, path)
-                        if a is not b:
+                        a = a.oid if a is not None else None
+                        b = b.oid if b is not None else None
+                        if a != b:
                             break
                 else:
                     continue
@@ -441,52 +726,120 @@ class Worktree(object):
         return commits
 
 
+    def _get_commit(self, reference):
+        return self.repo.revparse_single('%s^{commit}' % reference)
+
+
+    def _get_diff(self, since, until=None):
+        """Returns the diff (a pygit2 Diff object) between two commits, or if
+        'until' is not given, between the commit 'since' and its parent.
+        """
+        since = self._get_commit(since)
+        if until is None:
+            parents = since.parents
+            if parents:
+                return parents[0].tree.diff_to_tree(since.tree)
+            # The first commit
+            return since.tree.diff_to_tree(swap=True)
+
+        until = self._get_commit(until)
+        return since.tree.diff_to_tree(until.tree)
+
+
+    def iter_patches(self, since, until=None, paths=None):
+        """Yields the patches (pygit2 Patch objects) of the diff between two
+        commits (see '_get_diff'), eventually reduced to the given paths.
+        """
+        for patch in self._get_diff(since, until):
+            if paths:
+                delta = patch.delta
+                if not match_paths(delta.new_file.path, paths) and \
+                   not match_paths(delta.old_file.path, paths):
+                    continue
+            yield patch
+
+
+    def get_changes(self, since, until=None, paths=None):
+        """Returns the changes between two commits (see '_get_diff'),
+        eventually reduced to the given paths, as a list of dicts with the
+        following keys:
+
+          path     -- the path of the file
+          old_path -- the path of the file before the change
+          status   -- 'A' (added), 'D' (deleted), 'M' (modified), etc.
+          added    -- the number of lines added
+          removed  -- the number of lines removed
+          binary   -- whether the file is binary
+          old_size -- the size of the file before the change (binary files)
+          new_size -- the size of the file after the change (binary files)
+        """
+        changes = []
+        for patch in self.iter_patches(since, until, paths):
+            delta = patch.delta
+            context, added, removed = patch.line_stats
+            change = {
+                'path': delta.new_file.path,
+                'old_path': delta.old_file.path,
+                'status': delta.status_char(),
+                'added': added,
+                'removed': removed,
+                'binary': delta.is_binary}
+            if delta.is_binary:
+                change['old_size'] = self._get_blob_size(delta.old_file.id)
+                change['new_size'] = self._get_blob_size(delta.new_file.id)
+            changes.append(change)
+        return changes
+
+
+    def _get_blob_size(self, oid):
+        # The oid is zero if the file does not exist
+        if oid.hex == zero_sha:
+            return 0
+        return self.lookup(oid).size
+
+
     def git_diff(self, since, until=None, paths=None):
         """Return the diff between two commits, eventually reduced to the
-        given paths.
+        given paths.  If 'until' is not given, return the diff introduced by
+        the commit 'since'.
 
-        TODO Implement using Python's difflib standard library, to avoid
-        calling Git.
+        The text is that of git itself (see 'get_changes' for the changes
+        computed in-process).
         """
         if until is None:
-            data = self._call(['git', 'show', since, '--pretty=format:'])
-            return data[1:]
-
-        cmd = ['git', 'diff', '%s..%s' % (since, until)]
+            cmd = ['git', 'show', since, '--pretty=format:']
+        else:
+            cmd = ['git', 'diff', '%s..%s' % (since, until)]
         if paths:
             cmd.append('--')
             cmd.extend(paths)
-        return self._call(cmd)
+        data = self._call(cmd)
+        if until is None:
+            return data[1:]
+        return data
 
 
     def git_stats(self, since, until=None, paths=None):
         """Return statistics of the changes done between two commits,
-        eventually reduced to the given paths.
-
-        TODO Implement using libgit2
+        eventually reduced to the given paths.  If 'until' is not given,
+        return the statistics of the commit 'since'.
         """
-        if until is None:
-            cmd = ['git', 'show', '--pretty=format:', '--stat', since]
-            data = self._call(cmd)
-            return data[1:]
-
-        cmd = ['git', 'diff', '--stat', '%s..%s' % (since, until)]
-        if paths:
-            cmd.append('--')
-            cmd.extend(paths)
-        return self._call(cmd)
+        return format_stats(self.get_changes(since, until, paths))
 
 
     def get_files_changed(self, since, until):
-        """Return the files that have been changed between two commits.
-
-        TODO Implement with libgit2
+        """Return the files that have been changed by the commits between
+        'since' (excluded) and 'until'.
         """
-        expr = '%s..%s' % (since, until)
-        cmd = ['git', 'show', '--numstat', '--pretty=format:', expr]
-        data = self._call(cmd)
-        lines = data.splitlines()
-        return frozenset([ line.split('\t')[-1] for line in lines if line ])
+        repo = self.repo
+        walker = repo.walk(self._get_commit(until).oid, GIT_SORT_TIME)
+        walker.hide(self._get_commit(since).oid)
+
+        files = set()
+        for commit in walker:
+            for patch in self._get_diff(commit.hex):
+                files.add(patch.delta.new_file.path)
+        return frozenset(files)
 
 
     def get_metadata(self, reference='HEAD'):
@@ -515,7 +868,7 @@ class Worktree(object):
 
 
 
-def open_worktree(path, init=False, soft=False):
+def open_worktree(path, init=False, soft=False, **kw):
     try:
         if init:
             repo = init_repository(path, False)
@@ -526,4 +879,4 @@ def open_worktree(path, init=False, soft=False):
             return None
         raise
 
-    return Worktree(path, repo)
+    return Worktree(path, repo, **kw)
@@ -0,0 +1,255 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module implements an index of the history of every path in a Git
+repository (the list of commits that changed it), to answer 'git log' with
+paths without walking every commit.
+"""
+
+# Import from the Standard Library
+import anydbm
+from binascii import hexlify
+from bisect import insort
+from glob import glob
+from heapq import merge
+from os import remove
+from struct import Struct
+
+# Import from pygit2
+from pygit2 import GIT_FILEMODE_TREE, GIT_SORT_REVERSE, GIT_SORT_TOPOLOGICAL
+from pygit2 import Oid
+
+
+# An entry is the time of the commit, its sequence number (its position in
+# the index) and its oid (raw); the entries of a path are kept sorted, so
+# the histories of several paths are merged lazily, the most recent first
+entry_struct = Struct('>II20s')
+entry_size = entry_struct.size
+# The entries of a path are split in chunks, so appending an entry does not
+# rewrite the whole history of the path
+chunk_size = 256
+# Incremented when the format changes, the index is then rebuilt
+version = '2'
+
+
+
+def get_changed_paths(repo, tree, parent, base=''):
+    """Yields the paths that differ between the two given trees (either of
+    them may be None), files and folders.  The sub-trees that have not
+    changed are not traversed.
+    """
+    old = {}
+    if parent is not None:
+        for entry in parent:
+            old[entry.name] = entry
+
+    new = tree if tree is not None else []
+    for entry in new:
+        name = entry.name
+        old_entry = old.pop(name, None)
+        if old_entry is not None and old_entry.oid == entry.oid:
+            continue
+
+        path = base + name
+        yield path
+        # Go down
+        a = entry.filemode == GIT_FILEMODE_TREE
+        b = old_entry is not None and old_entry.filemode == GIT_FILEMODE_TREE
+        if a or b:
+            a = repo[entry.oid] if a else None
+            b = repo[old_entry.oid] if b else None
+            for path in get_changed_paths(repo, a, b, path + '/'):
+                yield path
+
+    # Removed
+    for name, entry in old.iteritems():
+        path = base + name
+        yield path
+        if entry.filemode == GIT_FILEMODE_TREE:
+            b = repo[entry.oid]
+            for path in get_changed_paths(repo, None, b, path + '/'):
+                yield path
+
+
+
+def get_value(db, key, default=None):
+    # Not every dbm module implements 'get'
+    try:
+        return db[key]
+    except KeyError:
+        return default
+
+
+
+class HistoryIndex(object):
+    """A mapping from path to the commits that changed it (the path or,
+    for folders, something inside), as 'git log -- <path>' would list them:
+    a commit changes a path if the object at the path differs from that of
+    its first parent.
+
+    The index is stored in a dbm file, it knows the last commit indexed (the
+    head), so it can be updated incrementally.  It is only used when its
+    head is the commit we want the log from.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def _open(self, flag='r'):
+        return anydbm.open(self.path, flag)
+
+
+    def exists(self):
+        return len(glob('%s*' % self.path)) > 0
+
+
+    def create(self):
+        """Creates the index, empty.  It will be filled by 'update'.
+        """
+        db = self._open('c')
+        db['\0version'] = version
+        db.close()
+
+
+    def get_commits(self, paths, head):
+        """Returns an iterator over the oids (hex) of the commits that
+        changed any of the given paths, the most recent first.
+
+        Returns None if the index is not available (it does not exist, or
+        it is being written), or if its head is not the given one (hex).
+        """
+        try:
+            db = self._open()
+        except anydbm.error:
+            return None
+
+        if get_value(db, '\0version') != version:
+            db.close()
+            return None
+        if get_value(db, '\0head') != head:
+            db.close()
+            return None
+
+        return self._get_commits(db, paths)
+
+
+    def _get_commits(self, db, paths):
+        try:
+            histories = [ self._get_history(db, path) for path in paths ]
+            last = None
+            for time, seq, oid in merge(*histories):
+                if seq != last:
+                    last = seq
+                    yield hexlify(oid)
+        finally:
+            db.close()
+
+
+    def _get_history(self, db, path):
+        # Yields (-time, -seq, oid), the most recent first
+        n = int(get_value(db, path, 0))
+        for chunk in range((n - 1) / chunk_size, -1, -1):
+            data = db['%s\0%d' % (path, chunk)]
+            for i in range(len(data) - entry_size, -1, -entry_size):
+                time, seq, oid = entry_struct.unpack_from(data, i)
+                yield -time, -seq, oid
+
+
+    def _append(self, db, path, entry):
+        n = int(get_value(db, path, 0))
+        chunk = (n - 1) / chunk_size
+        data = db['%s\0%d' % (path, chunk)] if n else ''
+        # Commonly the entry is the most recent
+        if data[-entry_size:-20] < entry[:-20]:
+            if n % chunk_size:
+                db['%s\0%d' % (path, chunk)] = data + entry
+            else:
+                db['%s\0%d' % (path, n / chunk_size)] = entry
+            db[path] = str(n + 1)
+            return
+
+        # Otherwise (the commits of a branch merged) the chunks with more
+        # recent entries are rewritten
+        tail = [data]
+        while chunk > 0 and data[:entry_size - 20] > entry[:-20]:
+            chunk -= 1
+            data = db['%s\0%d' % (path, chunk)]
+            tail.append(data)
+        tail.reverse()
+        data = ''.join(tail)
+        entries = [ data[i:i + entry_size]
+                    for i in range(0, len(data), entry_size) ]
+        insort(entries, entry)
+        data = ''.join(entries)
+        step = chunk_size * entry_size
+        for i in range(0, len(data), step):
+            db['%s\0%d' % (path, chunk)] = data[i:i + step]
+            chunk += 1
+        db[path] = str(n + 1)
+
+
+    def update(self, repo, head):
+        """Indexes the commits reachable from the given head (a commit
+        object) but not from the last one indexed.  If the last commit
+        indexed is not an ancestor of the head (after a reset for instance),
+        or if the format of the index has changed, the index is rebuilt.
+        """
+        db = self._open('c')
+        try:
+            last = get_value(db, '\0head')
+            if last == head.hex:
+                return
+
+            # The commits to index (those not reachable from the last one
+            # indexed), oldest first
+            walker = repo.walk(head.oid,
+                               GIT_SORT_TOPOLOGICAL | GIT_SORT_REVERSE)
+            if get_value(db, '\0version') != version:
+                last = None
+            elif last is not None:
+                last = Oid(hex=last)
+                if last in repo and repo.merge_base(last, head.oid) == last:
+                    walker.hide(last)
+                else:
+                    last = None
+            if last is None:
+                # Rebuild
+                db.close()
+                self.remove()
+                db = self._open('c')
+                db['\0version'] = version
+
+            # Index
+            seq = int(get_value(db, '\0seq', 0))
+            for commit in walker:
+                parents = commit.parents
+                parent = parents[0].tree if parents else None
+                entry = entry_struct.pack(commit.commit_time, seq,
+                                          commit.oid.raw)
+                for path in get_changed_paths(repo, commit.tree, parent):
+                    self._append(db, path, entry)
+                seq += 1
+            db['\0seq'] = str(seq)
+            db['\0head'] = head.hex
+        finally:
+            db.close()
+
+
+    def remove(self):
+        for path in glob('%s*' % self.path):
+            remove(path)
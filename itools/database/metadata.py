@@ -15,6 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from the Standard Library
+from marshal import dumps, loads
+from sys import getsizeof
+
 # Import from itools
 from itools.core import add_type, freeze
 from itools.datatypes import String
@@ -22,6 +26,7 @@ from itools.handlers import File, register_handler_class
 from itools.log import log_warning
 
 # Import from here
+from blobcache import get_blob_oid
 from fields import Field
 from metadata_parser import parse_table, MetadataProperty, property_to_str
 from metadata_parser import deserialize_parameters
@@ -43,6 +48,10 @@ class Metadata(File):
     class_mimetypes = ['text/x-metadata']
     class_extension = 'metadata'
 
+    # The version of the parsed state kept in the shared cache (see
+    # '_parse'), to increment whenever the output of 'parse_table' changes
+    cache_version = 1
+
 
     def reset(self):
         self.format = None
@@ -55,10 +64,26 @@ class Metadata(File):
         self.version = version or cls.class_version
 
 
+    def _parse(self, data):
+        # Use the shared cache, if any
+        blob_cache = getattr(self.database, 'blob_cache', None)
+        if blob_cache is None:
+            return parse_table(data)
+
+        oid = get_blob_oid(data)
+        table = blob_cache.get(oid)
+        if table is not None:
+            return iter(loads(table))
+
+        table = list(parse_table(data))
+        blob_cache.set(oid, dumps(table))
+        return iter(table)
+
+
     def _load_state_from_file(self, file):
         properties = self.properties
         data = file.read()
-        parser = parse_table(data)
+        parser = self._parse(data)
 
         # Read the format & version
         name, value, parameters = parser.next()
@@ -174,6 +199,40 @@ class Metadata(File):
         return ''.join(lines)
 
 
+    def get_sizeof(self):
+        # The generic implementation would follow the datatypes, so here we
+        # only count the properties, the raw values and the decoded values
+        if self.timestamp is None and self.dirty is None:
+            return None
+
+        properties = self.properties
+        size = getsizeof(self.__dict__) + getsizeof(properties)
+        for property in properties.itervalues():
+            p_type = type(property)
+            if p_type is dict:
+                size += getsizeof(property)
+                property = property.itervalues()
+            elif p_type is list:
+                size += getsizeof(property)
+            else:
+                property = [property]
+
+            for x in property:
+                size += getsizeof(x) + getsizeof(x.__dict__)
+                size += getsizeof(x.raw_value)
+                value = x.__dict__.get('value')
+                if value is not None and value is not x.raw_value:
+                    size += getsizeof(value)
+                if x.parameters:
+                    size += getsizeof(x.parameters)
+                    for values in x.parameters.itervalues():
+                        size += getsizeof(values)
+                        if type(values) is list:
+                            size += sum([ getsizeof(y) for y in values ])
+
+        return size
+
+
     ########################################################################
     # API
     ########################################################################
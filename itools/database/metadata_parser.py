@@ -22,6 +22,7 @@
 
 # Import from the Standard Library
 from copy import deepcopy
+from re import compile, escape, DOTALL
 
 # Import from itools
 from itools.core import lazy
@@ -36,16 +37,29 @@ escape_table = (
     ('\n', r'\n'))
 
 
+unescape_cache = {}
+
 def unescape_data(data, escape_table=escape_table):
     """Unescape the data
     """
-    out = []
-    for segment in data.split(r"\\"):
+    # Nothing to do
+    if '\\' not in data:
+        return data
+
+    # Build the regular expression for the given table, all the escape
+    # sequences start by a backslash, scanned from left to right
+    unescape = unescape_cache.get(escape_table)
+    if unescape is None:
+        unescape_map = {r'\\': '\\'}
         for c, c_escaped in escape_table:
-            segment = segment.replace(c_escaped, c)
-        out.append(segment)
+            unescape_map[c_escaped] = c
+        regexp = [ escape(x) for x in unescape_map ]
+        regexp = compile('|'.join(regexp))
+        unescape = regexp, unescape_map
+        unescape_cache[escape_table] = unescape
 
-    return '\\'.join(out)
+    regexp, unescape_map = unescape
+    return regexp.sub(lambda x: unescape_map[x.group(0)], data)
 
 
 
@@ -259,6 +273,41 @@ def get_tokens(property):
 
 
 
+# The fast path: the same grammar as 'read_name' and 'get_tokens', written
+# as regular expressions.  The lines that do not match (syntax errors) go
+# through the slow path, which will raise the appropriate error.
+name_expr = r'[a-zA-Z0-9-][a-zA-Z0-9_.@-]*'
+param_name_expr = r'[a-zA-Z0-9-][a-zA-Z0-9_-]*'
+param_value_expr = r'(?:"(?:[^"\\]|\\.)*"|[^";:,]*)'
+param_expr = r';(%s)=(%s(?:,%s)*)' % (param_name_expr, param_value_expr,
+                                       param_value_expr)
+line_expr = r'(?P<name>%s)(?P<params>(?:%s)*):(?P<value>.*)\Z' % (
+    name_expr, param_expr)
+line_match = compile(line_expr, DOTALL).match
+param_finditer = compile(param_expr, DOTALL).finditer
+param_value_match = compile(r'"((?:[^"\\]|\\.)*)"|([^";:,]*)', DOTALL).match
+
+
+def get_param_values(data):
+    # Common case: no quoted value
+    if '"' not in data:
+        return data.split(',')
+
+    values = []
+    idx = 0
+    n = len(data)
+    while True:
+        match = param_value_match(data, idx)
+        quoted, value = match.groups()
+        values.append(value if quoted is None else quoted)
+        idx = match.end()
+        if idx == n:
+            return values
+        # Skip the comma
+        idx += 1
+
+
+
 def parse_table(data):
     """This is the public interface of the module "itools.ical.parser", a
     low-level parser of iCalendar files.
@@ -272,10 +321,23 @@ def parse_table(data):
     are byte strings.
     """
     for line in unfold_lines(data):
-        name, line = read_name(line)
-        # Read the parameters and the property value
-        value, parameters = get_tokens(line)
-        yield name, value, parameters
+        match = line_match(line)
+        # Slow path
+        if match is None:
+            name, line = read_name(line)
+            # Read the parameters and the property value
+            value, parameters = get_tokens(line)
+            yield name, value, parameters
+            continue
+
+        # Fast path
+        name, params, value = match.group('name', 'params', 'value')
+        parameters = {}
+        if params:
+            for param in param_finditer(params):
+                param_name, param_values = param.groups()
+                parameters[param_name] = get_param_values(param_values)
+        yield name, unescape_data(value), parameters
 
 
 
@@ -181,6 +181,69 @@ class TextQuery(BaseQuery):
 
 
 
+############################################################################
+# Canonical form
+############################################################################
+def _freeze_value(value):
+    value_type = type(value)
+    if value_type in (list, tuple, set, frozenset):
+        return value_type, tuple([ _freeze_value(x) for x in value ])
+    if value_type is dict:
+        items = [ (k, _freeze_value(v)) for k, v in value.iteritems() ]
+        items.sort()
+        return value_type, tuple(items)
+    # Will raise TypeError if not hashable
+    hash(value)
+    return value_type, value
+
+
+
+def get_query_key(query):
+    """Returns a canonical and hashable form of the given query, such that
+    two equivalent queries return the same key (for instance the order of
+    the atoms of 'and' and 'or' queries does not matter).  This is used to
+    cache the results of searches.
+
+    Returns None if the query is not supported (then it cannot be cached).
+    """
+    query_class = type(query)
+    if query_class is AllQuery:
+        return ('all',)
+
+    try:
+        if query_class is PhraseQuery:
+            return ('phrase', query.name, _freeze_value(query.value))
+        if query_class is RangeQuery:
+            return ('range', query.name, _freeze_value(query.left),
+                    _freeze_value(query.right))
+        if query_class is StartQuery:
+            return ('start', query.name, _freeze_value(query.value))
+        if query_class is TextQuery:
+            return ('text', query.name, _freeze_value(query.value))
+    except TypeError:
+        return None
+
+    if query_class is NotQuery:
+        key = get_query_key(query.query)
+        return None if key is None else ('not', key)
+
+    if query_class in (_AndQuery, _OrQuery):
+        atoms = query.atoms
+        if len(atoms) == 1:
+            return get_query_key(atoms[0])
+        keys = []
+        for atom in atoms:
+            key = get_query_key(atom)
+            if key is None:
+                return None
+            keys.append(key)
+        operator = 'and' if query_class is _AndQuery else 'or'
+        return (operator, frozenset(keys))
+
+    return None
+
+
+
 class QueryPrinter(PrettyPrinter):
 
     def _format(self, query, stream, indent, allowance, context, level):
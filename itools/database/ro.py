@@ -25,12 +25,13 @@ from sys import getrefcount
 from xapian import DatabaseError, DatabaseOpeningError
 
 # Import from itools
-from itools.core import LRUCache, lazy
+from itools.core import LRUCache, SizedLRUCache, lazy
 from itools.fs import lfs
 from itools.handlers import Folder, get_handler_class_by_mimetype
 from itools.log import log_warning
 from itools.uri import Path
-from catalog import Catalog, _get_xquery, SearchResults
+from blobcache import BlobCache
+from catalog import Catalog, _get_key_and_xquery, SearchResults
 from git import open_worktree
 from magic_ import magic_from_file
 from metadata import Metadata
@@ -44,9 +45,26 @@ class ReadonlyError(StandardError):
 
 
 
+def get_handler_kind(handler):
+    """The handlers in the cache are of two kinds, each one with its own
+    memory budget: the metadata, and the other files (blobs).
+    """
+    if isinstance(handler, Metadata):
+        return 'metadata'
+    return 'blob'
+
+
+
+def get_handler_sizeof(handler):
+    return handler.get_sizeof()
+
+
+
 class RODatabase(object):
 
-    def __init__(self, path, size_min=4800, size_max=5200):
+    def __init__(self, path, size_min=4800, size_max=5200,
+                 metadata_max_bytes=None, blobs_max_bytes=None,
+                 shared_cache=False):
         # 1. Keep the path
         if not lfs.is_folder(path):
             error = '"%s" should be a folder, but it is not' % path
@@ -64,15 +82,47 @@ class RODatabase(object):
         # 3. Initialize the database, but chrooted
         self.fs = lfs.open(self.path_data)
 
-        # 4. New interface to Git
+        # 4. New interface to Git, and the commit we see (see 'sync'); the
+        # generation is incremented every time we see a new commit, the
+        # caches built from the database use it to know they are outdated
         self.worktree = open_worktree(self.path_data)
-
-        # 5. A mapping from key to handler
-        self.cache = LRUCache(size_min, size_max, automatic=False)
+        self.head = self.worktree._resolve_reference('HEAD')
+        self.generation = 0
+
+        # 5. A mapping from key to handler, bounded by the number of
+        # handlers, and optionally by the memory used by the metadata and by
+        # the other files
+        budgets = {}
+        if metadata_max_bytes is not None:
+            budgets['metadata'] = metadata_max_bytes
+        if blobs_max_bytes is not None:
+            budgets['blob'] = blobs_max_bytes
+        self.cache = SizedLRUCache(size_min, size_max, automatic=False,
+                                   budgets=budgets,
+                                   get_kind=get_handler_kind,
+                                   get_sizeof=get_handler_sizeof)
+        # Cache statistics (see 'get_cache_stats')
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_skipped = 0
 
         # 6. The git cache
         self.git_cache = LRUCache(900, 1100)
 
+        # 7. The cache of parsed handlers shared by all processes (optional),
+        # in the 'cache/v<version>' folder, so a new version of the parser
+        # does not use the parses of the old one (the folders of the old
+        # versions may be removed); 'shared_cache' is True for the default
+        # size, or the maximum size in bytes
+        if shared_cache:
+            path = '%s/cache/v%d' % (self.path, Metadata.cache_version)
+            if shared_cache is True:
+                self.blob_cache = BlobCache(path)
+            else:
+                self.blob_cache = BlobCache(path, shared_cache)
+        else:
+            self.blob_cache = None
+
 
     #######################################################################
     # Private API
@@ -132,37 +182,78 @@ class RODatabase(object):
 
 
     def make_room(self):
-        """Remove handlers from the cache until it fits the defined size.
+        """Remove handlers from the cache until it fits the defined size, and
+        the memory budgets.
 
         Use with caution. If the handlers we are about to discard are still
         used outside the database, and one of them (or more) are modified, then
         there will be an error.
         """
+        cache = self.cache
+
         # Find out how many handlers should be removed
-        size = len(self.cache)
-        if size < self.cache.size_max:
+        size = len(cache)
+        n = size - cache.size_min if size >= cache.size_max else 0
+        # And how many bytes
+        cache.update_sizes()
+        overflow = cache.get_overflow()
+        if n <= 0 and not overflow:
             return
 
         # Discard as many handlers as needed
-        n = size - self.cache.size_min
-        for key, handler in self.cache.iteritems():
+        sizes = cache.sizes
+        for key, handler in cache.iteritems():
+            kind, size = sizes[key]
+            if n <= 0 and kind not in overflow:
+                continue
             # Skip externally referenced handlers (refcount should be 3:
             # one for the cache, one for the local variable and one for
             # the argument passed to getrefcount).
             refcount = getrefcount(handler)
             if refcount > 3:
+                self.cache_skipped += 1
                 continue
             # Skip modified (not new) handlers
             if handler.dirty is not None:
+                self.cache_skipped += 1
                 continue
             # Discard this handler
             self._discard_handler(key)
+            cache.evictions += 1
             # Check whether we are done
             n -= 1
-            if n == 0:
+            if kind in overflow:
+                overflow[kind] -= size
+                if overflow[kind] <= 0:
+                    del overflow[kind]
+            if n <= 0 and not overflow:
                 return
 
 
+    def get_cache_stats(self):
+        """Returns a dict with the state of the handlers cache: the number of
+        handlers, the memory used by the metadata and by the other files
+        (blobs), and the counters of hits, misses, evictions and pinned
+        handlers skipped when making room (those externally referenced or
+        modified).  With the shared cache, also its hits and misses.
+        """
+        cache = self.cache
+        cache.update_sizes()
+        stats = {
+            'handlers': len(cache),
+            'metadata_bytes': cache.bytes.get('metadata', 0),
+            'blobs_bytes': cache.bytes.get('blob', 0),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': cache.evictions,
+            'skipped_pinned': self.cache_skipped}
+        blob_cache = self.blob_cache
+        if blob_cache is not None:
+            stats['shared_hits'] = blob_cache.hits
+            stats['shared_misses'] = blob_cache.misses
+        return stats
+
+
     def has_handler(self, key):
         key = self.normalize_key(key)
 
@@ -211,6 +302,7 @@ class RODatabase(object):
                 raise LookupError, error % (cls, handler.__class__)
             # Cache hit
             self.cache.touch(key)
+            self.cache_hits += 1
             return handler
 
         # Check the resource exists
@@ -224,6 +316,7 @@ class RODatabase(object):
             return Folder(key, database=self)
 
         # Cache miss
+        self.cache_misses += 1
         if cls is None:
             cls = self.get_handler_class(key)
         # Build the handler and update the cache
@@ -409,6 +502,36 @@ class RODatabase(object):
         return handler.timestamp is None and handler.dirty is not None
 
 
+    def sync(self):
+        """To see the changes committed by another process (the writer of
+        a prefork server), the handlers changed since the last commit we
+        saw are discarded and the catalog reopened.  Returns whether there
+        were changes.
+        """
+        head = self.worktree._resolve_reference('HEAD')
+        if head == self.head:
+            return False
+
+        old, self.head = self.head, head
+        self.generation += 1
+        if old is None or head is None:
+            # First commit, or no commit at all: drop everything
+            for key in self.cache.keys():
+                self._discard_handler(key)
+        else:
+            cache = self.cache
+            for patch in self.worktree._get_diff(old.hex, head.hex):
+                delta = patch.delta
+                for key in delta.old_file.path, delta.new_file.path:
+                    if key in cache:
+                        self._discard_handler(key)
+
+        catalog = self.__dict__.get('catalog')
+        if catalog is not None:
+            catalog.reopen()
+        return True
+
+
     #######################################################################
     # Git
     #######################################################################
@@ -448,9 +571,9 @@ class RODatabase(object):
     def search(self, query=None, **kw):
         """Launch a search in the catalog.
         """
-        xquery = _get_xquery(self.catalog, query, **kw)
-        return SearchResults(self, xquery)
+        key, xquery = _get_key_and_xquery(self.catalog, query, **kw)
+        return SearchResults(self, xquery, key)
 
 
-    def reindex_catalog(self, base_abspath, recursif=True):
+    def reindex_catalog(self, base_abspath, recursif=True, batch_size=1000):
         raise ReadonlyError
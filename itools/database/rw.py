@@ -22,20 +22,28 @@
 from datetime import datetime
 import fnmatch
 from heapq import heappush, heappop
+from multiprocessing import Manager, Pool, cpu_count
+from os import lstat
 from os.path import dirname
+from tempfile import mkdtemp
+from time import time
+
+# Import from xapian
+from xapian import WritableDatabase, DB_CREATE
 
 # Import from pygit2
 import pygit2
-from pygit2 import TreeBuilder, GIT_FILEMODE_TREE
+from pygit2 import TreeBuilder
+from pygit2 import GIT_FILEMODE_BLOB, GIT_FILEMODE_TREE
 from pygit2 import GIT_CHECKOUT_FORCE, GIT_CHECKOUT_REMOVE_UNTRACKED
 
 # Import from itools
 from itools.core import get_pipe, lazy
 from itools.fs import lfs
 from itools.handlers import Folder
-from itools.log import log_error
-from catalog import Catalog, make_catalog
-from git import open_worktree
+from itools.log import log_debug, log_error
+from catalog import Catalog, make_catalog, merge_catalogs
+from git import open_worktree, StatIndexEntry
 from registry import get_register_fields
 from ro import RODatabase
 
@@ -43,6 +51,43 @@ from ro import RODatabase
 
 MSG_URI_IS_BUSY = 'The "%s" URI is busy.'
 
+# The phases of a commit, see 'RWDatabase.commit_timings'
+commit_phases = ('save_state', 'add', 'tree', 'commit', 'catalog')
+
+
+
+def get_tree(repo, trees, path):
+    """Returns the tree object at the given path, or None if there is not
+    such a tree.  The 'trees' dict is used as a cache, it must be initialized
+    with the root tree (for the empty path).
+    """
+    tree = trees.get(path, False)
+    if tree is not False:
+        return tree
+
+    # Split the path
+    if '/' in path:
+        parent, name = path.rsplit('/', 1)
+    else:
+        parent = ''
+        name = path
+
+    # Look in the parent tree
+    tree = get_tree(repo, trees, parent)
+    if tree is not None:
+        try:
+            entry = tree[name]
+        except KeyError:
+            tree = None
+        else:
+            if entry.filemode == GIT_FILEMODE_TREE:
+                tree = repo[entry.oid]
+            else:
+                tree = None
+
+    trees[path] = tree
+    return tree
+
 
 
 class Heap(object):
@@ -96,14 +141,24 @@ class Heap(object):
 
 class RWDatabase(RODatabase):
 
-    def __init__(self, path, size_min, size_max):
-        super(RWDatabase, self).__init__(path, size_min, size_max)
+    # The class of the databases the workers of 'rebuild_catalog' open, to
+    # read the resources (by default the class of this database)
+    shard_database_cls = None
+
+
+    def __init__(self, path, size_min, size_max, metadata_max_bytes=None,
+                 blobs_max_bytes=None, shared_cache=False):
+        super(RWDatabase, self).__init__(path, size_min, size_max,
+                                         metadata_max_bytes, blobs_max_bytes,
+                                         shared_cache)
 
         # The "git add" arguments
         self.added = set()
         self.changed = set()
         self.removed = set()
         self.has_changed = False
+        # The time spent by every phase of the last commit (in seconds)
+        self.commit_timings = {}
 
         # The resources that been added, removed, changed and moved can be
         # represented as a set of two element tuples.  But we implement this
@@ -492,6 +547,7 @@ class RWDatabase(RODatabase):
             self._discard_handler(key)
         for key in self.changed:
             cache[key].abort_changes()
+            cache.resize(key)
 
         # 2. Git
         strategy = GIT_CHECKOUT_FORCE | GIT_CHECKOUT_REMOVE_UNTRACKED
@@ -532,44 +588,90 @@ class RWDatabase(RODatabase):
         return None, None, None, [], []
 
 
+    def _save_handler(self, key, handler):
+        """Saves the handler to the filesystem (see 'File.save_state'), and
+        writes the same data to the git object database.  Returns the index
+        entry of the blob, or None if the handler does not return the data
+        saved (then the file is added from the filesystem).
+        """
+        data = handler.save_state()
+        if data is None:
+            return None
+
+        oid = self.worktree.repo.create_blob(data)
+        stat = lstat('%s%s' % (self.path_data, key))
+        return StatIndexEntry(key, oid, GIT_FILEMODE_BLOB, stat)
+
+
     def _save_changes(self, data):
         worktree = self.worktree
+        timings = self.commit_timings = {}
+        t0 = time()
 
-        # 1. Synchronize the handlers and the filesystem
+        # 1. Synchronize the handlers and the filesystem.  The blobs of the
+        # modified handlers are written straight from their data, other
+        # files (moved for instance) will be added from the filesystem.
+        cache = self.cache
+        blobs = {}
+        git_add = []
         added = self.added
         for key in added:
-            handler = self.cache.get(key)
+            handler = cache.get(key)
+            entry = None
             if handler and handler.dirty:
                 parent_path = dirname(key)
                 if not self.fs.exists(parent_path):
                     self.fs.make_folder(parent_path)
-                handler.save_state()
+                entry = self._save_handler(key, handler)
+                cache.resize(key)
+            if entry is None:
+                git_add.append(key)
+            else:
+                blobs[key] = entry
 
         changed = self.changed
         for key in changed:
-            handler = self.cache[key]
-            handler.save_state()
+            handler = cache[key]
+            entry = None
+            if handler.dirty:
+                entry = self._save_handler(key, handler)
+                cache.resize(key)
+            if entry is None:
+                git_add.append(key)
+            else:
+                blobs[key] = entry
+
+        t1 = time()
+        timings['save_state'] = t1 - t0
 
         # 2. Build the 'git commit' command
         git_author, git_date, git_msg, docs_to_index, docs_to_unindex = data
         git_msg = git_msg or 'no comment'
 
-        # 3. Git add
-        git_add = list(added) + list(changed)
+        # 3. Git add (the blobs we already have are added to the index in
+        # memory, without reading the files back)
+        index = worktree.index
+        for entry in blobs.itervalues():
+            index.add(entry)
         worktree.git_add(*git_add)
 
+        t2 = time()
+        timings['add'] = t2 - t1
+
         # 4. Create the tree
         repo = worktree.repo
-        index = repo.index
         try:
             head = repo.revparse_single('HEAD')
         except KeyError:
             git_tree = None
         else:
             root = head.tree
+            trees = {'': root}
             # Initialize the heap
             heap = Heap()
             heap[''] = repo.TreeBuilder(root)
+            for key, entry in blobs.iteritems():
+                heap[key] = (entry.oid, entry.mode)
             for key in git_add:
                 entry = index[key]
                 heap[key] = (entry.oid, entry.mode)
@@ -600,12 +702,10 @@ class RWDatabase(RODatabase):
                 # Get the tree builder
                 tb = heap.get(parent)
                 if tb is None:
-                    try:
-                        tentry = root[parent]
-                    except KeyError:
+                    tree = get_tree(repo, trees, parent)
+                    if tree is None:
                         tb = repo.TreeBuilder()
                     else:
-                        tree = repo[tentry.oid]
                         tb = repo.TreeBuilder(tree)
                     heap[parent] = tb
 
@@ -619,14 +719,22 @@ class RWDatabase(RODatabase):
                 else:
                     tb.insert(name, value[0], value[1])
 
+        t3 = time()
+        timings['tree'] = t3 - t2
+
         # 5. Git commit
         worktree.git_commit(git_msg, git_author, git_date, tree=git_tree)
+        if worktree.history.exists():
+            worktree.update_history()
 
         # 6. Clear state
         changed.clear()
         added.clear()
         self.removed.clear()
 
+        t4 = time()
+        timings['commit'] = t4 - t3
+
         # 7. Catalog
         catalog = self.catalog
         for path in docs_to_unindex:
@@ -635,6 +743,12 @@ class RWDatabase(RODatabase):
             catalog.index_document(values)
         catalog.save_changes()
 
+        timings['catalog'] = time() - t4
+        phases = [ '%s %.3fs' % (x, timings[x]) for x in commit_phases ]
+        message = 'commit of %d files: %s' % (len(blobs) + len(git_add),
+                                              ', '.join(phases))
+        log_debug(message, domain='itools.database')
+
 
     def save_changes(self):
         if not self.has_changed:
@@ -663,6 +777,8 @@ class RWDatabase(RODatabase):
             except Exception:
                 log_error('Aborting failed', domain='itools.database')
             raise
+        else:
+            self.generation += 1
         finally:
             self._cleanup()
 
@@ -690,7 +806,7 @@ class RWDatabase(RODatabase):
             raise
 
 
-    def reindex_catalog(self, base_abspath, recursif=True):
+    def reindex_catalog(self, base_abspath, recursif=True, batch_size=1000):
         """Reindex the catalog & return nb resources re-indexed
         """
         catalog = self.catalog
@@ -700,11 +816,13 @@ class RWDatabase(RODatabase):
         n = 0
         # Recursif ?
         if recursif:
-            for item in base_resource.traverse_resources():
-                catalog.unindex_document(str(item.abspath))
-                values = item.get_catalog_values()
-                catalog.index_document(values)
-                n += 1
+            # The values are computed as they are indexed, and the catalog
+            # is written by batches
+            def get_values():
+                for item in base_resource.traverse_resources():
+                    catalog.unindex_document(str(item.abspath))
+                    yield item.get_catalog_values()
+            n = catalog.index_documents(get_values(), batch_size)
         else:
             # Reindex resource
             catalog.unindex_document(base_abspath)
@@ -718,6 +836,136 @@ class RWDatabase(RODatabase):
         return n
 
 
+    def rebuild_catalog(self, processes=None, batch_size=1000):
+        """Rebuild the catalog from scratch, in parallel.  Returns the number
+        of resources indexed.
+
+        The resources (one per metadata file) are split across a pool of
+        'processes' worker processes (by default one per CPU).  Every worker
+        opens the database (see 'shard_database_cls'), and indexes its share
+        of resources into its own temporary catalog (a shard).  Then the
+        shards are merged into the new catalog, which replaces the current
+        one.
+
+        Pending changes must have been saved before calling this method.
+        """
+        if self.has_changed:
+            raise RuntimeError, 'cannot rebuild the catalog, save changes first'
+
+        # 1. The resources to index
+        abspaths = [ '/%s' % path[:-9] for path in self.worktree.walk()
+                     if path[-9:] == '.metadata' ]
+
+        # 2. Index, every worker writes its own shard
+        if processes is None:
+            processes = cpu_count()
+        tmp = mkdtemp(dir=self.path)
+        shards = [ '%s/shard-%d' % (tmp, i) for i in range(processes) ]
+        database_cls = self.shard_database_cls or type(self)
+        jobs = [
+            (database_cls, self.path, self.cache.size_min, self.cache.size_max,
+             self.blob_cache is not None, shard, abspaths[i::processes],
+             batch_size)
+            for i, shard in enumerate(shards) ]
+
+        target = '%s/catalog' % tmp
+        manager = Manager()
+        shared = (manager.dict(), manager.Lock())
+        pool = Pool(processes, _init_shard_worker, shared)
+        try:
+            try:
+                n = sum(pool.map(_index_shard, jobs))
+                pool.close()
+            except Exception:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                manager.shutdown()
+
+            # 3. Merge the shards
+            merge_catalogs(shards, target)
+        except Exception:
+            lfs.remove(tmp)
+            raise
+
+        # 4. Replace the catalog
+        if 'catalog' in self.__dict__:
+            self.catalog.close()
+        path = '%s/catalog' % self.path
+        if lfs.exists(path):
+            lfs.move(path, '%s/old' % tmp)
+        lfs.move(target, path)
+        lfs.remove(tmp)
+        self.catalog = Catalog(path, get_register_fields())
+
+        # Ok
+        return n
+
+
+
+###########################################################################
+# Parallel indexing (see RWDatabase.rebuild_catalog)
+###########################################################################
+class ShardCatalog(Catalog):
+    """A catalog used to index a shard.  The field informations (value slots
+    and prefixes) are allocated from a mapping shared by all the shards, so
+    they can be merged.
+    """
+
+    def __init__(self, ref, fields, shared_metadata, lock):
+        self._shared_metadata = shared_metadata
+        self._lock = lock
+        super(ShardCatalog, self).__init__(ref, fields)
+
+
+    def _get_info(self, field_cls, name):
+        shared = self._shared_metadata
+        with self._lock:
+            info = shared.get(name)
+            if info is None:
+                infos = shared.values()
+                self._value_nb = len([ x for x in infos if 'value' in x ])
+                self._prefix_nb = len([ x for x in infos if 'prefix' in x ])
+                get_info = super(ShardCatalog, self)._get_info
+                info = get_info(field_cls, name)
+                shared[name] = info
+
+        return dict(info)
+
+
+
+_shard_worker_state = None
+
+def _init_shard_worker(shared_metadata, lock):
+    global _shard_worker_state
+    _shard_worker_state = shared_metadata, lock
+
+
+
+def _index_shard(job):
+    database_cls, path, size_min, size_max, shared_cache, shard, abspaths, \
+        batch_size = job
+    shared_metadata, lock = _shard_worker_state
+
+    database = database_cls(path, size_min, size_max,
+                            shared_cache=shared_cache)
+    db = WritableDatabase(shard, DB_CREATE)
+    catalog = ShardCatalog(db, get_register_fields(), shared_metadata, lock)
+
+    def get_values():
+        for abspath in abspaths:
+            resource = database.get_resource(abspath, soft=True)
+            if resource is not None:
+                yield resource.get_catalog_values()
+            database.make_room()
+
+    n = catalog.index_documents(get_values(), batch_size)
+    catalog.close()
+    return n
+
+
+
 def make_git_database(path, size_min, size_max, fields=None):
     """Create a new empty Git database if the given path does not exists or
     is a folder.
@@ -728,7 +976,8 @@ def make_git_database(path, size_min, size_max, fields=None):
     """
     path = lfs.get_absolute_path(path)
     # Git init
-    open_worktree('%s/database' % path, init=True)
+    worktree = open_worktree('%s/database' % path, init=True)
+    worktree.history.create()
     # The catalog
     if fields is None:
         fields = get_register_fields()
@@ -24,6 +24,7 @@ from datetime import datetime
 from sys import exc_info
 
 # Import from itools
+from itools.core import get_sizeof
 from itools.fs import vfs
 from base import Handler
 from registry import register_handler_class
@@ -140,19 +141,27 @@ class File(Handler):
 
 
     def save_state(self):
+        # Returns the data written (used by the database to write the blob
+        # without reading the file back)
         if not self.dirty:
-            return
+            return None
+
+        # Serialize
+        file = StringIO()
+        self.save_state_to_file(file)
+        data = file.getvalue()
 
         # Save
         file = self.database.fs.open(self.key, 'w')
         try:
-            self.save_state_to_file(file)
+            file.write(data)
         finally:
             file.close()
 
         # Update timestamp/dirty
         self.timestamp = self.database.fs.get_mtime(self.key)
         self.dirty = None
+        return data
 
 
     def save_state_to(self, key):
@@ -258,6 +267,23 @@ class File(Handler):
         self._clean_state()
 
 
+    def get_sizeof(self):
+        """Returns an approximation of the memory used by the handler, in
+        bytes, or None if it is not loaded.  This is used by the database to
+        bound the size of its cache.
+
+        The default implementation is generic (and slow), sub-classes with a
+        complex state should override it.
+        """
+        if self.timestamp is None and self.dirty is None:
+            return None
+
+        exclude = self.clone_exclude
+        state = [ value for name, value in self.__dict__.iteritems()
+                  if name not in exclude ]
+        return get_sizeof(state)
+
+
     #########################################################################
     # API
     #########################################################################
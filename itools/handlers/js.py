@@ -27,11 +27,11 @@ class JSFile(TextFile):
     class_extension = 'js'
 
 
-    def get_units(self, srx_handler=None):
+    def get_units(self, srx_handler=None, language='en'):
         raise NotImplementedError
 
 
-    def translate(self, catalog, srx_handler=None):
+    def translate(self, catalog, srx_handler=None, language='en'):
         raise NotImplementedError
 
 
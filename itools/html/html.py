@@ -68,8 +68,8 @@ class HTMLFile(XHTMLFile):
     to_str = XHTMLFile.to_html
 
 
-    def translate(self, catalog, srx_handler=None):
-        stream = translate(self.events, catalog, srx_handler)
+    def translate(self, catalog, srx_handler=None, language='en'):
+        stream = translate(self.events, catalog, srx_handler, language)
         return stream_to_str_as_html(stream)
 
 
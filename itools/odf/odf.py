@@ -168,22 +168,22 @@ class ODFFile(OOFile):
                 yield event
 
 
-    def get_units(self, srx_handler=None):
+    def get_units(self, srx_handler=None, language='en'):
         for filename in ['content.xml', 'meta.xml', 'styles.xml']:
             events = self.get_events(filename)
-            for message in get_units(events, srx_handler):
+            for message in get_units(events, srx_handler, language):
                 # FIXME the line number has no sense here
                 yield message
 
 
-    def translate(self, catalog, srx_handler=None):
+    def translate(self, catalog, srx_handler=None, language='en'):
         """Translate the document and reconstruct an odt document.
         """
         # Translate
         modified_files = {}
         for filename in ['content.xml', 'meta.xml', 'styles.xml']:
             events = self.get_events(filename)
-            translation = translate(events, catalog, srx_handler)
+            translation = translate(events, catalog, srx_handler, language)
             modified_files[filename] = stream_to_str(translation)
 
         # Zip
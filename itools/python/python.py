@@ -49,7 +49,7 @@ class Python(TextFile):
     class_extension = 'py'
 
 
-    def get_units(self, srx_handler=None):
+    def get_units(self, srx_handler=None, language='en'):
         data = self.to_str()
         # Make it work with Windows files (the parser expects '\n' ending
         # lines)
@@ -179,7 +179,7 @@ def _clean_message(message, keep_spaces):
 
 default_srx_handler = get_abspath('srx/default.srx', 'itools')
 default_srx_handler = ro_database.get_handler(default_srx_handler, SRXFile)
-def _split_message(message, srx_handler=None):
+def _split_message(message, srx_handler=None, language='en'):
     # Concatenation!
     concat_text = []
     for type, value, line in message:
@@ -190,20 +190,15 @@ def _split_message(message, srx_handler=None):
     # Get the rules
     if srx_handler is None:
         srx_handler = default_srx_handler
-    # XXX we must handle the language here!
-    rules = srx_handler.get_compiled_rules('en')
+    rules = srx_handler.get_compiled_rules(language)
 
-    # Get the breaks
-    breaks = set()
-    no_breaks = set()
+    # Get the breaks: a position is decided by the first rule that matches
+    # there, be it a break or a no-break rule
+    decided = {}
     for break_value, regexp in rules:
         for match in regexp.finditer(concat_text):
-            pos = match.end()
-            if break_value and pos not in no_breaks:
-                breaks.add(pos)
-            if not break_value and pos not in breaks:
-                no_breaks.add(pos)
-    breaks = list(breaks)
+            decided.setdefault(match.end(), break_value)
+    breaks = [ pos for pos, break_value in decided.iteritems() if break_value ]
     breaks.sort()
 
     # And now cut the message
@@ -282,15 +277,16 @@ def _translate_message(message, catalog):
 ###########################################################################
 # API
 ###########################################################################
-def get_segments(message, keep_spaces=False, srx_handler=None):
-    for sub_message in _split_message(message, srx_handler):
+def get_segments(message, keep_spaces=False, srx_handler=None,
+                 language='en'):
+    for sub_message in _split_message(message, srx_handler, language):
         left, center, right = _clean_message(sub_message, keep_spaces)
 
         todo = left+right
 
         if center != sub_message:
             for value, context, line in get_segments(center, keep_spaces,
-                                                     srx_handler):
+                                                     srx_handler, language):
                 yield value, context, line
         else:
             # Is there a human text in this center ?
@@ -310,9 +306,10 @@ def get_segments(message, keep_spaces=False, srx_handler=None):
                         yield ((TEXT, text),), context, line
 
 
-def translate_message(message, catalog, keep_spaces=False, srx_handler=None):
+def translate_message(message, catalog, keep_spaces=False, srx_handler=None,
+                      language='en'):
     translated_message = []
-    for sub_message in _split_message(message, srx_handler):
+    for sub_message in _split_message(message, srx_handler, language):
         left, center, right = _clean_message(sub_message, keep_spaces)
 
         _translate_format(left, catalog)
@@ -323,7 +320,7 @@ def translate_message(message, catalog, keep_spaces=False, srx_handler=None):
 
         if center != sub_message:
             center = translate_message(center, catalog, keep_spaces,
-                                       srx_handler)
+                                       srx_handler, language)
         else:
             # Is there a human text in this center ?
             for type, value, line in center:
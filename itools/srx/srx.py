@@ -41,6 +41,8 @@ class SRXFile(TextFile):
                        'formathandle_isolated': False}
         self.language_rules = {}
         self.map_rules = []
+        # Cache of the compiled rules, by language
+        self.compiled_rules = {}
 
         srx_uri = 'http://www.lisa.org/srx20'
 
@@ -109,6 +111,10 @@ class SRXFile(TextFile):
     # API
     #########################################################################
     def get_compiled_rules(self, language):
+        result = self.compiled_rules.get(language)
+        if result is not None:
+            return result
+
         result = []
         for rule in self.get_rules(language):
             break_value, before_break, after_break = rule
@@ -117,6 +123,7 @@ class SRXFile(TextFile):
                 regexp += '(?=%s)' % after_break
             regexp = compile(regexp, DOTALL | MULTILINE)
             result.append((break_value, regexp))
+        self.compiled_rules[language] = result
         return result
 
 
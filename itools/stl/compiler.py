@@ -0,0 +1,781 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The STL compiler translates the events of a template, once, to the source
+code of a Python function.  Rendering the template is then a call to that
+function: the "${...}" substitutions are already split, the expressions
+already parsed, the datatypes of the attributes already known, and the
+parts of the template that do not depend on the namespace are ready to
+be sent (as events, or as a string).
+
+The output is the same as that of the interpreter (the 'process'
+function).  For the 'xml', 'xhtml' and 'html' modes the function writes
+the serialized output straight to a list of strings, the static parts of
+the template escaped once at compile time.
+"""
+
+# Import from the Standard Library
+from types import GeneratorType
+
+# Import from itools
+from itools.core import LRUCache, is_prototype
+from itools.datatypes import Boolean
+from itools.gettext import MSG
+from itools.html import xhtml_uri
+from itools.html.xhtml import stream_to_html_map
+from itools.xml import XMLParser, DOCUMENT_TYPE, START_ELEMENT, END_ELEMENT
+from itools.xml import TEXT
+from itools.xml import find_end, get_attr_datatype, is_xml_stream, xmlns_uri
+from itools.xml.xml import stream_to_str_map
+
+# Import from here
+from schema import stl_uri
+from stl import STLError, ERR_EXPR_XML, evaluate, evaluate_if, lookup
+from stl import evaluate_repeat, set_prefix, subs_expr, subs_expr_solo
+from stl import substitute, substitute_attribute, substitute_boolean
+from stl import stl_repeat, stl_if, stl_omit_tag
+
+
+
+###########################################################################
+# Run-time
+###########################################################################
+def resolve(stack, path, expression):
+    # Like 'evaluate', with the expression already parsed
+    err = "evaluation of '%s' failed, '%s' could not be resolved"
+    try:
+        value = stack.lookup(path[0])
+    except STLError:
+        raise STLError, err % (expression, path[0])
+
+    for name in path[1:]:
+        try:
+            value = lookup(value, name)
+        except STLError:
+            raise STLError, err % (expression, name)
+
+    return value
+
+
+def if_and(condition1, condition2):
+    return condition1 and condition2
+
+
+def if_or(condition1, condition2):
+    return condition1 or condition2
+
+
+def get_attribute(value, encoding):
+    # Like 'substitute_attribute' with a single expression
+    if value is None:
+        return None
+    if is_prototype(value, MSG):
+        return value.gettext().encode(encoding)
+    elif type(value) is unicode:
+        return value.encode(encoding)
+    return str(value)
+
+
+def get_attribute_part(value, encoding):
+    # Like 'substitute_attribute' with an expression within a string
+    if value is None:
+        return ''
+    return get_attribute(value, encoding)
+
+
+def get_events(value, encoding, line, expression):
+    # Like 'substitute' (and 'process') for an expression
+    render = getattr(value, 'render', None)
+    if render:
+        value = render()
+    if value is None:
+        return ()
+
+    if is_prototype(value, MSG):
+        value = value.gettext()
+
+    if type(value) is unicode:
+        return [(TEXT, value.encode(encoding), line)]
+    elif is_xml_stream(value):
+        events = []
+        for x in value:
+            if type(x) is not tuple:
+                raise STLError, ERR_EXPR_XML % (type(x), expression)
+            event, value, kk = x
+            events.append((event, value, line))
+        return events
+    return [(TEXT, str(value), line)]
+
+
+def get_string(value, encoding, expression, map):
+    events = get_events(value, encoding, None, expression)
+    return ''.join([ map[x](y) for x, y, z in events ])
+
+
+def get_text_events(data, stack, repeat, encoding, line):
+    # The interpreter, for the cases the compiler does not handle
+    return [ (x, y, line) for x, y, z
+             in substitute(data, stack, repeat, encoding) ]
+
+
+def get_text_string(data, stack, repeat, encoding, map):
+    events = substitute(data, stack, repeat, encoding)
+    return ''.join([ map[x](y) for x, y, z in events ])
+
+
+http_equiv = (None, 'http-equiv')
+content = (None, 'content')
+
+def set_content_type(value, content_type, state):
+    # Like 'itools.html.set_content_type' for a start tag, 'state' is the
+    # position of the last <head> in the output and whether a <meta> has
+    # been replaced
+    tag_uri, tag_name, attributes = value
+    if tag_uri == xhtml_uri and tag_name == 'meta':
+        if attributes.get(http_equiv) == 'Content-Type':
+            state[1] = True
+            attributes = {http_equiv: 'Content-Type', content: content_type}
+            return (xhtml_uri, 'meta', attributes)
+    return value
+
+
+def append_events(events, map, output, content_type, state):
+    for x, y, z in events:
+        if x == START_ELEMENT:
+            y = set_content_type(y, content_type, state)
+            output.append(map[x](y))
+            if y[0] == xhtml_uri and y[1] == 'head':
+                state[0] = len(output)
+        else:
+            output.append(map[x](y))
+
+
+def append_string(value, encoding, expression, map, output, content_type,
+                  state):
+    events = get_events(value, encoding, None, expression)
+    append_events(events, map, output, content_type, state)
+
+
+def append_text_string(data, stack, repeat, encoding, map, output,
+                       content_type, state):
+    events = substitute(data, stack, repeat, encoding)
+    append_events(events, map, output, content_type, state)
+
+
+runtime = {
+    'START_ELEMENT': START_ELEMENT,
+    'evaluate': evaluate,
+    'evaluate_if': evaluate_if,
+    'evaluate_repeat': evaluate_repeat,
+    'substitute_attribute': substitute_attribute,
+    'substitute_boolean': substitute_boolean,
+    'resolve': resolve,
+    'if_and': if_and,
+    'if_or': if_or,
+    'get_attribute': get_attribute,
+    'get_attribute_part': get_attribute_part,
+    'get_events': get_events,
+    'get_string': get_string,
+    'get_text_events': get_text_events,
+    'get_text_string': get_text_string,
+    'set_content_type': set_content_type,
+    'append_string': append_string,
+    'append_text_string': append_text_string}
+
+
+
+###########################################################################
+# Compiler
+###########################################################################
+class TemplateCompiler(object):
+    """Translates the events of a template to the source code of a
+    function, with the same output as the 'process' function:
+
+    - render(stack, re_stack, encoding), a generator of events, if no
+      map is given;
+
+    - render(stack, re_stack, encoding, output), that appends to the
+      'output' list the output serialized by the given map (see
+      'stream_to_str').
+
+    If a content type is given, the <meta http-equiv="Content-Type"> of
+    the output is set, as 'itools.html.set_content_type' does.
+    """
+
+    def __init__(self, events, skip_events=(DOCUMENT_TYPE,), map=None,
+                 content_type=None):
+        self.events = events
+        self.skip_events = skip_events
+        self.map = map
+        self.content_type = content_type
+        # The source code
+        self.code = []
+        self.indent = 1
+        self.blocks = []
+        # The objects referenced by the code
+        self.constants = {}
+        self.n_vars = 0
+        # The static events not yet written
+        self.run = []
+        # End tags to send only if the start tag was sent (stl:omit-tag)
+        self.conditional_ends = {}
+
+
+    def get_function(self, filename='<template>'):
+        self.compile_range(0, len(self.events))
+        self.flush()
+
+        if self.map is None:
+            header = 'def render(stack, re_stack, encoding):'
+            # Always a generator
+            self.code.append('    if False: yield None')
+        else:
+            header = 'def render(stack, re_stack, encoding, output):'
+            prologue = ['    append = output.append']
+            content_type = self.content_type
+            if content_type is not None:
+                # Insert the <meta> after the last <head>, if none was
+                # replaced
+                prologue.append('    state = [None, False]')
+                attributes = {http_equiv: 'Content-Type',
+                              content: content_type}
+                value = (xhtml_uri, 'meta', attributes)
+                meta = (self.map[START_ELEMENT](value)
+                        + self.map[END_ELEMENT]((xhtml_uri, 'meta')))
+                self.code.append('    if state[0] is not None and not '
+                                 'state[1]:')
+                self.code.append('        output.insert(state[0], %s)'
+                                 % self.add_constant(meta))
+            self.code[0:0] = prologue
+        source = '\n'.join([header] + self.code)
+
+        namespace = runtime.copy()
+        namespace.update(self.constants)
+        namespace['MAP'] = self.map
+        exec compile(source, filename, 'exec') in namespace
+        return namespace['render']
+
+
+    #######################################################################
+    # Writing the code
+    def add_constant(self, value):
+        name = 'C%d' % len(self.constants)
+        self.constants[name] = value
+        return name
+
+
+    def new_var(self, prefix):
+        self.n_vars += 1
+        return '%s%d' % (prefix, self.n_vars)
+
+
+    def write(self, line):
+        self.flush()
+        self.code.append('    ' * self.indent + line)
+
+
+    def open_block(self, line):
+        self.write(line)
+        self.indent += 1
+        self.blocks.append(len(self.code))
+
+
+    def close_block(self):
+        self.flush()
+        if self.blocks.pop() == len(self.code):
+            self.code.append('    ' * self.indent + 'pass')
+        self.indent -= 1
+
+
+    def static(self, event):
+        if self.content_type is None or event[0] != START_ELEMENT:
+            self.run.append(event)
+            return
+
+        # Content-Type
+        event_type, value, line = event
+        tag_uri, tag_name, attributes = value
+        value = set_content_type(value, self.content_type, [None, False])
+        self.run.append((event_type, value, line))
+        if value is not event[1]:
+            self.write('state[1] = True')
+        elif tag_uri == xhtml_uri and tag_name == 'head':
+            self.write('state[0] = len(output)')
+
+
+    def flush(self):
+        run = self.run
+        if not run:
+            return
+        self.run = []
+
+        indent = '    ' * self.indent
+        if self.map is None:
+            if len(run) == 1:
+                name = self.add_constant(run[0])
+                self.code.append('%syield %s' % (indent, name))
+            else:
+                name = self.add_constant(tuple(run))
+                self.code.append('%sfor event in %s: yield event'
+                                 % (indent, name))
+        else:
+            map = self.map
+            try:
+                data = ''.join([ map[x](y) for x, y, z in run ])
+            except Exception:
+                # Raise the error at run-time, if the events are sent
+                for event in run:
+                    name = self.add_constant(event)
+                    self.code.append('%sappend(MAP[%s[0]](%s[1]))'
+                                     % (indent, name, name))
+                return
+            if data:
+                name = self.add_constant(data)
+                self.code.append('%sappend(%s)' % (indent, name))
+
+
+    def send(self, var, tag_uri=None, tag_name=None):
+        """Writes the code to send the event in the given variable.
+        """
+        if self.map is None:
+            self.write('yield %s' % var)
+            return
+
+        if self.content_type is None or tag_uri != xhtml_uri:
+            self.write('append(MAP[%s[0]](%s[1]))' % (var, var))
+        elif tag_name == 'meta':
+            self.write('%s = (%s[0], set_content_type(%s[1], %s, state), '
+                       '%s[2])' % (var, var, var,
+                                   self.add_constant(self.content_type), var))
+            self.write('append(MAP[%s[0]](%s[1]))' % (var, var))
+        else:
+            self.write('append(MAP[%s[0]](%s[1]))' % (var, var))
+            if tag_name == 'head':
+                self.write('state[0] = len(output)')
+
+
+    #######################################################################
+    # Expressions
+    def get_expression_code(self, expression):
+        if expression == 'none':
+            return 'None'
+
+        path = expression.split('/')
+        stack = 'stack'
+        if path[0] == 'repeat':
+            stack = 're_stack'
+            path = path[1:]
+        if not path:
+            return 'evaluate(%s, stack, re_stack)' % (
+                self.add_constant(expression))
+
+        path = self.add_constant(tuple(path))
+        expression = self.add_constant(expression)
+        return 'resolve(%s, %s, %s)' % (stack, path, expression)
+
+
+    def get_not_code(self, expression):
+        if expression[:4] == 'not ':
+            return '(not %s)' % self.get_expression_code(expression[4:])
+        return self.get_expression_code(expression)
+
+
+    def get_if_code(self, expression):
+        # Like 'evaluate_if', both conditions are evaluated
+        for operator, function in [(' and ', 'if_and'), (' or ', 'if_or')]:
+            if operator in expression:
+                expressions = expression.split(operator)
+                if len(expressions) != 2:
+                    return 'evaluate_if(%s, stack, re_stack)' % (
+                        self.add_constant(expression))
+                ex1, ex2 = expressions
+                return '%s(%s, %s)' % (function, self.get_not_code(ex1),
+                                       self.get_not_code(ex2))
+        return self.get_not_code(expression)
+
+
+    #######################################################################
+    # Events
+    def compile_range(self, i, end):
+        events = self.events
+        while i < end:
+            event, value, line = events[i]
+            if event == TEXT:
+                self.compile_text(value, line)
+            elif event == START_ELEMENT:
+                tag_uri, tag_name, attributes = value
+                if stl_repeat in attributes:
+                    i = self.compile_repeat(i)
+                elif stl_if in attributes:
+                    i = self.compile_if(i)
+                elif tag_uri != stl_uri:
+                    var = self.compile_start_tag(tag_uri, tag_name,
+                                                 attributes)
+                    if var is not None:
+                        self.conditional_ends[find_end(events, i)] = var
+            elif event == END_ELEMENT:
+                tag_uri, tag_name = value
+                if tag_uri != stl_uri:
+                    var = self.conditional_ends.get(i)
+                    if var is None:
+                        self.static((event, value, line))
+                    else:
+                        self.open_block('if %s is not None:' % var)
+                        self.static((event, value, line))
+                        self.close_block()
+            elif event not in self.skip_events:
+                self.static((event, value, line))
+            # Next
+            i += 1
+
+
+    def compile_text(self, data, line):
+        map = self.map
+        if type(data) is not str:
+            # Let the interpreter raise the error
+            data = self.add_constant(data)
+            if map is None:
+                self.write('for event in get_text_events(%s, stack, re_stack,'
+                           ' encoding, %r): yield event' % (data, line))
+            elif self.content_type is None:
+                self.write('append(get_text_string(%s, stack, re_stack, '
+                           'encoding, MAP))' % data)
+            else:
+                content_type = self.add_constant(self.content_type)
+                self.write('append_text_string(%s, stack, re_stack, '
+                           'encoding, MAP, output, %s, state)'
+                           % (data, content_type))
+            return
+
+        for i, segment in enumerate(subs_expr.split(data)):
+            if i % 2:
+                value = self.get_expression_code(segment)
+                segment = self.add_constant(segment)
+                if map is None:
+                    self.write('for event in get_events(%s, encoding, %r, %s):'
+                               ' yield event' % (value, line, segment))
+                elif self.content_type is None:
+                    self.write('append(get_string(%s, encoding, %s, MAP))'
+                               % (value, segment))
+                else:
+                    content_type = self.add_constant(self.content_type)
+                    self.write('append_string(%s, encoding, %s, MAP, output, '
+                               '%s, state)' % (value, segment, content_type))
+            elif segment:
+                self.static((TEXT, segment, line))
+
+
+    def get_static_attributes(self, tag_uri, tag_name, attributes):
+        """Returns the attributes of the start tag as 'process_start_tag'
+        would, or None if they depend on the namespace.
+        """
+        if stl_omit_tag in attributes:
+            return None
+
+        aux = {}
+        for attr_uri, attr_name in attributes:
+            # Omit stl attributes and namespace
+            if attr_uri == stl_uri:
+                continue
+            if attr_uri == xmlns_uri and attr_name == 'stl':
+                continue
+
+            value = attributes[(attr_uri, attr_name)]
+            datatype = get_attr_datatype(tag_uri, tag_name, attr_uri,
+                                         attr_name, attributes)
+            # Boolean attributes
+            if issubclass(datatype, Boolean):
+                if type(value) is bool:
+                    if value is True:
+                        aux[(attr_uri, attr_name)] = attr_name
+                    continue
+                if type(value) is not str or subs_expr_solo.match(value):
+                    return None
+                aux[(attr_uri, attr_name)] = attr_name
+                continue
+            # Non Boolean attributes
+            if type(value) is not str or subs_expr.search(value):
+                return None
+            aux[(attr_uri, attr_name)] = value
+
+        return aux
+
+
+    def compile_start_tag(self, tag_uri, tag_name, attributes):
+        """Compiles 'process_start_tag' (for a tag not in the stl
+        namespace).  Returns the variable with the start tag, if it may
+        not be sent (stl:omit-tag), None otherwise.
+        """
+        aux = self.get_static_attributes(tag_uri, tag_name, attributes)
+        if aux is not None:
+            self.static((START_ELEMENT, (tag_uri, tag_name, aux), None))
+            return None
+
+        var = self.new_var('x')
+        omit_tag = stl_omit_tag in attributes
+        if omit_tag:
+            expression = attributes[stl_omit_tag]
+            self.open_block('if %s:' % self.get_if_code(expression))
+            self.write('%s = None' % var)
+            self.close_block()
+            self.open_block('else:')
+
+        # Attributes, in the same order
+        self.write('aux = {}')
+        for attr_uri, attr_name in attributes:
+            if attr_uri == stl_uri:
+                continue
+            if attr_uri == xmlns_uri and attr_name == 'stl':
+                continue
+
+            key = self.add_constant((attr_uri, attr_name))
+            value = attributes[(attr_uri, attr_name)]
+            datatype = get_attr_datatype(tag_uri, tag_name, attr_uri,
+                                         attr_name, attributes)
+            # Boolean attributes
+            if issubclass(datatype, Boolean):
+                name = self.add_constant(attr_name)
+                if type(value) is bool:
+                    if value is True:
+                        self.write('aux[%s] = %s' % (key, name))
+                    continue
+                if type(value) is not str:
+                    value = self.add_constant(value)
+                    self.write('if substitute_boolean(%s, stack, re_stack, '
+                               'encoding) is True: aux[%s] = %s'
+                               % (value, key, name))
+                    continue
+                match = subs_expr_solo.match(value)
+                if match is None:
+                    self.write('aux[%s] = %s' % (key, name))
+                else:
+                    value = self.get_expression_code(match.group(1))
+                    self.write('if %s: aux[%s] = %s' % (value, key, name))
+                continue
+
+            # Non Boolean attributes
+            if type(value) is not str:
+                value = self.add_constant(value)
+                self.write('value = substitute_attribute(%s, stack, re_stack,'
+                           ' encoding)[0]' % value)
+                self.write('if value is not None: aux[%s] = value' % key)
+                continue
+            match = subs_expr_solo.match(value)
+            if match is not None:
+                value = self.get_expression_code(match.group(1))
+                self.write('value = get_attribute(%s, encoding)' % value)
+                self.write('if value is not None: aux[%s] = value' % key)
+            elif subs_expr.search(value):
+                parts = []
+                for i, segment in enumerate(subs_expr.split(value)):
+                    if i % 2:
+                        segment = self.get_expression_code(segment)
+                        parts.append('get_attribute_part(%s, encoding)'
+                                     % segment)
+                    elif segment:
+                        parts.append(self.add_constant(segment))
+                parts = ', '.join(parts)
+                self.write("aux[%s] = ''.join((%s,))" % (key, parts))
+            else:
+                self.write('aux[%s] = %s' % (key, self.add_constant(value)))
+
+        self.write('%s = (START_ELEMENT, (%s, %s, aux), None)'
+                   % (var, self.add_constant(tag_uri),
+                      self.add_constant(tag_name)))
+
+        # Send
+        if omit_tag:
+            self.close_block()
+            self.open_block('if %s is not None:' % var)
+            self.send(var, tag_uri, tag_name)
+            self.close_block()
+            return var
+
+        self.send(var, tag_uri, tag_name)
+        return None
+
+
+    def compile_if(self, i):
+        event, value, line = self.events[i]
+        tag_uri, tag_name, attributes = value
+        attributes = attributes.copy()
+        expression = attributes.pop(stl_if)
+        end = find_end(self.events, i)
+        if end is None:
+            raise STLError, 'the element at %s is not closed' % line
+
+        self.open_block('if %s:' % self.get_if_code(expression))
+        if tag_uri != stl_uri:
+            var = self.compile_start_tag(tag_uri, tag_name, attributes)
+            if var is not None:
+                self.conditional_ends[end] = var
+        self.compile_range(i + 1, end + 1)
+        self.close_block()
+        return end
+
+
+    def compile_repeat(self, i):
+        events = self.events
+        event, value, line = events[i]
+        tag_uri, tag_name, attributes = value
+        attributes = attributes.copy()
+        re_expr = attributes.pop(stl_repeat)
+        if_expr = attributes.pop(stl_if, None)
+        loop_end = find_end(events, i)
+        if loop_end is None:
+            raise STLError, 'the element at %s is not closed' % line
+
+        n = self.new_var('')
+        # The variable name and values
+        if ' ' in re_expr:
+            name, expression = re_expr.split(' ', 1)
+            self.write('name%s = %s' % (n, self.add_constant(name)))
+            self.write('values%s = %s' % (n, self.get_expression_code(
+                expression)))
+        else:
+            # Let the interpreter raise the error
+            self.write('name%s, values%s = evaluate_repeat(%s, stack, '
+                       're_stack)' % (n, n, self.add_constant(re_expr)))
+        self.write('n%s = len(values%s)' % (n, n))
+
+        # The loop
+        self.open_block('for j%s, value%s in enumerate(values%s):' % (n, n, n))
+        self.write('stack.append({name%s: value%s})' % (n, n))
+        self.write("re_stack.append({name%s: {'index': j%s, 'start': j%s == 0,"
+                   " 'end': j%s == n%s - 1, 'even': j%s %% 2 and 'odd' or "
+                   "'even'}})" % (n, n, n, n, n, n))
+        # Like the interpreter, the stacks are not restored when skipping
+        if if_expr:
+            self.write('if not %s: continue' % self.get_if_code(if_expr))
+        var = None
+        if tag_uri != stl_uri:
+            var = self.compile_start_tag(tag_uri, tag_name, attributes)
+        self.compile_range(i + 1, loop_end)
+        # The end tag
+        if tag_uri != stl_uri:
+            if var is None:
+                self.static(events[loop_end])
+            else:
+                self.open_block('if %s is not None:' % var)
+                self.static(events[loop_end])
+                self.close_block()
+        self.write('stack.pop()')
+        self.write('re_stack.pop()')
+        self.close_block()
+
+        return loop_end
+
+
+
+# The map and content type of every mode (see 'stl')
+modes = {
+    'events': (None, None),
+    'xml': (stream_to_str_map, None),
+    'xhtml': (stream_to_str_map, 'application/xhtml+xml; charset=%s'),
+    'html': (stream_to_html_map, 'text/html; charset=%s')}
+
+
+class CompiledTemplate(object):
+    """A template ready to be rendered by calling Python functions: one
+    generating the events, and one per serialization (compiled on demand).
+    """
+
+    def __init__(self, events, skip=(DOCUMENT_TYPE,), filename='<template>'):
+        self.events = events
+        self.skip = skip
+        self.filename = filename
+        self.functions = {}
+
+
+    def get_function(self, mode, encoding='utf-8'):
+        key = (mode, encoding)
+        function = self.functions.get(key)
+        if function is None:
+            map, content_type = modes[mode]
+            if content_type is not None:
+                content_type = content_type % encoding
+            compiler = TemplateCompiler(self.events, self.skip, map,
+                                        content_type)
+            function = compiler.get_function(self.filename)
+            self.functions[key] = function
+        return function
+
+
+    def get_events(self, stack, repeat, encoding='utf-8'):
+        render = self.get_function('events', encoding)
+        return render(stack, repeat, encoding)
+
+
+    def get_chunks(self, stack, repeat, encoding='utf-8', mode='xml'):
+        """Returns the output, serialized for the given mode ('xml',
+        'xhtml' or 'html'), as a list of strings.
+        """
+        render = self.get_function(mode, encoding)
+        output = []
+        render(stack, repeat, encoding, output)
+        return output
+
+
+    def to_str(self, stack, repeat, encoding='utf-8', mode='xml'):
+        return ''.join(self.get_chunks(stack, repeat, encoding, mode))
+
+
+
+compiled_templates = LRUCache(200, 300)
+
+def get_compiled_template(document=None, events=None, prefix=None,
+                          skip=(DOCUMENT_TYPE,)):
+    """Returns the compiled template for the given handler or events (as
+    given to 'stl').  The compiled templates are cached, by handler (key and
+    mtime) or by list of events.
+    """
+    if prefix is not None:
+        prefix = str(prefix)
+
+    # The cache key
+    if events is not None:
+        if type(events) in (GeneratorType, XMLParser):
+            events = list(events)
+            key = None
+        else:
+            key = (id(events), prefix, skip)
+        filename = '<template>'
+    else:
+        events = document.events
+        if document.key is None or document.dirty is not None:
+            # Not saved, do not cache
+            key = None
+        else:
+            key = (document.key, document.timestamp, prefix, skip)
+        filename = '<template %s>' % document.key
+
+    # Cache hit
+    if key is not None:
+        template = compiled_templates.get(key)
+        if template is not None and template.source is events:
+            compiled_templates.touch(key)
+            return template
+
+    # Compile
+    source = events
+    if prefix is not None:
+        events = list(set_prefix(events, prefix))
+    template = CompiledTemplate(events, skip, filename)
+    template.source = source
+    if key is not None:
+        compiled_templates[key] = template
+    return template
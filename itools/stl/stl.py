@@ -36,7 +36,7 @@ from itools.log import log_error
 from itools.uri import Path, Reference, get_reference
 from itools.xml import XMLParser, find_end, get_attr_datatype, stream_to_str
 from itools.xml import DOCUMENT_TYPE, START_ELEMENT, END_ELEMENT, TEXT
-from itools.xml import xmlns_uri
+from itools.xml import xmlns_uri, CompactEvents
 from itools.xml import is_xml_stream
 from itools.xmlfile import XMLFile, get_units
 from itools.html import xhtml_uri
@@ -278,18 +278,14 @@ def substitute(data, stack, repeat_stack, encoding='utf-8'):
 
 
 def stl(document=None, namespace=freeze({}), prefix=None, events=None,
-        mode='events', skip=(DOCUMENT_TYPE,)):
+        mode='events', skip=(DOCUMENT_TYPE,), compiled=False, chunks=False):
+    """Renders the template with the namespace, as events or as a string
+    serialized for the mode ('xml', 'xhtml' or 'html').  With 'chunks',
+    the serialized output is returned as a list of strings not joined
+    (with the compiler), which the web server sends as is.
+    """
     # Input
     encoding = 'utf-8'
-    if events is None:
-        events = document.events
-
-    # Prefix
-    if prefix is not None:
-        stream = set_prefix(events, prefix)
-        events = list(stream)
-    elif type(events) in (GeneratorType, XMLParser):
-        events = list(events)
 
     # Initialize the namespace stacks
     stack = NamespaceStack()
@@ -297,25 +293,50 @@ def stl(document=None, namespace=freeze({}), prefix=None, events=None,
     repeat = NamespaceStack()
 
     # Process
-    stream = process(events, 0, len(events), stack, repeat, encoding, skip)
+    if compiled:
+        # Import here, the compiler uses this module
+        from compiler import get_compiled_template
+        template = get_compiled_template(document, events, prefix, skip)
+        if mode == 'events':
+            stream = template.get_events(stack, repeat, encoding)
+    else:
+        if events is None:
+            events = document.events
+
+        # Prefix
+        if prefix is not None:
+            stream = set_prefix(events, prefix)
+            events = list(stream)
+        elif type(events) in (GeneratorType, XMLParser):
+            events = list(events)
+
+        stream = process(events, 0, len(events), stack, repeat, encoding,
+                         skip)
 
     # Return
     try:
         if mode == 'events':
             return stream
+        elif compiled and mode in ('xml', 'xhtml', 'html'):
+            # Rendered straight to strings
+            if chunks:
+                return template.get_chunks(stack, repeat, encoding, mode)
+            return template.to_str(stack, repeat, encoding, mode)
         elif mode == 'xml':
-            return stream_to_str(stream, encoding)
+            data = stream_to_str(stream, encoding)
         elif mode == 'xhtml':
-            return stream_to_str_as_xhtml(stream, encoding)
+            data = stream_to_str_as_xhtml(stream, encoding)
         elif mode == 'html':
-            return stream_to_str_as_html(stream, encoding)
+            data = stream_to_str_as_html(stream, encoding)
+        else:
+            # Unknow mode
+            raise ValueError('unexpected mode "{0}"'.format(mode))
     except STLError, e:
         error = 'Error in generation of {0}\n'.format(mode)
         if document:
             error += 'Template {0}\n'.format(document.key)
         raise STLError(error + e.message)
-    # Unknow mode
-    raise ValueError('unexpected mode "{0}"'.format(mode))
+    return [data] if chunks else data
 
 
 
@@ -545,9 +566,11 @@ class STLFile(XMLFile):
 
     # FIXME To be changed once we have our own extension and mimetype (#864)
     class_mimetypes = ['text/xml', 'application/xml', 'application/xhtml+xml']
+    compact_events = True
 
-    def get_units(self, srx_handler=None):
-        for source, context, line in get_units(self.events, srx_handler):
+    def get_units(self, srx_handler=None, language='en'):
+        units = get_units(self.events, srx_handler, language)
+        for source, context, line in units:
             if len(source) > 1 or subs_expr_solo.match(source[0][1]) is None:
                 yield source, context, line
 
@@ -560,25 +583,30 @@ class STLTemplate(prototype):
 
     template = None
     show = True
+    # Set to True to render the template with the STL compiler
+    compile_template = False
 
 
     def get_template(self):
-        if type(self.template) is list:
+        if type(self.template) in (list, CompactEvents):
             return self.template
 
         error = 'template variable of unexpected type "%s"'
         raise TypeError, error % type(self.template).__name__
 
 
-    def render(self, mode='events'):
+    def render(self, mode='events', chunks=False):
         if not self.show:
             return None
 
         # Case 1: a ready made list of events
+        compiled = self.compile_template
         template = self.get_template()
-        if type(template) is list:
-            return stl(events=template, namespace=self, mode=mode)
+        if type(template) in (list, CompactEvents):
+            return stl(events=template, namespace=self, mode=mode,
+                       compiled=compiled, chunks=chunks)
 
         # Case 2: we assume it is a handler
-        return stl(template, self, mode=mode)
+        return stl(template, self, mode=mode, compiled=compiled,
+                   chunks=chunks)
 
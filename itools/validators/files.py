@@ -124,13 +124,17 @@ class ImagePixelsValidator(BaseValidator):
 
     def check(self, value):
         filename, mimetype, body = value
-        data = StringIO(body)
+        # The big files are uploaded to temporary files
+        data = StringIO(body) if type(body) is str else body
         try:
             im = PILImage.open(data)
             im.verify()
         except Exception:
             code = 'image_has_errors'
             raise ValidationError(self.errors[code], code, {})
+        finally:
+            if data is body:
+                body.seek(0)
         if im.width * im.height > self.max_pixels:
             code = 'too_much_pixels'
             raise ValidationError(self.errors[code], code, {})
@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The compression of the responses (the content codings 'gzip' and
+'deflate'), negotiated with the 'Accept-Encoding' header.
+"""
+
+# Import from the Standard Library
+from zlib import compress as zlib_compress, compressobj, DEFLATED, MAX_WBITS
+
+
+# The media types worth compressing ('text/*' matches all the text types)
+compressible_types = (
+    'text/*',
+    'application/javascript',
+    'application/x-javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'image/svg+xml')
+
+
+
+def get_accept_encoding(header):
+    """Returns the mapping from content coding to quality of the given
+    'Accept-Encoding' header.
+    """
+    codings = {}
+    for value in header.split(','):
+        value = value.strip()
+        if not value:
+            continue
+        q = 1.0
+        if ';' in value:
+            value, parameters = value.split(';', 1)
+            value = value.strip()
+            parameters = parameters.strip()
+            if parameters[:2] == 'q=':
+                try:
+                    q = float(parameters[2:])
+                except ValueError:
+                    q = 0.0
+        codings[value.lower()] = q
+    # Alias
+    if 'x-gzip' in codings and 'gzip' not in codings:
+        codings['gzip'] = codings['x-gzip']
+    return codings
+
+
+def select_coding(header, codings=('gzip', 'deflate')):
+    """Returns the content coding, among the given ones (by order of
+    preference), the client prefers, or None if it accepts none of them.
+    """
+    if not header:
+        return None
+
+    accept = get_accept_encoding(header)
+    default = accept.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in codings:
+        q = accept.get(coding, default)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def is_compressible(content_type, types=compressible_types):
+    """Tells whether the given content type (maybe with parameters) is one
+    of the given media types.
+    """
+    if not content_type:
+        return False
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    if media_type in types:
+        return True
+    # Wildcard
+    return '%s/*' % media_type.split('/', 1)[0] in types
+
+
+def compress(data, coding, level=6):
+    """Returns the given data (a string or a buffer) encoded with the given
+    content coding: 'gzip' or 'deflate' (the zlib format).
+    """
+    if coding == 'deflate':
+        return zlib_compress(data, level)
+    elif coding == 'gzip':
+        compressor = compressobj(level, DEFLATED, MAX_WBITS | 16)
+        return compressor.compress(data) + compressor.flush()
+
+    raise ValueError, 'unexpected content coding "%s"' % coding
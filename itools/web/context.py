@@ -25,6 +25,8 @@ import json
 from base64 import decodestring, encodestring
 from datetime import datetime, timedelta
 from hashlib import sha224
+from os import fstat
+from threading import local
 from urllib import quote, unquote
 
 # Import from pytz
@@ -42,10 +44,11 @@ from itools.uri import decode_query, get_reference, Path, Reference
 from itools.validators import ValidationError
 
 # Local imports
-from entities import Entity
+from compression import compress, is_compressible, select_coding
 from exceptions import FormError
 from headers import get_type, Cookie, SetCookieDataType
 from messages import ERROR
+from multipart import MultipartParser
 from utils import NewJSONEncoder, fix_json, reason_phrases
 from router import RequestMethod
 
@@ -69,6 +72,9 @@ class Context(prototype):
     form = {}
     form_error = None
     commit = False
+    # The server-side cache (see 'RequestMethod.check_page_cache')
+    page_key = None
+    page_hit = False
 
 
     def init_context(self):
@@ -129,6 +135,13 @@ class Context(prototype):
         return datetime.utcnow().replace(tzinfo=fixed_offset(0))
 
 
+    @proto_lazy_property
+    def response_headers(self):
+        """The names of the response headers set so far.
+        """
+        return []
+
+
     @proto_lazy_property
     def accept_language(self):
         accept_language = self.soup_message.get_header('accept-language')
@@ -139,6 +152,12 @@ class Context(prototype):
 
     @proto_lazy_property
     def body(self):
+        # Case 0: multipart, parsed as received (see WebServer.start_upload)
+        key = self.soup_message.get_key()
+        parser = self.server.uploads.pop(key, None)
+        if parser is not None:
+            return parser.close()
+
         # Case 1: nothing
         body = self.soup_message.get_body()
         if not body:
@@ -170,40 +189,9 @@ class Context(prototype):
     def get_multipart_body(self, body):
         content_type, type_parameters = self.get_header('content-type')
         boundary = type_parameters.get('boundary')
-        boundary = '--%s' % boundary
-        form = {}
-        for part in body.split(boundary)[1:-1]:
-            # Parse the entity
-            entity = Entity(string=part)
-            # Find out the parameter name
-            header = entity.get_header('Content-Disposition')
-            value, header_parameters = header
-            name = header_parameters['name']
-            # Load the value
-            body = entity.get_body()
-            if 'filename' in header_parameters:
-                filename = header_parameters['filename']
-                if filename:
-                    # Strip the path (for IE).
-                    filename = filename.split('\\')[-1]
-                    # Default content-type, see
-                    # http://tools.ietf.org/html/rfc2045#section-5.2
-                    if entity.has_header('content-type'):
-                        mimetype = entity.get_header('content-type')[0]
-                    else:
-                        mimetype = 'text/plain'
-                    form[name] = filename, mimetype, body
-                else:
-                    form[name] = None
-            else:
-                if name not in form:
-                    form[name] = body
-                else:
-                    if isinstance(form[name], list):
-                        form[name].append(body)
-                    else:
-                        form[name] = [form[name], body]
-        return form
+        parser = MultipartParser(boundary)
+        parser.feed(body)
+        return parser.close()
 
 
     def add_style(self, *args):
@@ -254,6 +242,7 @@ class Context(prototype):
         datatype = get_type(name)
         value = datatype.encode(value)
         self.soup_message.set_header(name, value)
+        self.response_headers.append(name)
 
 
     def get_referrer(self):
@@ -281,6 +270,7 @@ class Context(prototype):
             disposition = '%s; filename="%s"' % (disposition, filename)
 
         self.soup_message.set_header('Content-Disposition', disposition)
+        self.response_headers.append('Content-Disposition')
 
 
     def set_default_response(self, status):
@@ -302,23 +292,88 @@ class Context(prototype):
         # Set response status
         self.soup_message.set_status(self.status)
         # Never cache if status != 200
-        if context.mtime and context.status != 200:
-            self.set_header('Last-Modified', context.mtime)
+        if self.mtime and self.status != 200:
+            self.set_header('Last-Modified', self.mtime)
             self.set_header('Cache-Control', 'max-age=1')
         # Set response body
         if self.entity is None:
             self.status = 204
         elif isinstance(self.entity, Reference):
-            location = context.uri.resolve(self.entity)
+            location = self.uri.resolve(self.entity)
             location = str(location)
             self.status = 302
             self.soup_message.set_header('Location', location)
+        elif type(self.entity) is str:
+            entity = self.compress_entity(self.entity)
+            self.soup_message.set_response(self.content_type, entity)
+        elif hasattr(self.entity, 'read'):
+            # A file, sent while read
+            entity = self.entity
+            size = get_file_size(entity)
+            self.soup_message.set_response_stream(self.content_type,
+                                                  iter_file(entity), size)
+        elif type(self.entity) in (list, tuple):
+            # Chunks (the length is known)
+            size = sum([ len(x) for x in self.entity ])
+            self.soup_message.set_response_stream(self.content_type,
+                                                  self.entity, size)
+        elif hasattr(self.entity, '__iter__'):
+            # A generator of chunks, sent with the chunked encoding
+            self.soup_message.set_response_stream(self.content_type,
+                                                  self.entity)
         else:
-            self.soup_message.set_response(self.content_type, self.entity)
+            # Objects with the buffer interface (not copied)
+            entity = self.compress_entity(self.entity)
+            self.soup_message.set_response(self.content_type, entity)
+
+
+    def compress_entity(self, entity):
+        """Returns the given entity (a string or a buffer) compressed, if
+        the client accepts it and the server's policy allows it (see
+        'WebServer.compress_level').  The streams are not compressed.
+        """
+        server = self.server
+        level = server.compress_level
+        if not level or type(entity) is unicode:
+            return entity
+        if len(entity) < server.compress_min_size:
+            return entity
+        # Partial content, or already encoded (e.g. precompressed files)
+        message = self.soup_message
+        if self.status == 206:
+            return entity
+        if message.get_response_header('content-encoding'):
+            return entity
+        if not is_compressible(self.content_type, server.compress_types):
+            return entity
+
+        # The response depends on the Accept-Encoding header
+        vary = message.get_response_header('vary')
+        if vary is None:
+            message.set_header('Vary', 'Accept-Encoding')
+        elif 'accept-encoding' not in vary.lower():
+            message.set_header('Vary', '%s, Accept-Encoding' % vary)
+
+        # Compress
+        accept = message.get_header('accept-encoding')
+        coding = select_coding(accept, server.compress_codings)
+        if coding is None:
+            return entity
+        data = compress(entity, coding, level)
+        if len(data) >= len(entity):
+            return entity
+
+        message.set_header('Content-Encoding', coding)
+        # The entity tag of the identity is not that of the compressed
+        # representation, but they are semantically equivalent
+        etag = message.get_response_header('etag')
+        if etag and etag[:2] != 'W/':
+            message.set_header('ETag', 'W/%s' % etag)
+        return data
 
 
     def accept_cors(self):
-        origin = context.get_header('Origin')
+        origin = self.get_header('Origin')
         self.set_header('Access-Control-Allow-Credentials', 'true')
         self.set_header('Access-Control-Allow-Origin', origin)
 
@@ -437,6 +492,7 @@ class Context(prototype):
         cookie = Cookie(value, **kw)
         cookie = SetCookieDataType.encode({name: cookie})
         self.soup_message.append_header('Set-Cookie', cookie)
+        self.response_headers.append('Set-Cookie')
 
 
     def del_cookie(self, name):
@@ -446,6 +502,7 @@ class Context(prototype):
         cookie = Cookie('', expires=expires)
         cookie = SetCookieDataType.encode({name: cookie})
         self.soup_message.append_header('Set-Cookie', cookie)
+        self.response_headers.append('Set-Cookie')
 
 
     #######################################################################
@@ -631,7 +688,7 @@ class Context(prototype):
         # (2) If path is null => 400 Bad Request
         if path is None:
             log_warning('Unexpected HTTP path (null)', domain='itools.web')
-            self.set_default_response(400)
+            context.set_default_response(400)
             return context
 
         # (3) Get the method that will handle the request
@@ -640,20 +697,23 @@ class Context(prototype):
         if method_name not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'HEAD'):
             log_warning('Unexpected "%s" HTTP method' % method_name,
                         domain='itools.web')
-            self.set_default_response(501)
+            context.set_default_response(501)
             return context
 
-        # (4) Go
+        # (4) Go (restore the context of the caller, if any, at the end)
+        caller = get_context()
         set_context(context)
         try:
+            if context.server.sync_database:
+                context.database.sync()
             context.init_context()
             RequestMethod.handle_request(context)
         except StandardError:
             log_error('Internal error', domain='itools.web')
-            self.set_default_response(500)
+            context.set_default_response(500)
             return context
         finally:
-            set_context(None)
+            set_context(caller)
             return context
 
 
@@ -664,18 +724,57 @@ class Context(prototype):
 
 
 ###########################################################################
-# Keep the context globally
+# Response bodies
 ###########################################################################
-context = None
+def get_file_size(file):
+    """Returns the number of bytes left to read from the given file, or -1
+    if not known.
+    """
+    try:
+        size = fstat(file.fileno()).st_size
+    except (AttributeError, EnvironmentError):
+        try:
+            size = len(file)
+        except TypeError:
+            return -1
+    return size - file.tell()
+
+
+def iter_file(file, chunk_size=64*1024):
+    try:
+        data = file.read(chunk_size)
+        while data:
+            yield data
+            data = file.read(chunk_size)
+    finally:
+        file.close()
+
+
+
+###########################################################################
+# Keep the context of the request being handled
+###########################################################################
+# One context per thread (or per greenlet, if 'threading' is patched, as
+# gevent does), and 'Context.handle_request' restores the caller's context
+# when done, so a request may be made from within another one (see
+# 'WebServer.do_request').
+#
+# Only the context is per thread: the database (its cache and the changes
+# of the transaction), the catalog, the compiled templates and the caches
+# of the server (pages, uploads, static files) are shared with no locking,
+# and the C callbacks of the server call Python without taking the GIL.
+# So a process must handle the requests one at a time, in the thread of
+# the main loop; to serve several requests at once use several processes
+# (see 'itools.web.prefork').
+_local = local()
 
 
 def set_context(ctx):
-    global context
-    context = ctx
+    _local.context = ctx
 
 
 def get_context():
-    return context
+    return getattr(_local, 'context', None)
 
 
 #######################################################################
@@ -755,7 +854,7 @@ def check_form_value(field, value):
         return
     errors = []
     for validator in field.get_validators():
-        validator = validator(title=field.title, context=context)
+        validator = validator(title=field.title, context=get_context())
         try:
             validator.check(value)
         except ValidationError, e:
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from standard library
+from operator import itemgetter
 import re
 
 # Import from itools
@@ -39,6 +40,8 @@ class URIPatternsParser(prototype):
                 'chunk': r'[^/^.]+',
                 'any': r'.+'}
     default_pattern = 'chunk'
+    # The patterns that never match a '/' (see 'get_segments')
+    segment_patterns = frozenset(['word', 'alpha', 'digits', 'chunk'])
 
 
     def _lookup(self, name):
@@ -77,18 +80,171 @@ class URIPatternsParser(prototype):
         return self._lastly(self._parse(url_pattern))
 
 
+    def _get_segment(self, parts):
+        """Returns the given segment parts as a string if static, as a
+        compiled regex otherwise.
+        """
+        if all([ is_static for is_static, part in parts ]):
+            return ''.join([ part for is_static, part in parts ])
+
+        regex = [ re.escape(part) if is_static else self._lookup(part)
+                  for is_static, part in parts ]
+        return re.compile(self._lastly(''.join(regex)))
+
+
+    def get_segments(self, url_pattern):
+        """Split a path expression into its segments (separated by '/'),
+        every segment is either a string (static segment) or a compiled regex
+        matching the whole segment.
+
+        If there is a part that may match a '/' (like 'any'), the segments
+        stop there and the last item of the list is None: the rest of the
+        path must be matched with the full regex.
+        """
+        self._pos = 0
+        parts = [part.split(self.end)
+                 for part in url_pattern.split(self.start)]
+        parts = [y for x in parts for y in x]
+
+        segments = []
+        segment = []
+        for i, part in enumerate(parts):
+            # Static text
+            if i % 2 == 0:
+                for j, text in enumerate(part.split('/')):
+                    if j > 0:
+                        segments.append(self._get_segment(segment))
+                        segment = []
+                    if text:
+                        segment.append((True, text))
+                continue
+
+            # Pattern
+            if ':' in part:
+                pattern = part.split(':')[1]
+            else:
+                pattern = self.default_pattern
+            if pattern not in self.segment_patterns:
+                segments.append(None)
+                return segments
+            segment.append((False, part))
+
+        segments.append(self._get_segment(segment))
+        return segments
+
+
+
+class RouteNode(object):
+    """A node of the dispatcher trie, there is a node for every segment of
+    the registered patterns.  The routes are (order, regex, data) tuples.
+    """
+
+    __slots__ = ['static', 'dynamic', 'routes', 'tails']
+
+
+    def __init__(self):
+        # Static segments: {text: node}
+        self.static = {}
+        # Dynamic segments: {regex source: (regex, node)}
+        self.dynamic = {}
+        # The routes ending here
+        self.routes = []
+        # The routes that match the rest of the path with their regex
+        self.tails = []
+
+
+    def add(self, segments, route):
+        node = self
+        for segment in segments:
+            if segment is None:
+                node.tails.append(route)
+                return
+            if isinstance(segment, basestring):
+                child = node.static.get(segment)
+                if child is None:
+                    child = node.static[segment] = RouteNode()
+            else:
+                key = segment.pattern
+                entry = node.dynamic.get(key)
+                if entry is None:
+                    entry = node.dynamic[key] = (segment, RouteNode())
+                child = entry[1]
+            node = child
+        node.routes.append(route)
+
+
+    def get_candidates(self, segments, i, candidates):
+        """Adds to the given list the routes that may match the path
+        segments (starting at 'i').
+        """
+        candidates.extend(self.tails)
+        if i == len(segments):
+            candidates.extend(self.routes)
+            return
+
+        segment = segments[i]
+        child = self.static.get(segment)
+        if child is not None:
+            child.get_candidates(segments, i + 1, candidates)
+        for regex, child in self.dynamic.itervalues():
+            if regex.match(segment):
+                child.get_candidates(segments, i + 1, candidates)
+
+
 
 class URIDispatcher(object):
+    """The routes are resolved by order of registration, the first pattern
+    that matches wins.
+
+    To avoid trying every regex, the patterns are stored in a trie of path
+    segments (see 'RouteNode'), which gives the few candidates that may
+    match; the candidates are then checked with their regex.  The trie is
+    built on demand, and rebuilt when the patterns change.
+
+    The patterns may be shared by several dispatchers (by default they are
+    a class attribute), so their version is kept with them: it is bumped
+    by 'add', and the trie of every dispatcher is rebuilt when it changes
+    (or when the number of patterns changes, if modified directly).
+    """
 
     patterns = OrderedDict()
     parser = URIPatternsParser
 
+    _trie = None
+    _trie_key = None
+
+
     def add(self, pattern, data):
         """Register a route pattern paired with some data"""
         parser = self.parser()
         regex = parser.get_regex(pattern)
         compiled_regex = re.compile(regex)
-        self.patterns[pattern] = (compiled_regex, data)
+        patterns = self.patterns
+        patterns[pattern] = (compiled_regex, data)
+        patterns.version = getattr(patterns, 'version', 0) + 1
+
+
+    def get_trie(self):
+        patterns = self.patterns
+        key = (id(patterns), getattr(patterns, 'version', 0), len(patterns))
+        if self._trie is not None and self._trie_key == key:
+            return self._trie
+
+        parser = self.parser()
+        trie = RouteNode()
+        order = {}
+        for pattern in patterns:
+            # The order is that of the first registration
+            if pattern not in order:
+                order[pattern] = len(order)
+        for pattern, i in order.iteritems():
+            compiled_regex, data = patterns[pattern]
+            segments = parser.get_segments(pattern)
+            trie.add(segments, (i, compiled_regex, data))
+
+        self._trie = trie
+        self._trie_key = key
+        return trie
 
 
     def resolve(self, path):
@@ -96,10 +252,16 @@ class URIDispatcher(object):
         Path resolution, look for a corresponding registered pattern
         and return associated data along with the extracted parameters.
         """
-        for pattern, values in self.patterns.iteritems():
-            compiled_regex, data = values
+        trie = self.get_trie()
+        candidates = []
+        trie.get_candidates(path.split('/'), 0, candidates)
+        # The regex '$' also matches before a trailing new line
+        if path[-1:] == '\n':
+            trie.get_candidates(path[:-1].split('/'), 0, candidates)
+
+        candidates.sort(key=itemgetter(0))
+        for i, compiled_regex, data in candidates:
             match = compiled_regex.search(path)
             if match:
                 return data, match.groupdict()
         return None
-
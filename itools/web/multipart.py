@@ -0,0 +1,270 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An incremental parser of multipart bodies (file uploads): it is fed the
+body as it is received, and writes the files too big to be kept in memory
+to temporary files.
+"""
+
+# Import from the Standard Library
+from cStringIO import StringIO
+from re import compile
+from tempfile import NamedTemporaryFile
+
+# Import from here
+from entities import read_headers
+
+
+# The end of the headers of a part
+headers_end = compile(r'\r?\n\r?\n')
+# The headers of a part must not be bigger than this
+headers_max_size = 64 * 1024
+
+# The states of the parser
+PREAMBLE, DELIMITER, HEADERS, BODY, EPILOGUE = range(5)
+
+
+
+class UploadFile(object):
+    """The body of an uploaded file too big to be kept in memory, it is
+    written to a temporary file (removed once closed).  It is a read-only
+    file object, its size is given by 'len'.  The path of the temporary file
+    is 'name'.
+    """
+
+    def __init__(self, dir=None):
+        self.file = NamedTemporaryFile(prefix='itools-upload-', dir=dir)
+        self.name = self.file.name
+        self.size = 0
+
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
+
+
+    def tell(self):
+        return self.file.tell()
+
+
+    def close(self):
+        self.file.close()
+
+
+
+class MultipartParser(object):
+    """Parses a multipart body fed by chunks (see 'feed'), and returns the
+    form (see 'close').
+
+    The values of the form are the same as the whole body was parsed at
+    once, except for the files bigger than 'spool_size' bytes (if given):
+    their body is an UploadFile, instead of a string.
+    """
+
+    def __init__(self, boundary, spool_size=None, spool_dir=None):
+        self.delimiter = '--%s' % boundary
+        # Keep the end of the buffer, it may be the beginning of a
+        # delimiter, preceded by the end of line
+        self.reserve = len(self.delimiter) + 2
+        self.spool_size = spool_size
+        self.spool_dir = spool_dir
+        # State
+        self.state = PREAMBLE
+        self.buffer = ''
+        self.size = 0
+        self.error = None
+        self.form = {}
+        # The part being parsed
+        self.headers = None
+        self.chunks = []
+        self.chunks_size = 0
+        self.file = None
+
+
+    def feed(self, data):
+        self.size += len(data)
+        if self.error is not None or self.state == EPILOGUE:
+            return
+
+        try:
+            self._feed(self.buffer + data)
+        except (KeyError, ValueError):
+            self.error = 'malformed multipart body'
+            self.abort()
+
+
+    def _feed(self, buffer):
+        delimiter = self.delimiter
+        while True:
+            state = self.state
+            if state == PREAMBLE:
+                i = buffer.find(delimiter)
+                if i == -1:
+                    self.buffer = buffer[-len(delimiter):]
+                    return
+                buffer = buffer[i + len(delimiter):]
+                self.state = DELIMITER
+            elif state == DELIMITER:
+                if len(buffer) < 2:
+                    self.buffer = buffer
+                    return
+                if buffer[:2] == '--':
+                    # The end
+                    self.buffer = ''
+                    self.state = EPILOGUE
+                    return
+                self.state = HEADERS
+            elif state == HEADERS:
+                match = headers_end.search(buffer)
+                if match is None:
+                    if len(buffer) > headers_max_size:
+                        raise ValueError, 'the headers are too big'
+                    self.buffer = buffer
+                    return
+                headers = buffer[:match.start()]
+                buffer = buffer[match.end():]
+                if headers.strip():
+                    headers = read_headers(StringIO(headers))
+                else:
+                    headers = {}
+                self.start_part(headers)
+                self.state = BODY
+            elif state == BODY:
+                i = buffer.find(delimiter)
+                if i == -1:
+                    n = len(buffer) - self.reserve
+                    if n > 0:
+                        self.write(buffer[:n])
+                        buffer = buffer[n:]
+                    self.buffer = buffer
+                    return
+                # The end of line before the delimiter is not part of the
+                # body
+                data = buffer[:i]
+                if data.endswith('\r\n'):
+                    data = data[:-2]
+                elif data.endswith('\n'):
+                    data = data[:-1]
+                self.write(data)
+                self.end_part()
+                buffer = buffer[i + len(delimiter):]
+                self.state = DELIMITER
+
+
+    def start_part(self, headers):
+        value, parameters = headers['content-disposition']
+        if 'name' not in parameters:
+            raise ValueError, 'expected the name of the field'
+        self.headers = headers
+        self.parameters = parameters
+        self.chunks = []
+        self.chunks_size = 0
+        self.file = None
+
+
+    def write(self, data):
+        if not data:
+            return
+
+        if self.file is not None:
+            self.file.write(data)
+            return
+
+        self.chunks.append(data)
+        self.chunks_size += len(data)
+        # Too big, spool to a temporary file (only files)
+        spool_size = self.spool_size
+        if spool_size is not None and self.chunks_size > spool_size:
+            if 'filename' in self.parameters:
+                self.file = UploadFile(self.spool_dir)
+                for data in self.chunks:
+                    self.file.write(data)
+                self.chunks = []
+
+
+    def end_part(self):
+        if self.file is None:
+            body = ''.join(self.chunks)
+        else:
+            body = self.file
+            body.file.flush()
+            body.seek(0)
+        self.chunks = []
+        self.file = None
+
+        form = self.form
+        headers = self.headers
+        parameters = self.parameters
+        name = parameters['name']
+        if 'filename' in parameters:
+            filename = parameters['filename']
+            if filename:
+                # Strip the path (for IE).
+                filename = filename.split('\\')[-1]
+                # Default content-type, see
+                # http://tools.ietf.org/html/rfc2045#section-5.2
+                if 'content-type' in headers:
+                    mimetype = headers['content-type'][0]
+                else:
+                    mimetype = 'text/plain'
+                form[name] = filename, mimetype, body
+            else:
+                form[name] = None
+        else:
+            if name not in form:
+                form[name] = body
+            else:
+                if isinstance(form[name], list):
+                    form[name].append(body)
+                else:
+                    form[name] = [form[name], body]
+
+
+    def abort(self):
+        """Removes the temporary files.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        for value in self.form.itervalues():
+            if type(value) is tuple and isinstance(value[2], UploadFile):
+                value[2].close()
+
+
+    def close(self):
+        """Returns the form.  The part not finished, if any, is ignored.
+        """
+        if self.error is not None:
+            raise ValueError, self.error
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.buffer = ''
+        return self.form
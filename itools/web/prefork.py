@@ -0,0 +1,358 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A prefork front-end for the web server: a master process binds the
+sockets and forks the workers, each one a web server with its own
+database (shared-nothing).
+
+The readers share the public socket, their database is read-only; the
+writer listens to a socket of its own, the front-end proxy must send
+the requests that change the database (POST, PUT, PATCH, DELETE) there.
+The readers see the changes once committed (see 'RODatabase.sync').
+"""
+
+# Import from the Standard Library
+from errno import EINTR
+from json import dumps, loads
+from os import close, fdopen, fork, getpid, kill, pipe, read, waitpid
+from os import remove, rename, _exit, WNOHANG
+from select import select, error as select_error
+from signal import signal, SIGHUP, SIGINT, SIGTERM, SIGUSR1, SIG_DFL
+from signal import SIG_IGN
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from time import sleep, time
+from traceback import print_exc
+
+# Import from itools
+from itools.core import vmsize
+from itools.loop import Loop, cron
+
+
+def make_socket(address, port, backlog=128):
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    sock.bind((address or '', port))
+    sock.listen(backlog)
+    return sock
+
+
+
+class Worker(object):
+    """The master's view of a worker process.
+    """
+
+    def __init__(self, pid, role, fd, replaces=None):
+        self.pid = pid
+        self.role = role
+        # The read end of the pipe the worker reports its health to
+        self.fd = fd
+        self.buffer = ''
+        self.health = {}
+        self.started = time()
+        # The old worker to drain once this one is ready (see 'restart')
+        self.replaces = replaces
+
+
+
+class PreforkServer(object):
+    """Runs the web server in N read-only workers, sharing the socket bound
+    to the given address and port, and optionally in a writer, alone on the
+    socket bound to the given writer address and port.
+
+    The workers are built by calling 'make_server(read_only)', which must
+    open the database (read-only or not) and return the web server.
+
+    The master:
+
+    - restarts the workers that die, and recycles them after they have
+      served 'max_requests' requests (if given);
+
+    - on SIGHUP, restarts the workers gracefully: every old worker is
+      drained (see 'drain_signal') once the new one replacing it is ready,
+      this is to say once it has sent its first health report;
+
+    - on SIGTERM or SIGINT, stops the workers and quits;
+
+    - aggregates the health of the workers (requests served, memory) and
+      writes it to 'status_file' (if given), as JSON.
+    """
+
+    # Seconds between two health reports
+    health_interval = 5
+    # On this signal a worker stops accepting connections, and quits once
+    # the requests in progress are done, or after 'drain_timeout' seconds
+    drain_signal = SIGUSR1
+    drain_timeout = 60
+
+
+    def __init__(self, make_server, address, port, workers=4,
+                 writer_address=None, writer_port=None, max_requests=None,
+                 pid_file=None, status_file=None):
+        self.make_server = make_server
+        self.address = address
+        self.port = port
+        self.n_workers = workers
+        self.writer_address = writer_address
+        self.writer_port = writer_port
+        self.max_requests = max_requests
+        self.pid_file = pid_file
+        self.status_file = status_file
+        # State
+        self.workers = {}
+        self.stopping = False
+        self.restarting = False
+
+
+    #######################################################################
+    # Master
+    #######################################################################
+    def run(self):
+        # Bind
+        self.socket = make_socket(self.address, self.port)
+        self.writer_socket = None
+        if self.writer_port is not None:
+            self.writer_socket = make_socket(self.writer_address,
+                                             self.writer_port)
+        address = self.address if self.address is not None else '*'
+        print 'Listen %s:%d (%d workers)' % (address, self.port,
+                                             self.n_workers)
+
+        # Graceful stop
+        if self.pid_file:
+            open(self.pid_file, 'w').write(str(getpid()))
+
+        signal(SIGTERM, self.on_stop)
+        signal(SIGINT, self.on_stop)
+        signal(SIGHUP, self.on_restart)
+
+        # Go
+        self.spawn_workers()
+        try:
+            while not self.stopping or self.workers:
+                if self.restarting:
+                    self.restarting = False
+                    self.restart()
+                self.read_health(1.0)
+                self.reap()
+                self.write_status()
+        finally:
+            if self.pid_file:
+                remove(self.pid_file)
+
+
+    def on_stop(self, signum, frame):
+        if not self.stopping:
+            print 'Shutting down the server...'
+            self.stopping = True
+            self.kill_workers(self.workers.keys())
+
+
+    def on_restart(self, signum, frame):
+        self.restarting = True
+
+
+    def spawn_workers(self):
+        roles = [ x.role for x in self.workers.itervalues() ]
+        if self.writer_socket is not None and 'writer' not in roles:
+            self.spawn('writer')
+        for i in range(self.n_workers - roles.count('reader')):
+            self.spawn('reader')
+
+
+    def restart(self):
+        # The new workers first, the old ones are drained once the new ones
+        # are ready (see 'read_health').  The workers starting, and those
+        # already being replaced, are left alone.
+        workers = self.workers.values()
+        replaced = set([ x.replaces for x in workers ])
+        for worker in workers:
+            if worker.role is None or worker.replaces is not None:
+                continue
+            if worker.pid not in replaced:
+                self.spawn(worker.role, worker.pid)
+
+
+    def kill_workers(self, pids, signum=SIGTERM):
+        for pid in pids:
+            worker = self.workers.get(pid)
+            if worker is not None:
+                worker.role = None
+                self.signal_worker(pid, signum)
+
+
+    def signal_worker(self, pid, signum):
+        try:
+            kill(pid, signum)
+        except OSError:
+            pass
+
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = waitpid(-1, WNOHANG)
+            except OSError:
+                return
+            if pid == 0:
+                return
+
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            close(worker.fd)
+            # Replace the worker (unless stopped on purpose)
+            if worker.role is not None and not self.stopping:
+                if time() - worker.started < 1:
+                    # Do not fork like crazy if the workers die at start
+                    sleep(1)
+                self.spawn(worker.role, worker.replaces)
+
+
+    def read_health(self, timeout):
+        fds = dict([ (x.fd, x) for x in self.workers.itervalues() ])
+        try:
+            ready = select(fds.keys(), [], [], timeout)[0]
+        except select_error, e:
+            if e.args[0] == EINTR:
+                return
+            raise
+
+        for fd in ready:
+            worker = fds[fd]
+            data = read(fd, 4096)
+            if not data:
+                continue
+            lines = (worker.buffer + data).split('\n')
+            worker.buffer = lines.pop()
+            if lines:
+                worker.health = loads(lines[-1])
+                # Ready, drain the worker it replaces
+                if worker.replaces is not None:
+                    self.kill_workers([worker.replaces], self.drain_signal)
+                    worker.replaces = None
+
+
+    def get_status(self):
+        """Returns the health of the workers, and the totals.
+        """
+        workers = []
+        requests = 0
+        for pid, worker in sorted(self.workers.iteritems()):
+            health = worker.health
+            requests += health.get('requests', 0)
+            workers.append({'pid': pid, 'role': worker.role,
+                            'started': worker.started,
+                            'requests': health.get('requests', 0),
+                            'vmsize': health.get('vmsize', 0)})
+        return {'pid': getpid(), 'workers': workers, 'requests': requests}
+
+
+    def write_status(self):
+        if self.status_file is None:
+            return
+        # Atomic
+        path = '%s.tmp' % self.status_file
+        open(path, 'w').write(dumps(self.get_status()))
+        rename(path, self.status_file)
+
+
+    def spawn(self, role, replaces=None):
+        rfd, wfd = pipe()
+        pid = fork()
+        if pid:
+            # Master
+            close(wfd)
+            self.workers[pid] = Worker(pid, role, rfd, replaces)
+            return pid
+
+        # Worker
+        close(rfd)
+        try:
+            self.run_worker(role, wfd)
+        except Exception:
+            print_exc()
+            _exit(1)
+        _exit(0)
+
+
+    #######################################################################
+    # Worker
+    #######################################################################
+    def run_worker(self, role, fd):
+        # Signals: the loop handles SIGTERM and SIGINT, restarts are the
+        # master's business
+        for signum in SIGTERM, SIGINT:
+            signal(signum, SIG_DFL)
+        signal(SIGHUP, SIG_IGN)
+
+        # Drain: stop accepting connections, quit once the requests in
+        # progress are done (or after the timeout)
+        loop = Loop()
+        server = None
+        def drain(signum=None, frame=None):
+            if not loop.is_running():
+                # Not serving yet
+                _exit(0)
+            server.stop_listening()
+            deadline = time() + self.drain_timeout
+            def check():
+                if server.get_pending() == 0 or time() > deadline:
+                    loop.quit()
+                    return False
+                return True
+            if check():
+                cron(check, 1)
+        signal(self.drain_signal, drain)
+
+        # Not ours
+        for worker in self.workers.itervalues():
+            close(worker.fd)
+        self.workers = {}
+        if role == 'writer':
+            self.socket.close()
+            sock = self.writer_socket
+        else:
+            if self.writer_socket is not None:
+                self.writer_socket.close()
+            sock = self.socket
+
+        # The server
+        read_only = (role == 'reader')
+        server = self.make_server(read_only)
+        server.sync_database = read_only
+        server.listen_socket(sock.fileno())
+
+        # Report the health to the master, and drain once served enough
+        # requests (to be replaced by a fresh worker)
+        pipe = fdopen(fd, 'w', 0)
+        max_requests = self.max_requests
+        def report():
+            health = {'requests': server.n_requests, 'vmsize': vmsize()}
+            try:
+                pipe.write(dumps(health) + '\n')
+            except IOError:
+                # The master is gone
+                loop.quit()
+                return False
+            if max_requests and server.n_requests >= max_requests:
+                drain()
+                return False
+            return True
+        report()
+        cron(report, self.health_interval)
+
+        loop.run()
@@ -74,24 +74,86 @@ class RequestMethod(object):
         if context.method == 'GET':
             # 1. Get the view's modification time
             mtime = context.view.get_mtime(context.resource)
-            if mtime is None:
-                return
-            mtime = mtime.replace(microsecond=0)
-            # If naive, assume local time
-            if mtime.tzinfo is None:
-                mtime = local_tz.localize(mtime)
-
-            # 2. Set Last-Modified
-            context.mtime = mtime
-
-            # 3. Check for If-Modified-Since
-            if_modified_since = context.get_header('if-modified-since')
-            if if_modified_since and if_modified_since >= mtime:
-                context.set_header('Last-Modified', mtime)
-                # Cache-Control: max-age=1
-                # (because Apache does not cache pages with a query by default)
-                context.set_header('Cache-Control', 'max-age=1')
-                raise NotModified
+            if mtime is not None:
+                mtime = mtime.replace(microsecond=0)
+                # If naive, assume local time
+                if mtime.tzinfo is None:
+                    mtime = local_tz.localize(mtime)
+
+                # 2. Set Last-Modified
+                context.mtime = mtime
+
+                # 3. Check for If-Modified-Since
+                if_modified_since = context.get_header('if-modified-since')
+                if if_modified_since and if_modified_since >= mtime:
+                    context.set_header('Last-Modified', mtime)
+                    # Cache-Control: max-age=1
+                    # (because Apache does not cache pages with a query by
+                    # default)
+                    context.set_header('Cache-Control', 'max-age=1')
+                    raise NotModified
+
+            # 4. The server's cache
+            cls.check_page_cache(context)
+
+
+    @classmethod
+    def check_page_cache(cls, context):
+        """Sets the response from the server's cache, if the view asks for
+        it (see 'ItoolsView.cache_page') and there is a response still
+        valid: the database has not changed since (see its 'generation'),
+        and neither has the view's mtime.  The response stands for the
+        view's, the 'after_traverse' hook runs as usual.
+        """
+        cache = context.server.page_cache
+        view = context.view
+        if cache is None or not view.cache_page:
+            return
+
+        resource = context.resource
+        vary = view.get_page_cache_key(resource, context)
+        if vary is False:
+            return
+        language = view.get_page_cache_language(resource, context)
+        key = context.page_key = (str(context.uri), language, vary)
+
+        entry = cache.get(key)
+        if entry is None:
+            return
+        generation, mtime, content_type, data = entry
+        if generation != context.database.generation:
+            del cache[key]
+            return
+        if mtime != context.mtime:
+            del cache[key]
+            return
+
+        # Hit
+        cache.touch(key)
+        context.page_hit = True
+        context.status = 200
+        context.content_type = content_type
+        context.entity = data
+
+
+    @classmethod
+    def set_page_cache(cls, context):
+        """Keeps the response of the view in the server's cache, if asked
+        for it (see 'check_page_cache').  Only the content type and the body
+        are kept, so the responses with headers (or cookies) are not.
+        """
+        key = context.page_key
+        if key is None or context.page_hit or context.commit:
+            return
+        if context.status != 200 or type(context.entity) is not str:
+            return
+        if context.response_headers:
+            return
+
+        generation = context.database.generation
+        context.server.page_cache[key] = (generation, context.mtime,
+                                          context.content_type,
+                                          context.entity)
 
 
     @classmethod
@@ -219,8 +281,10 @@ class RequestMethod(object):
                 cls.internal_server_error(context)
                 method = None
             else:
-                # GET, POST...
-                method = getattr(view, context.method)
+                # GET, POST... (unless the response is from the server's
+                # cache)
+                if not context.page_hit:
+                    method = getattr(view, context.method)
             # 2) The form
             if context.method in ['POST', 'PUT', 'PATCH']:
                 try:
@@ -258,6 +322,9 @@ class RequestMethod(object):
                 cls.set_status_from_entity(context)
             context.database.abort_changes()
 
+        # Keep the response of the view in the server's cache
+        cls.set_page_cache(context)
+
         # (6) After Traverse hook
         try:
             context.site_root.after_traverse(context)
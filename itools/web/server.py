@@ -25,14 +25,22 @@ from datetime import timedelta
 from time import strftime
 
 # Import from itools
+from itools.core import SizedLRUCache
 from itools.i18n import init_language_selector
-from itools.log import Logger, register_logger, log_info
+from itools.log import Logger, register_logger, log_error, log_info
 from context import select_language
+from compression import compressible_types
 from context import WebLogger, get_context, set_context
+from headers import ContentType
+from multipart import MultipartParser
 from soup import SoupServer, SoupMessage
 from dispatcher import URIDispatcher
 
 class WebServer(SoupServer):
+    """The requests are handled one at a time, in the thread of the main
+    loop; the server, and everything behind the request context, is not
+    thread-safe (see 'itools.web.context.set_context').
+    """
 
     access_log = None
     event_log = None
@@ -43,6 +51,32 @@ class WebServer(SoupServer):
     accept_cors = False
     dispatcher = URIDispatcher()
 
+    # Set by the read-only workers of a prefork server (see
+    # 'itools.web.prefork'), to see the changes committed by the writer
+    sync_database = False
+    # The number of requests served
+    n_requests = 0
+
+    # The files uploaded bigger than this (in bytes) are written to
+    # temporary files, in the given folder (by default the system's one).
+    # None to keep them in memory.
+    upload_spool_size = 2**20
+    upload_dir = None
+
+    # Compress the responses (with gzip or deflate, as accepted by the
+    # client) of the given media types, from the given size (in bytes).
+    # The level goes from 1 (fast) to 9 (small), 0 disables compression.
+    # The streams are not compressed.
+    compress_level = 6
+    compress_min_size = 1024
+    compress_types = compressible_types
+    compress_codings = ('gzip', 'deflate')
+
+    # The size (in bytes) of the server-side cache of the GET responses, for
+    # the views that ask for it (see 'ItoolsView.cache_page').  0 disables
+    # the cache.
+    page_cache_size = 0
+
 
     def __init__(self, root, access_log=None, event_log=None):
         super(WebServer, self).__init__()
@@ -57,11 +91,21 @@ class WebServer(SoupServer):
 
         # Useful the current uploads stats
         self.upload_stats = {}
+        # The multipart bodies being received {message key: parser}
+        self.uploads = {}
+        # The GET responses {(uri, language, key): (generation,
+        # mtime, content type, body)}, bounded by the size of the bodies
+        self.page_cache = None
+        if self.page_cache_size:
+            self.page_cache = SizedLRUCache(
+                10000, 11000, budgets={None: self.page_cache_size},
+                get_sizeof=lambda x: len(x[3]))
 
 
     def log_access(self, host, request_line, status_code, body_length):
         if host:
             host = host.split(',', 1)[0].strip()
+        self.n_requests += 1
         now = strftime('%d/%b/%Y:%H:%M:%S')
         message = '%s - - [%s] "%s" %d %d\n' % (host, now, request_line,
                                                 status_code, body_length)
@@ -69,17 +113,29 @@ class WebServer(SoupServer):
 
 
     def listen(self, address, port):
+        super(WebServer, self).listen(address, port)
+        self._add_handlers()
+        # Say hello
+        address = address if address is not None else '*'
+        print 'Listen %s:%d' % (address, port)
+
+
+    def listen_socket(self, fd):
+        """Like 'listen', but with a socket already bound and listening (its
+        file descriptor), shared by the processes of a prefork server.
+        """
+        super(WebServer, self).listen_socket(fd)
+        self._add_handlers()
+
+
+    def _add_handlers(self):
         # Language negotiation
         init_language_selector(select_language)
         # Add handlers
-        super(WebServer, self).listen(address, port)
         self.add_handler('*', self.star_callback)
         context = self.root.context_cls(
             database=self.database, server=self)
         self.add_handler('/', context.handle_request)
-        # Say hello
-        address = address if address is not None else '*'
-        print 'Listen %s:%d' % (address, port)
 
 
     def do_request(self, method='GET', path='/', headers=None, body='',
@@ -144,6 +200,55 @@ class WebServer(SoupServer):
             self.upload_stats[upload_id] = (uploaded_size, total_size)
 
 
+    def start_upload(self, key, content_type):
+        """This function is called by the C part of your server, when the
+        headers of a multipart request have been received.  Returns whether
+        the body is to be parsed as received (see 'got_upload_chunk'),
+        instead of kept in memory.
+        """
+        try:
+            value, parameters = ContentType.decode(content_type)
+            boundary = parameters.get('boundary')
+            if not boundary:
+                return False
+            parser = MultipartParser(boundary, self.upload_spool_size,
+                                     self.upload_dir)
+        except Exception:
+            log_error('Internal error', domain='itools.web')
+            return False
+
+        self.uploads[key] = parser
+        return True
+
+
+    def got_upload_chunk(self, key, data, upload_id, total_size):
+        """This function is called by the C part of your server, for every
+        chunk of a multipart body (see 'start_upload').
+        """
+        parser = self.uploads.get(key)
+        if parser is None:
+            return
+        try:
+            parser.feed(data)
+        except Exception:
+            # Writing the temporary file failed (disk full?)
+            log_error('Internal error', domain='itools.web')
+            parser.error = 'the upload failed'
+            parser.abort()
+        if upload_id:
+            self.set_upload_stats(upload_id, parser.size, total_size)
+
+
+    def end_upload(self, key):
+        """This function is called by the C part of your server, once the
+        request is done.  Removes the temporary files of the upload, if not
+        used.
+        """
+        parser = self.uploads.pop(key, None)
+        if parser is not None:
+            parser.abort()
+
+
     def stop(self):
         super(WebServer, self).stop()
         if self.access_log:
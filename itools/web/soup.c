@@ -197,11 +197,95 @@ got_chunk_callback (SoupMessage * s_msg, SoupBuffer * chunk,
 }
 
 
+/* The key of the message, to identify it from Python (see
+ * PyMessage_get_key) */
+#define MESSAGE_KEY(s_msg) ((unsigned PY_LONG_LONG) (size_t) (s_msg))
+
+
+/* Tells whether the body of the request may be a multipart body, parsed as
+ * received by Python */
+static int
+has_upload_body (SoupMessage * s_msg)
+{
+  if (s_msg->method == NULL)
+    return 0;
+  return (strcmp (s_msg->method, "POST") == 0 ||
+          strcmp (s_msg->method, "PUT") == 0 ||
+          strcmp (s_msg->method, "PATCH") == 0);
+}
+
+
+/* Multipart bodies are not kept in memory, the chunks are given to the
+ * parser of the Python server */
+static void
+got_upload_chunk_callback (SoupMessage * s_msg, SoupBuffer * chunk,
+                           gpointer user_data)
+{
+  unsigned int id, total_size;
+  PyObject *p_result;
+  PyObject *p_server = (PyObject *) user_data;
+
+  total_size = (unsigned int)
+    soup_message_headers_get_content_length (s_msg->request_headers);
+  id = get_upload_id (s_msg);
+
+  p_result = PyObject_CallMethod (p_server, "got_upload_chunk", "Ks#II",
+                                  MESSAGE_KEY (s_msg), chunk->data,
+                                  (int) chunk->length, id, total_size);
+  /* The Python callback should never fail, it is its responsibility to catch
+   * and handle exceptions */
+  if (p_result == NULL)
+    {
+      printf (
+      "ERROR! Python's got_upload_chunk failed, this should never happen\n");
+      abort ();
+    }
+  Py_DECREF (p_result);
+}
+
+
 /* Just useful for the upload percent computation */
 static void
 got_headers_callback (SoupMessage * s_msg, gpointer user_data)
 {
   unsigned int id;
+  const char *content_type;
+  PyObject *p_result;
+  PyObject *p_server = (PyObject *) user_data;
+  int streaming;
+
+  /* A request in progress (see 'get_pending') */
+  g_object_set_data (G_OBJECT (s_msg), "itools-pending", GINT_TO_POINTER (1));
+  ((PyServer *) p_server)->n_pending++;
+
+  /* Multipart bodies */
+  if (has_upload_body (s_msg))
+    {
+      content_type = soup_message_headers_get_one (s_msg->request_headers,
+                                                   "Content-Type");
+      if (content_type != NULL &&
+          g_ascii_strncasecmp (content_type, "multipart/", 10) == 0)
+        {
+          p_result = PyObject_CallMethod (p_server, "start_upload", "Ks",
+                                          MESSAGE_KEY (s_msg), content_type);
+          if (p_result == NULL)
+            {
+              printf (
+        "ERROR! Python's start_upload failed, this should never happen\n");
+              abort ();
+            }
+          streaming = PyObject_IsTrue (p_result);
+          Py_DECREF (p_result);
+          if (streaming == 1)
+            {
+              soup_message_body_set_accumulate (s_msg->request_body, FALSE);
+              g_signal_connect (s_msg, "got-chunk",
+                                G_CALLBACK (got_upload_chunk_callback),
+                                user_data);
+              return;
+            }
+        }
+    }
 
   /* Just for POST */
   if (s_msg->method == NULL || strcmp (s_msg->method, "POST") != 0)
@@ -284,6 +368,13 @@ PyMessage_get_body (PyMessage * self, PyObject * args, PyObject * kwdict)
 }
 
 
+static PyObject *
+PyMessage_get_key (PyMessage * self, PyObject * args, PyObject * kwdict)
+{
+  return Py_BuildValue ("K", MESSAGE_KEY (self->s_msg));
+}
+
+
 static PyObject *
 PyMessage_get_headers (PyMessage * self, PyObject * args, PyObject * kwdict)
 {
@@ -337,6 +428,24 @@ PyMessage_get_header (PyMessage * self, PyObject * args, PyObject * kwdict)
 }
 
 
+static PyObject *
+PyMessage_get_response_header (PyMessage * self, PyObject * args,
+                               PyObject * kwdict)
+{
+  char *name;
+  const char *value;
+
+  if (!PyArg_ParseTuple (args, "s", &name))
+    return NULL;
+
+  value = soup_message_headers_get_one (self->s_msg->response_headers, name);
+  if (value == NULL)
+    Py_RETURN_NONE;
+
+  return PyString_FromString (value);
+}
+
+
 static PyObject *
 PyMessage_get_host (PyMessage * self, PyObject * args, PyObject * kwdict)
 {
@@ -409,17 +518,155 @@ PyMessage_set_request_header (PyMessage * self, PyObject * args, PyObject * kwdi
 }
 
 
+/* The Python objects given as bodies are not copied, libsoup keeps a
+ * reference to them until the data has been sent */
+static void
+release_body (gpointer p_body)
+{
+  PyGILState_STATE state;
+
+  state = PyGILState_Ensure ();
+  Py_DECREF ((PyObject *) p_body);
+  PyGILState_Release (state);
+}
+
+
+static SoupBuffer *
+make_buffer (PyObject * p_body)
+{
+  const void *data;
+  Py_ssize_t length;
+
+  /* Unicode is encoded with the default encoding (as "s#" does) */
+  if (PyUnicode_Check (p_body))
+    {
+      p_body = PyUnicode_AsEncodedString (p_body, NULL, NULL);
+      if (p_body == NULL)
+        return NULL;
+    }
+  else
+    Py_INCREF (p_body);
+
+  /* Strings, and any object with the buffer interface (mmap, etc.) */
+  if (PyObject_AsReadBuffer (p_body, &data, &length) == -1)
+    {
+      Py_DECREF (p_body);
+      return NULL;
+    }
+
+  return soup_buffer_new_with_owner (data, (gsize) length, p_body,
+                                     release_body);
+}
+
+
 static PyObject *
 PyMessage_set_response (PyMessage * self, PyObject * args, PyObject * kwdict)
 {
-  char *content_type, *body;
-  int content_length;
+  char *content_type;
+  PyObject *p_body;
+  SoupBuffer *s_buffer;
+
+  if (!PyArg_ParseTuple (args, "sO", &content_type, &p_body))
+    return NULL;
+
+  s_buffer = make_buffer (p_body);
+  if (s_buffer == NULL)
+    return NULL;
+
+  soup_message_headers_replace (self->s_msg->response_headers,
+                                "Content-Type", content_type);
+  soup_message_body_truncate (self->s_msg->response_body);
+  soup_message_body_append_buffer (self->s_msg->response_body, s_buffer);
+  soup_buffer_free (s_buffer);
+
+  Py_RETURN_NONE;
+}
+
+
+/* Streaming: the body is read from a Python iterator, a chunk is appended
+ * once the previous one has been written, so the response is never held in
+ * memory */
+static void
+stream_next (SoupMessage * s_msg)
+{
+  PyObject *p_iter, *p_chunk;
+  SoupBuffer *s_buffer;
+
+  p_iter = (PyObject *) g_object_get_data (G_OBJECT (s_msg), "itools-stream");
+  if (p_iter == NULL)
+    return;
+
+  /* Skip the empty chunks, they would pause the message */
+  while ((p_chunk = PyIter_Next (p_iter)) != NULL)
+    {
+      s_buffer = make_buffer (p_chunk);
+      Py_DECREF (p_chunk);
+      if (s_buffer == NULL)
+        break;
+      if (s_buffer->length == 0)
+        {
+          soup_buffer_free (s_buffer);
+          continue;
+        }
+      soup_message_body_append_buffer (s_msg->response_body, s_buffer);
+      soup_buffer_free (s_buffer);
+      return;
+    }
+
+  /* The end (or an error, the response is then truncated) */
+  if (PyErr_Occurred ())
+    {
+      printf ("ERROR! The iterator of the response body failed\n");
+      PyErr_Print ();
+    }
+  g_object_set_data (G_OBJECT (s_msg), "itools-stream", NULL);
+  soup_message_body_complete (s_msg->response_body);
+}
+
+
+static void
+wrote_chunk_callback (SoupMessage * s_msg, gpointer user_data)
+{
+  stream_next (s_msg);
+}
+
+
+static PyObject *
+PyMessage_set_response_stream (PyMessage * self, PyObject * args,
+                               PyObject * kwdict)
+{
+  char *content_type;
+  PyObject *p_iterable, *p_iter;
+  PY_LONG_LONG length = -1;
+  SoupMessage *s_msg = self->s_msg;
 
-  if (!PyArg_ParseTuple (args, "ss#", &content_type, &body, &content_length))
+  if (!PyArg_ParseTuple (args, "sO|L", &content_type, &p_iterable, &length))
     return NULL;
 
-  soup_message_set_response (self->s_msg, content_type, SOUP_MEMORY_COPY,
-                             body, (gsize) content_length);
+  p_iter = PyObject_GetIter (p_iterable);
+  if (p_iter == NULL)
+    return NULL;
+
+  /* Headers: Content-Length if known, chunked encoding otherwise */
+  soup_message_headers_replace (s_msg->response_headers, "Content-Type",
+                                content_type);
+  if (length >= 0)
+    soup_message_headers_set_content_length (s_msg->response_headers,
+                                             (goffset) length);
+  else
+    soup_message_headers_set_encoding (s_msg->response_headers,
+                                       SOUP_ENCODING_CHUNKED);
+
+  /* Body: do not keep the chunks written */
+  soup_message_body_truncate (s_msg->response_body);
+  soup_message_body_set_accumulate (s_msg->response_body, FALSE);
+  g_object_set_data_full (G_OBJECT (s_msg), "itools-stream", p_iter,
+                          release_body);
+  g_signal_connect (s_msg, "wrote-chunk", G_CALLBACK (wrote_chunk_callback),
+                    NULL);
+
+  /* The first chunk */
+  stream_next (s_msg);
 
   Py_RETURN_NONE;
 }
@@ -448,10 +695,14 @@ static PyMethodDef PyMessage_methods[] = {
    "Returns the request line"},
   {"get_body", (PyCFunction) PyMessage_get_body, METH_NOARGS,
    "Returns the body of the request"},
+  {"get_key", (PyCFunction) PyMessage_get_key, METH_NOARGS,
+   "Returns the key of the message (see WebServer.start_upload)"},
   {"get_headers", (PyCFunction) PyMessage_get_headers, METH_NOARGS,
    "Returns all the headers of the request"},
   {"get_header", (PyCFunction) PyMessage_get_header, METH_VARARGS,
    "Returns the value of the given request header"},
+  {"get_response_header", (PyCFunction) PyMessage_get_response_header,
+   METH_VARARGS, "Returns the value of the given response header"},
   {"get_host", (PyCFunction) PyMessage_get_host, METH_NOARGS,
    "Get the host from the request uri"},
   {"get_method", (PyCFunction) PyMessage_get_method, METH_NOARGS,
@@ -463,7 +714,12 @@ static PyMethodDef PyMessage_methods[] = {
   {"set_request_header", (PyCFunction) PyMessage_set_request_header, METH_VARARGS,
    "Set the given request header"},
   {"set_response", (PyCFunction) PyMessage_set_response, METH_VARARGS,
-   "Set the response body"},
+   "Set the response body (a string, or an object with the buffer "
+   "interface)"},
+  {"set_response_stream", (PyCFunction) PyMessage_set_response_stream,
+   METH_VARARGS,
+   "Set the response body, read from the given iterable (of strings) "
+   "while it is sent"},
   {"set_status", (PyCFunction) PyMessage_set_status, METH_VARARGS,
    "Set the response status code"},
   {NULL}                        /* Sentinel */
@@ -521,6 +777,8 @@ typedef struct
 {
   PyObject_HEAD
   SoupServer * s_server;
+  /* The requests in progress (their headers received) */
+  unsigned int n_pending;
 } PyServer;
 
 
@@ -541,6 +799,27 @@ request_end_callback (SoupServer * s_server, SoupMessage * s_msg,
   PyObject *p_result;
   PyObject *p_server = (PyObject *) user_data;
 
+  /* The request is done */
+  if (g_object_get_data (G_OBJECT (s_msg), "itools-pending") != NULL)
+    {
+      g_object_set_data (G_OBJECT (s_msg), "itools-pending", NULL);
+      ((PyServer *) p_server)->n_pending--;
+    }
+
+  /* Remove what is left of the multipart body */
+  if (has_upload_body (s_msg))
+    {
+      p_result = PyObject_CallMethod (p_server, "end_upload", "K",
+                                      MESSAGE_KEY (s_msg));
+      if (p_result == NULL)
+        {
+          printf (
+          "ERROR! Python's end_upload failed, this should never happen\n");
+          abort ();
+        }
+      Py_DECREF (p_result);
+    }
+
   /* Just useful for the upload percent computation */
   /* Just for POST with upload_id=xxx */
   if (s_msg->method != NULL && strcmp (s_msg->method, "POST") == 0 &&
@@ -599,13 +878,38 @@ s_server_callback (SoupServer * s_server, SoupMessage * s_msg,
 }
 
 
+static int
+make_server (PyServer * self)
+{
+  SoupServer *s_server;
+
+  /* s_server */
+  s_server = soup_server_new (SOUP_SERVER_SERVER_HEADER, "itools.web", NULL);
+  if (!s_server)
+    {
+      PyErr_Format (PyExc_RuntimeError, "could not make the SoupServer");
+      return -1;
+    }
+  self->s_server = s_server;
+
+  /* Signals */
+  g_signal_connect (s_server, "request-started",
+                    G_CALLBACK (request_started_callback), (gpointer) self);
+  g_signal_connect (s_server, "request-finished",
+                    G_CALLBACK (request_end_callback), (gpointer) self);
+  g_signal_connect (s_server, "request-aborted",
+                    G_CALLBACK (request_end_callback), (gpointer) self);
+
+  return 0;
+}
+
+
 static PyObject *
 PyServerType_listen (PyServer * self, PyObject * args, PyObject * kwdict)
 {
   /* libsoup variables */
   char *address = NULL;
   guint port = 8080;
-  SoupServer *s_server;
   GInetAddress *s_address = NULL;
   GSocketAddress *s_socket_address = NULL;
   gboolean success;
@@ -627,21 +931,8 @@ PyServerType_listen (PyServer * self, PyObject * args, PyObject * kwdict)
     }
 
   /* s_server */
-  s_server = soup_server_new (SOUP_SERVER_SERVER_HEADER, "itools.web", NULL);
-  if (!s_server)
-    {
-      PyErr_Format (PyExc_RuntimeError, "could not make the SoupServer");
-      return NULL;
-    }
-  self->s_server = s_server;
-
-  /* Signals */
-  g_signal_connect (s_server, "request-started",
-                    G_CALLBACK (request_started_callback), (gpointer) self);
-  g_signal_connect (s_server, "request-finished",
-                    G_CALLBACK (request_end_callback), (gpointer) self);
-  g_signal_connect (s_server, "request-aborted",
-                    G_CALLBACK (request_end_callback), (gpointer) self);
+  if (make_server (self) != 0)
+    return NULL;
 
   /* Go */
   //soup_server_run_async (self->s_server);
@@ -658,6 +949,50 @@ PyServerType_listen (PyServer * self, PyObject * args, PyObject * kwdict)
 }
 
 
+static PyObject *
+PyServerType_listen_socket (PyServer * self, PyObject * args,
+                            PyObject * kwdict)
+{
+  int fd;
+  GSocket *s_socket;
+  GError *error = NULL;
+  gboolean success;
+
+  /* Arguments: the file descriptor of a socket already bound and
+   * listening (shared by the processes of a prefork server) */
+  if (!PyArg_ParseTuple (args, "i", &fd))
+    return NULL;
+
+  s_socket = g_socket_new_from_fd (fd, &error);
+  if (!s_socket)
+    {
+      PyErr_Format (PyExc_RuntimeError, "Bad socket: %s", error->message);
+      g_error_free (error);
+      return NULL;
+    }
+
+  /* s_server */
+  if (make_server (self) != 0)
+    {
+      g_object_unref (s_socket);
+      return NULL;
+    }
+
+  /* Go */
+  success = soup_server_listen_socket (self->s_server, s_socket, 0, &error);
+  g_object_unref (s_socket);
+  if (!success)
+    {
+      PyErr_Format (PyExc_RuntimeError, "Cannot listen server: %s",
+                    error->message);
+      g_error_free (error);
+      return NULL;
+    }
+
+  Py_RETURN_NONE;
+}
+
+
 static PyObject *
 PyServerType_stop (PyServer * self, PyObject * args, PyObject * kwdict)
 {
@@ -666,6 +1001,35 @@ PyServerType_stop (PyServer * self, PyObject * args, PyObject * kwdict)
 }
 
 
+static PyObject *
+PyServerType_stop_listening (PyServer * self, PyObject * args,
+                             PyObject * kwdict)
+{
+  GSList *listeners, *iter;
+
+  if (self->s_server == NULL)
+    Py_RETURN_NONE;
+
+  /* Close the listening sockets (in this process, a shared socket stays
+   * open in the others); the connections open and the requests in progress
+   * go on */
+  listeners = soup_server_get_listeners (self->s_server);
+  for (iter = listeners; iter; iter = iter->next)
+    g_socket_close (G_SOCKET (iter->data), NULL);
+  g_slist_free (listeners);
+
+  Py_RETURN_NONE;
+}
+
+
+static PyObject *
+PyServerType_get_pending (PyServer * self, PyObject * args,
+                          PyObject * kwdict)
+{
+  return PyInt_FromLong (self->n_pending);
+}
+
+
 static PyObject *
 PyServerType_add_handler (PyServer * self, PyObject * args, PyObject * kwdict)
 {
@@ -686,7 +1050,13 @@ PyServerType_add_handler (PyServer * self, PyObject * args, PyObject * kwdict)
 static PyMethodDef PyServer_methods[] = {
   {"listen", (PyCFunction) PyServerType_listen, METH_VARARGS,
    "Listen to the given interface and port"},
+  {"listen_socket", (PyCFunction) PyServerType_listen_socket, METH_VARARGS,
+   "Listen to the given socket (a file descriptor)"},
   {"stop", (PyCFunction) PyServerType_stop, METH_NOARGS, "Stop the server"},
+  {"stop_listening", (PyCFunction) PyServerType_stop_listening, METH_NOARGS,
+   "Stop accepting connections, the requests in progress go on"},
+  {"get_pending", (PyCFunction) PyServerType_get_pending, METH_NOARGS,
+   "Returns the number of requests in progress"},
   {"add_handler", (PyCFunction) PyServerType_add_handler, METH_VARARGS,
    "Adds a handler for requests under path"},
   {NULL}                        /* Sentinel */
@@ -16,13 +16,118 @@
 
 # Import from the Standard Library
 from datetime import datetime
-from os.path import basename, getmtime, isfile
+from os import stat
+from os.path import basename, isfile
+from random import getrandbits
 
 # Import from itools
-from itools.core import fixed_offset
+from itools.core import SizedLRUCache, fixed_offset
+from itools.datatypes import HTTPDate
 from itools.fs.common import get_mimetype
 from itools.uri import Path
 from itools.web import BaseView
+from itools.web.compression import get_accept_encoding
+
+
+# The small files most often requested, in memory {(path, mtime, size):
+# data}, bounded by the number of files and by their size
+static_cache = SizedLRUCache(900, 1100, budgets={None: 32 * 2**20},
+                             get_sizeof=len)
+
+
+def get_etag(st, coding=None):
+    """Returns a strong entity tag, from the size and the mtime of the file
+    (in microseconds), and the content coding if any.
+    """
+    etag = '%x-%x' % (st.st_size, int(st.st_mtime * 1000000))
+    if coding is not None:
+        etag = '%s-%s' % (etag, coding)
+    return '"%s"' % etag
+
+
+def match_etag(header, etag):
+    """Tells whether the given entity tag matches any of the 'If-None-Match'
+    header (weak comparison).
+    """
+    if header.strip() == '*':
+        return True
+    for value in header.split(','):
+        value = value.strip()
+        if value[:2] == 'W/':
+            value = value[2:]
+        if value == etag:
+            return True
+    return False
+
+
+def parse_range(header, size, max_ranges=16):
+    """Returns the list of byte ranges (first and last positions, included)
+    of the given 'Range' header, for a file of the given size.
+
+    Returns None if the header is not valid (to be ignored), and an empty
+    list if none of the ranges is satisfiable.
+    """
+    if header[:6] != 'bytes=':
+        return None
+
+    ranges = []
+    for spec in header[6:].split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        if '-' not in spec:
+            return None
+        first, last = spec.split('-', 1)
+        try:
+            if first:
+                first = int(first)
+                if last:
+                    last = int(last)
+                    if last < first:
+                        return None
+                    last = min(last, size - 1)
+                else:
+                    last = size - 1
+            else:
+                # The last bytes
+                first = max(size - int(last), 0)
+                last = size - 1
+        except ValueError:
+            return None
+        if first <= last:
+            ranges.append((first, last))
+
+    if len(ranges) > max_ranges:
+        return None
+    return ranges
+
+
+def read_range(path, first, last, chunk_size=64*1024):
+    with open(path, 'rb') as file:
+        file.seek(first)
+        size = last - first + 1
+        while size > 0:
+            data = file.read(min(size, chunk_size))
+            if not data:
+                break
+            size -= len(data)
+            yield data
+
+
+def iter_byteranges(path, data, ranges, size, mimetype, boundary):
+    """Yields the body of a 'multipart/byteranges' response.
+    """
+    for first, last in ranges:
+        yield ('\r\n--%s\r\nContent-Type: %s\r\n'
+               'Content-Range: bytes %d-%d/%d\r\n\r\n'
+               % (boundary, mimetype, first, last, size))
+        if data is None:
+            for chunk in read_range(path, first, last):
+                yield chunk
+        else:
+            yield data[first:last + 1]
+    yield '\r\n--%s--\r\n' % boundary
+
 
 
 class StaticView(BaseView):
@@ -31,6 +136,69 @@ class StaticView(BaseView):
 
     mount_path = None
     local_path = None
+    # The files bigger than this (in bytes) are not loaded in memory
+    max_read_size = 256 * 1024
+    # The files smaller than this (in bytes) are kept in memory
+    max_cache_size = 64 * 1024
+    # Serve 'file.gz' or 'file.br' instead of 'file' to the clients that
+    # accept the coding, if they exist and are up to date
+    precompressed = [('br', '.br'), ('gzip', '.gz')]
+
+
+    def get_precompressed(self, context, path, st):
+        """Returns the content coding, the path and the stat result of the
+        file to serve, and whether there are several representations.
+        """
+        accept = None
+        vary = False
+        for coding, extension in self.precompressed:
+            try:
+                st2 = stat(path + extension)
+            except OSError:
+                continue
+            if st2.st_mtime < st.st_mtime:
+                # Out of date
+                continue
+            vary = True
+            if accept is None:
+                header = context.get_header('Accept-Encoding') or ''
+                accept = get_accept_encoding(header)
+            q = accept.get(coding, accept.get('*', 0.0))
+            if q > 0:
+                return coding, path + extension, st2, True
+        return None, path, st, vary
+
+
+    def get_data(self, path, st):
+        """Returns the data of the file, or None if too big to be kept in
+        memory.
+        """
+        if st.st_size > self.max_cache_size:
+            return None
+
+        key = (path, st.st_mtime, st.st_size)
+        data = static_cache.get(key)
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+            static_cache[key] = data
+        else:
+            static_cache.touch(key)
+        return data
+
+
+    def check_if_range(self, context, etag, mtime):
+        header = context.get_header('If-Range')
+        if not header:
+            return True
+        header = header.strip()
+        if header[:1] == '"' or header[:2] == 'W/':
+            return header == etag
+        try:
+            return HTTPDate.decode(header) == mtime
+        except ValueError:
+            return False
+
 
     def GET(self, query, context):
         n = len(Path(self.mount_path))
@@ -39,22 +207,71 @@ class StaticView(BaseView):
         # 404 Not Found
         if not isfile(path):
             return context.set_default_response(404)
-        # 304 Not Modified
-        mtime = getmtime(path)
-        mtime = datetime.utcfromtimestamp(mtime)
+        st = stat(path)
+        mtime = datetime.utcfromtimestamp(st.st_mtime)
         mtime = mtime.replace(microsecond=0)
         mtime = fixed_offset(0).localize(mtime)
-        since = context.get_header('If-Modified-Since')
-        if since and since >= mtime:
-            return context.set_default_response(304)
-        # 200 Ok
         # FIXME Check we set the encoding for text files
         mimetype = get_mimetype(basename(path))
-        # Get data
-        with open(path, 'r') as f:
-            data = f.read()
-        # Response
-        context.status = 200
-        context.set_content_type(mimetype)
+
+        # Precompressed
+        coding, path, st, vary = self.get_precompressed(context, path, st)
+        etag = get_etag(st, coding)
+        context.set_header('ETag', etag)
         context.set_header('Last-Modified', mtime)
-        return data
+        context.set_header('Accept-Ranges', 'bytes')
+        if vary:
+            context.set_header('Vary', 'Accept-Encoding')
+
+        # 304 Not Modified (If-None-Match has precedence)
+        if_none_match = context.get_header('If-None-Match')
+        if if_none_match:
+            if match_etag(if_none_match, etag):
+                return context.set_default_response(304)
+        else:
+            since = context.get_header('If-Modified-Since')
+            if since and since >= mtime:
+                return context.set_default_response(304)
+
+        # Range
+        size = st.st_size
+        ranges = None
+        header = context.get_header('Range')
+        if header and self.check_if_range(context, etag, mtime):
+            ranges = parse_range(header, size)
+            if ranges == []:
+                # 416 Requested Range Not Satisfiable
+                context.set_header('Content-Range', 'bytes */%d' % size)
+                return context.set_default_response(416)
+
+        # Get data (the big files are sent while read)
+        data = self.get_data(path, st)
+        context.set_content_type(mimetype)
+        if coding is not None:
+            context.set_header('Content-Encoding', coding)
+
+        # 206 Partial Content
+        if ranges:
+            context.status = 206
+            if len(ranges) == 1:
+                first, last = ranges[0]
+                context.set_header('Content-Range', 'bytes %d-%d/%d'
+                                   % (first, last, size))
+                if data is not None:
+                    return data[first:last + 1]
+                return read_range(path, first, last)
+            # Multiple ranges
+            boundary = '%032x' % getrandbits(128)
+            context.set_content_type('multipart/byteranges',
+                                     boundary=boundary)
+            return iter_byteranges(path, data, ranges, size, mimetype,
+                                   boundary)
+
+        # 200 Ok
+        context.status = 200
+        if data is not None:
+            return data
+        if size > self.max_read_size:
+            return open(path, 'rb')
+        with open(path, 'rb') as f:
+            return f.read()
@@ -29,8 +29,10 @@ from itools.database import get_field_and_datatype
 from itools.datatypes import Enumerate, String
 from itools.gettext import MSG
 from itools.handlers import File
+from itools.i18n import AcceptLanguageType
 from itools.stl import stl
 from itools.uri import Reference
+from itools.xml import CompactEvents
 
 # Import from here
 from exceptions import FormError, Conflict, MethodNotAllowed
@@ -84,6 +86,32 @@ class ItoolsView(prototype):
         return None
 
 
+    # Keep the GET responses in the server's cache (see
+    # 'WebServer.page_cache_size'), until the database changes or the
+    # view's mtime.  Only the content type and the body are kept: the
+    # responses the view sets headers or cookies for are not cached, and
+    # the 'after_traverse' hook runs for the cached responses too.
+    cache_page = False
+
+    def get_page_cache_key(self, resource, context):
+        """Returns what the response depends on, besides the URI and the
+        language: by default the user (None if anonymous).  Returns False
+        not to use the cache for this request.
+        """
+        user = context.user
+        return user.name if user is not None else None
+
+
+    def get_page_cache_language(self, resource, context):
+        """Returns what stands for the language of the response in the
+        server's cache: by default the languages the client accepts,
+        normalized.  The views that know the languages they are available
+        in should return the one negotiated, to keep one response per
+        language.
+        """
+        return AcceptLanguageType.encode(context.accept_language)
+
+
     def return_json(self, data, context):
         return context.return_json(data)
 
@@ -348,6 +376,12 @@ class BaseView(ItoolsView):
 class STLView(BaseView):
 
     template = None
+    # Set to True to render the template with the STL compiler
+    compile_template = False
+    # What GET returns: the events (to be put in the page by the skin), or
+    # the page, serialized for the mode ('xhtml' or 'html') as a list of
+    # chunks (not joined with the compiler), sent as is
+    template_mode = 'events'
 
 
     def get_template(self, resource, context):
@@ -367,7 +401,7 @@ class STLView(BaseView):
             return template
 
         # Case 2: the stream ready to use
-        if template_type is list:
+        if template_type in (list, CompactEvents):
             return template
 
         # Error
@@ -383,10 +417,17 @@ class STLView(BaseView):
 
         # STL
         template = self.get_template(resource, context)
-        if type(template) is list:
-            return stl(None, namespace, events=template)
-
-        return stl(template, namespace)
+        compiled = self.compile_template
+        mode = self.template_mode
+        chunks = (mode != 'events')
+        if chunks:
+            context.set_content_type('text/html', charset='UTF-8')
+        if type(template) in (list, CompactEvents):
+            return stl(None, namespace, events=template, mode=mode,
+                       compiled=compiled, chunks=chunks)
+
+        return stl(template, namespace, mode=mode, compiled=compiled,
+                   chunks=chunks)
 
 
     #######################################################################
@@ -27,6 +27,7 @@ from parser import DOCUMENT_TYPE, START_ELEMENT, END_ELEMENT, TEXT, COMMENT
 from parser import PI, CDATA
 from utils import is_xml_stream, xml_to_text
 from xml import Element, stream_to_str, get_element, find_end
+from xml import CompactEvents
 from xml import get_qname, get_attribute_qname, get_end_tag, get_doctype
 
 
@@ -40,6 +41,7 @@ __all__ = [
     'stream_to_str',
     'find_end',
     'get_element',
+    'CompactEvents',
     # Exceptions
     'XMLError',
     # Namespaces
@@ -20,11 +20,12 @@ from types import GeneratorType
 
 # Import from itools
 from parser import XMLParser, TEXT, XML_DECL
+from xml import CompactEvents
 
 
 
 def is_xml_stream(value):
-    return type(value) in (list, GeneratorType, XMLParser)
+    return type(value) in (list, GeneratorType, XMLParser, CompactEvents)
 
 
 def xml_to_text(stream):
@@ -19,6 +19,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from the Standard Library
+from array import array
+from itertools import izip
+
 # Import from itools
 from itools.datatypes import XMLAttribute, XMLContent
 from namespaces import get_namespace, is_empty
@@ -116,16 +120,118 @@ stream_to_str_map = (
 
 # XXX encoding is not used
 def stream_to_str(stream, encoding='UTF-8', map=stream_to_str_map):
+    if type(stream) is CompactEvents:
+        return ''.join([ map[x](y) for x, y in izip(stream.types,
+                                                    stream.values) ])
     return ''.join( map[x](y) for x, y, z in stream )
 
 
 
+def intern_name(name):
+    if type(name) is str:
+        return intern(name)
+    return name
+
+
+
+class CompactEvents(object):
+    """A read-only sequence of events, as returned by the parser, stored in
+    arrays instead of a list of tuples.  The values of the start and end
+    elements are shared: equal tags (same name, same attributes) are
+    stored once, and the tag and attribute names are interned.  The position
+    of the end of every element is computed once, so 'find_end' does not
+    scan the events.
+
+    The values of the events must not be modified (the attributes of equal
+    tags are the same dictionary).
+    """
+
+    __slots__ = ['types', 'values', 'lines', 'ends']
+
+    def __init__(self, events):
+        types = array('B')
+        values = []
+        lines = array('i')
+        ends = array('i')
+        # Interned values
+        start_values = {}
+        end_values = {}
+
+        stack = []
+        for i, (event, value, line) in enumerate(events):
+            if event == START_ELEMENT:
+                stack.append(i)
+                tag_uri, tag_name, attributes = value
+                key = (tag_uri, tag_name, tuple(sorted(attributes.items())))
+                try:
+                    interned = start_values.get(key)
+                except TypeError:
+                    # The attribute values are not hashable
+                    key = interned = None
+                if interned is None:
+                    aux = {}
+                    for (attr_uri, attr_name), x in attributes.iteritems():
+                        aux[intern_name(attr_uri), intern_name(attr_name)] = x
+                    interned = intern_name(tag_uri), intern_name(tag_name), aux
+                    if key is not None:
+                        start_values[key] = interned
+                value = interned
+            elif event == END_ELEMENT:
+                if stack:
+                    ends[stack.pop()] = i
+                interned = end_values.get(value)
+                if interned is None:
+                    tag_uri, tag_name = value
+                    interned = intern_name(tag_uri), intern_name(tag_name)
+                    end_values[value] = interned
+                value = interned
+
+            types.append(event)
+            values.append(value)
+            lines.append(-1 if line is None else line)
+            ends.append(-1)
+
+        self.types = types
+        self.values = values
+        self.lines = lines
+        self.ends = ends
+
+
+    def __len__(self):
+        return len(self.types)
+
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return [ self[i] for i in xrange(*index.indices(len(self))) ]
+
+        line = self.lines[index]
+        return self.types[index], self.values[index], (
+            None if line == -1 else line)
+
+
+    def __iter__(self):
+        for event, value, line in izip(self.types, self.values, self.lines):
+            yield event, value, (None if line == -1 else line)
+
+
+    def find_end(self, start):
+        end = self.ends[start]
+        if end == -1:
+            return None
+        return end
+
+
+
 def find_end(events, start):
     """Receives a list of events and a position in the list of an start
     element.
 
     Returns the position in the list where the element ends.
     """
+    if type(events) is CompactEvents:
+        return events.find_end(start)
+
     c = 1
     n = len(events)
     i = start + 1
@@ -195,7 +195,7 @@ def _get_translatable_blocks(events):
 ###########################################################################
 # Get Messages
 ###########################################################################
-def get_units(events, srx_handler=None):
+def get_units(events, srx_handler=None, language='en'):
     keep_spaces = False
     keep_spaces_level = 0
     for type, value, line in _get_translatable_blocks(events):
@@ -229,7 +229,8 @@ def get_units(events, srx_handler=None):
                     keep_spaces = False
         elif type == MESSAGE:
             # Segmentation
-            for segment in get_segments(value, keep_spaces, srx_handler):
+            for segment in get_segments(value, keep_spaces, srx_handler,
+                                        language):
                 yield segment
 
 
@@ -237,7 +238,7 @@ def get_units(events, srx_handler=None):
 ###########################################################################
 # Translate
 ###########################################################################
-def translate(events, catalog, srx_handler=None):
+def translate(events, catalog, srx_handler=None, language='en'):
     # Default values
     encoding = 'utf-8'
     doctype = None
@@ -298,7 +299,7 @@ def translate(events, catalog, srx_handler=None):
         elif type == MESSAGE:
             try:
                 translation = translate_message(value, catalog, keep_spaces,
-                                                srx_handler)
+                                                srx_handler, language)
             except KeyError:
                 # translate_message can raise an KeyError in case of translations mistake
                 raise TranslationError(line=line)
@@ -24,7 +24,7 @@ from cStringIO import InputType
 
 # Import from itools
 from itools.handlers import TextFile, register_handler_class
-from itools.xml import XMLParser, stream_to_str, xml_to_text
+from itools.xml import XMLParser, CompactEvents, stream_to_str, xml_to_text
 from i18n import get_units, translate
 
 
@@ -38,32 +38,70 @@ class XMLFile(TextFile):
     providing their own Element and Raw classes. This is the reason why
     we use 'self.Element' and 'self.Raw' throghout the code instead of
     just 'Element' and 'Raw'.
+
+    In lazy mode ('lazy_events' set to True, by a sub-class or on the
+    handler before it is loaded) the events are not kept in memory, only
+    the data loaded: every access to 'events' returns a new iterator, that
+    parses it.  This is meant for large documents read once (units
+    extraction, translation, indexing).  Once the events are set, they are
+    kept in memory.
+
+    With 'compact_events' set to True the events loaded are stored in a
+    'CompactEvents' table instead of a list (for read-only handlers, like
+    templates).
     """
 
     class_mimetypes = ['text/xml', 'application/xml']
     class_extension = 'xml'
     __hash__ = None
 
+    lazy_events = False
+    compact_events = False
+
     def new(self):
         # XML is a meta-language, it does not make change to create a bare
         # XML handler without a resource.
         raise NotImplementedError
 
 
+    def _get_events(self, stream):
+        if self.compact_events:
+            return CompactEvents(stream)
+        return list(stream)
+
+
+    def __getattr__(self, name):
+        if name != 'events' or not self.lazy_events:
+            return super(XMLFile, self).__getattr__(name)
+
+        # Lazy mode (loads the handler if needed)
+        return XMLParser(self._lazy_data)
+
+
     def _load_state_from_file(self, file):
+        # Lazy mode, keep the data to parse the events from, so they match
+        # the timestamp even if the file changes
+        if self.lazy_events:
+            self._lazy_data = file.read()
+            return
+
         # FIXME The XML parser does not support reading from a StringIO
         if type(file) is InputType:
             file = file.read()
 
         stream = XMLParser(file)
-        self.events = list(stream)
+        self.events = self._get_events(stream)
 
 
     def load_state_from_string(self, string):
         self.set_changed()
         self.reset()
+        if self.lazy_events:
+            self._lazy_data = string
+            return
+
         stream = XMLParser(string)
-        self.events = list(stream)
+        self.events = self._get_events(stream)
 
 
     #######################################################################
@@ -81,7 +119,13 @@ class XMLFile(TextFile):
     def __cmp__(self, other):
         if not isinstance(other, self.__class__):
             return 1
-        return cmp(self.events, other.events)
+        events = self.events
+        if type(events) is not list:
+            events = list(events)
+        other_events = other.events
+        if type(other_events) is not list:
+            other_events = list(other_events)
+        return cmp(events, other_events)
 
 
     def to_text(self):
@@ -93,12 +137,12 @@ class XMLFile(TextFile):
     #######################################################################
     # API / Internationalization - Localization
     #######################################################################
-    def get_units(self, srx_handler=None):
-        return get_units(self.events, srx_handler)
+    def get_units(self, srx_handler=None, language='en'):
+        return get_units(self.events, srx_handler, language)
 
 
-    def translate(self, catalog, srx_handler=None):
-        stream = translate(self.events, catalog, srx_handler)
+    def translate(self, catalog, srx_handler=None, language='en'):
+        stream = translate(self.events, catalog, srx_handler, language)
         return stream_to_str(stream)
 
 
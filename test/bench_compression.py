@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the compression of the responses, for a listing page (HTML) and
+its JSON equivalent: the CPU time per response against the bytes saved,
+by content coding and level:
+
+  $ python bench_compression.py [nb_rows] [nb_repeat]
+"""
+
+# Import from the Standard Library
+from json import dumps
+import sys
+from time import time
+
+# Import from itools
+from itools.web.compression import compress
+
+
+row = """<tr class="%(even)s">
+  <td><input type="checkbox" name="ids" value="%(id)d" /></td>
+  <td><a href="/items/%(id)d/;view">Item %(id)d</a></td>
+  <td>jdavid</td>
+  <td>2026-01-%(day)02d</td>
+</tr>
+"""
+
+
+def bench(data, coding, level, nb_repeat):
+    t0 = time()
+    for i in range(nb_repeat):
+        output = compress(data, coding, level)
+    t = (time() - t0) / nb_repeat
+    return t, len(output)
+
+
+
+if __name__ == '__main__':
+    # Read input parameters
+    nb_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    nb_repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    rows = [ {'id': i, 'even': 'even' if i % 2 else 'odd', 'day': i % 28 + 1}
+             for i in range(nb_rows) ]
+    html = ''.join([ row % x for x in rows ])
+    html = '<html><body><table>%s</table></body></html>' % html
+    json = dumps(rows)
+
+    # Go
+    print '%d rows, %d passes' % (nb_rows, nb_repeat)
+    for name, data in [('html', html), ('json', json)]:
+        print '%s: %d bytes' % (name, len(data))
+        for coding in ['gzip', 'deflate']:
+            for level in [1, 6, 9]:
+                t, size = bench(data, coding, level, nb_repeat)
+                saved = len(data) - size
+                print ('  %-7s %d : % 8.3f ms/response, % 7d bytes saved'
+                       ' (%2d%%), % 8.1f KB saved/ms' % (
+                       coding, level, t * 1000, saved,
+                       saved * 100 / len(data), saved / 1024.0 / (t * 1000)))
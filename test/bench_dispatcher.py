@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the resolution of routes by the dispatcher trie with the linear
+scan of the regular expressions, in routes per second:
+
+  $ python bench_dispatcher.py [nb_routes] [nb_repeat]
+"""
+
+# Import from the Standard Library
+import sys
+from time import time
+
+# Import from itools
+from itools.core import OrderedDict
+from itools.web.dispatcher import URIDispatcher
+
+
+def resolve_linear(dispatcher, path):
+    for pattern, values in dispatcher.patterns.iteritems():
+        compiled_regex, data = values
+        match = compiled_regex.search(path)
+        if match:
+            return data, match.groupdict()
+    return None
+
+
+
+def bench(resolve, paths, nb_repeat):
+    t0 = time()
+    for i in range(nb_repeat):
+        for path in paths:
+            resolve(path)
+    return (len(paths) * nb_repeat) / (time() - t0)
+
+
+
+if __name__ == '__main__':
+    # Read input parameters
+    nb_routes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nb_repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    # Register the routes, by groups of 5
+    dispatcher = URIDispatcher()
+    dispatcher.patterns = OrderedDict()
+    for i in range(nb_routes / 5):
+        dispatcher.add('/api/r%d' % i, i)
+        dispatcher.add('/api/r%d/{id:digits}' % i, i)
+        dispatcher.add('/api/r%d/{id:digits}/{name}' % i, i)
+        dispatcher.add('/api/r%d/search/{name:word}' % i, i)
+        dispatcher.add('/ui/r%d/{path:any}' % i, i)
+
+    # The paths: hits at the beginning, middle and end, and misses (most
+    # requests are for resources, not for routes)
+    n = nb_routes / 5
+    paths = []
+    for i in [0, n / 2, n - 1]:
+        paths.append('/api/r%d/42' % i)
+        paths.append('/api/r%d/42/title' % i)
+        paths.append('/ui/r%d/images/logo.png' % i)
+    paths.extend(['/', '/users/5/;edit', '/theme/style/;download'] * 3)
+
+    # Check both agree
+    for path in paths:
+        if dispatcher.resolve(path) != resolve_linear(dispatcher, path):
+            print 'ERROR: the dispatchers disagree on "%s"' % path
+            exit(1)
+
+    # Go
+    linear = bench(lambda x: resolve_linear(dispatcher, x), paths, nb_repeat)
+    trie = bench(dispatcher.resolve, paths, nb_repeat)
+    print '%d routes, %d paths, %d passes' % (len(dispatcher.patterns),
+                                              len(paths), nb_repeat)
+    print 'linear scan : % 9d routes/s' % linear
+    print 'trie        : % 9d routes/s' % trie
@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the fast path of the metadata parser (regular expressions) with
+the slow path (the state machine), over a corpus of metadata files:
+
+  $ python bench_metadata.py <path to a database> [nb_repeat]
+"""
+
+# Import from the Standard Library
+from os import walk
+from os.path import join
+import sys
+from time import time
+
+# Import from itools
+from itools.database.metadata_parser import parse_table, unfold_lines
+from itools.database.metadata_parser import read_name, get_tokens
+
+
+def parse_table_slow(data):
+    for line in unfold_lines(data):
+        name, line = read_name(line)
+        value, parameters = get_tokens(line)
+        yield name, value, parameters
+
+
+
+def bench(parse, corpus, nb_repeat):
+    t0 = time()
+    for i in range(nb_repeat):
+        for data in corpus:
+            for x in parse(data):
+                pass
+    return time() - t0
+
+
+
+if __name__ == '__main__':
+    # Read input parameters
+    path = sys.argv[1]
+    nb_repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    # Load the corpus
+    corpus = []
+    for root, dirs, files in walk(path):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        for name in files:
+            if name.endswith('.metadata'):
+                with open(join(root, name)) as f:
+                    corpus.append(f.read())
+    size = sum([ len(x) for x in corpus ])
+    print '%d metadata files (%d bytes), %d passes' % (len(corpus), size,
+                                                      nb_repeat)
+
+    # Check both parsers agree
+    for data in corpus:
+        if list(parse_table(data)) != list(parse_table_slow(data)):
+            print 'ERROR: the parsers disagree'
+            exit(1)
+
+    # Go
+    slow = bench(parse_table_slow, corpus, nb_repeat)
+    fast = bench(parse_table, corpus, nb_repeat)
+    print 'state machine      : %.3f s' % slow
+    print 'regular expressions: %.3f s (x%.1f)' % (fast, slow / fast)
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the segmentation of messages with the default SRX rules, in
+messages per second, with the compiled rules cached (by language) or
+compiled for every message:
+
+  $ python bench_srx.py [nb_messages] [language]
+"""
+
+# Import from the Standard Library
+from re import purge
+import sys
+from time import time
+
+# Import from itools
+from itools.srx import Message, get_segments
+from itools.srx.segment import default_srx_handler
+
+
+sentences = [
+    u'This is a sentence.',
+    u'Mr. Smith works for Toto Inc. in the U.K. since 1999.',
+    u'Is it true? Yes! It is, etc. and so on.',
+    u'Price: -12.25 Euro.',
+    u'Bonjour Mme. Dupont.']
+
+
+def bench(messages, language, cached):
+    handler = default_srx_handler
+    t0 = time()
+    for message in messages:
+        if not cached:
+            # Like a busy process, where the regular expressions of the
+            # rules do not stay in the cache of the 're' module either
+            handler.compiled_rules.clear()
+            purge()
+        for segment in get_segments(message, language=language):
+            pass
+    return len(messages) / (time() - t0)
+
+
+
+if __name__ == '__main__':
+    # Read input parameters
+    nb_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    language = sys.argv[2] if len(sys.argv) > 2 else 'en'
+
+    # The messages, of 1 to 5 sentences
+    messages = []
+    for i in range(nb_messages):
+        message = Message()
+        message.append_text(u' '.join(sentences[:i % 5 + 1]))
+        messages.append(message)
+
+    # Go
+    compiled = bench(messages, language, False)
+    cached = bench(messages, language, True)
+    print '%d messages, language "%s"' % (nb_messages, language)
+    print 'compiled every time : % 7d messages/s' % compiled
+    print 'cached              : % 7d messages/s' % cached
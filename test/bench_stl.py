@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2026 The itools developers
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the STL interpreter with the STL compiler, rendering a listing
+page, in pages per second:
+
+  $ python bench_stl.py [nb_rows] [nb_repeat]
+"""
+
+# Import from the Standard Library
+import sys
+from time import time
+
+# Import from itools
+import itools.html
+from itools.stl import stl
+from itools.xml import XMLParser
+
+
+template = """<html xmlns="http://www.w3.org/1999/xhtml"
+  xmlns:stl="http://www.hforge.org/xml-namespaces/stl">
+  <head><title>${title}</title></head>
+  <body>
+    <h1>${title}</h1>
+    <table class="listing">
+      <thead>
+        <tr><th>#</th><th>Title</th><th>Author</th><th>Date</th></tr>
+      </thead>
+      <tbody>
+        <tr stl:repeat="row rows" class="${repeat/row/even}">
+          <td><input type="checkbox" name="ids" value="${row/id}"
+            checked="${row/checked}" /></td>
+          <td><a href="/items/${row/id}/;view">${row/title}</a></td>
+          <td>${row/author}</td>
+          <td stl:if="row/date">${row/date}</td>
+          <td stl:if="not row/date">-</td>
+        </tr>
+      </tbody>
+    </table>
+    <p stl:if="not rows">No items.</p>
+  </body>
+</html>"""
+
+
+def bench(events, namespace, mode, compiled, nb_repeat):
+    t0 = time()
+    for i in range(nb_repeat):
+        output = stl(events=events, namespace=namespace, mode=mode,
+                     compiled=compiled)
+        if mode == 'events':
+            list(output)
+    return nb_repeat / (time() - t0)
+
+
+
+if __name__ == '__main__':
+    # Read input parameters
+    nb_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    nb_repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    events = list(XMLParser(template))
+    rows = [ {'id': i, 'title': u'Item %d' % i, 'author': 'jdavid',
+              'date': '2026-01-%02d' % (i % 28 + 1) if i % 3 else None,
+              'checked': i % 2 == 0}
+             for i in range(nb_rows) ]
+    namespace = {'title': u'Listing', 'rows': rows}
+
+    # Check both agree
+    for mode in ['events', 'xml', 'xhtml', 'html']:
+        a = stl(events=events, namespace=namespace, mode=mode)
+        b = stl(events=events, namespace=namespace, mode=mode, compiled=True)
+        if mode == 'events':
+            a, b = list(a), list(b)
+        if a != b:
+            print 'ERROR: the interpreter and the compiler disagree'
+            exit(1)
+
+    # Go
+    print '%d rows, %d passes' % (nb_rows, nb_repeat)
+    for mode in ['events', 'xml', 'xhtml', 'html']:
+        interpreter = bench(events, namespace, mode, False, nb_repeat)
+        compiler = bench(events, namespace, mode, True, nb_repeat)
+        print '%-6s interpreter : % 7d pages/s' % (mode, interpreter)
+        print '%-6s compiler    : % 7d pages/s' % (mode, compiler)
@@ -20,7 +20,7 @@ from unittest import TestCase, main
 
 # Import from itools
 from itools.core import freeze, frozenlist, frozendict
-from itools.core import LRUCache
+from itools.core import LRUCache, SizedLRUCache
 
 
 ###########################################################################
@@ -419,6 +419,54 @@ class CacheTestCase(TestCase):
 
 
 
+class SizedCacheTestCase(TestCase):
+
+    def setUp(self):
+        # Two kinds: upper and lower case strings, the size is the length
+        get_kind = lambda x: x.isupper()
+        self.cache = SizedLRUCache(10, budgets={True: 6}, get_kind=get_kind,
+                                   get_sizeof=len)
+
+
+    def tearDown(self):
+        self.cache._check_integrity()
+
+
+    def test_bytes(self):
+        cache = self.cache
+        cache['a'] = 'aaa'
+        cache['b'] = 'BB'
+        self.assertEqual(cache.bytes, {False: 3, True: 2})
+        cache['b'] = 'BBBB'
+        self.assertEqual(cache.bytes, {False: 3, True: 4})
+        del cache['a']
+        self.assertEqual(cache.bytes, {False: 0, True: 4})
+
+
+    def test_budget(self):
+        cache = self.cache
+        cache['a'] = 'AAA'
+        cache['b'] = 'bbbbbbbbbb'
+        cache['c'] = 'CCC'
+        cache['d'] = 'DD'
+        # The least-recently used value of the kind over budget is removed
+        self.assertEqual(cache.keys(), list('bcd'))
+        self.assertEqual(cache.bytes, {False: 10, True: 5})
+        self.assertEqual(cache.evictions, 1)
+
+
+    def test_unsized(self):
+        sizes = {}
+        cache = SizedLRUCache(10, get_sizeof=lambda x: sizes.get(x))
+        cache['a'] = 'A'
+        self.assertEqual(cache.bytes, {None: 0})
+        sizes['A'] = 5
+        cache.update_sizes()
+        self.assertEqual(cache.bytes, {None: 5})
+        self.assertEqual(cache.get_size('a'), 5)
+
+
+
 if __name__ == '__main__':
     main()
 
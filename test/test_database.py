@@ -19,23 +19,35 @@
 
 # Import from the Standard Library
 from unittest import TestCase, main
+from os import lstat, utime
 from os.path import basename
 from random import sample
 import re
+from threading import Lock
+
+# Import from pygit2
+from pygit2 import Signature, GIT_FILEMODE_BLOB
 
 # Import from itools
 from itools.database import AndQuery, RangeQuery, PhraseQuery, NotQuery
 from itools.database import AllQuery, OrQuery, TextQuery
 from itools.database import make_catalog, Catalog, Resource, StartQuery
-from itools.database import make_git_database
-from itools.database.catalog import _index, _decode
+from itools.database import make_git_database, Metadata, RODatabase
+from itools.database.blobcache import BlobCache, get_blob_oid
+from itools.database.catalog import _index, _decode, merge_catalogs
+from itools.database.metadata_parser import parse_table, get_tokens
+from itools.database.metadata_parser import read_name, unfold_lines
+from itools.database.rw import ShardCatalog, commit_phases
+from itools.database.rw import _index_shard, _init_shard_worker
 from itools.datatypes import String, Unicode, Boolean, Integer
 from itools.fs import lfs, FileName
-from itools.handlers import TextFile
+from itools.handlers import File, TextFile
+from itools.i18n import init_language_selector
 from itools.log.log import register_logger, Logger, FATAL
 
 # Import from xapian
 from xapian import Document as XapianDocument
+from xapian import WritableDatabase, DB_CREATE
 
 
 
@@ -46,6 +58,26 @@ class BrokenHandler(TextFile):
 
 
 
+class OldStyleFile(TextFile):
+
+    saved = []
+
+    def save_state(self):
+        self.saved.append(self.key)
+        super(OldStyleFile, self).save_state()
+
+
+
+class ShardDatabase(RODatabase):
+
+    abspaths = []
+
+    def get_resource(self, abspath, soft=False):
+        self.abspaths.append(abspath)
+        return None
+
+
+
 class RWDatabaseTestCase(TestCase):
 
     def setUp(self):
@@ -68,7 +100,9 @@ class RWDatabaseTestCase(TestCase):
                  'fables/database/.git',
                  'fables/database/31.txt',
                  'fables/database/agenda',
-                 'fables/database/broken.txt']
+                 'fables/database/broken.txt',
+                 'fables/cache',
+                 'tests/shard-0']
         for path in paths:
             if lfs.exists(path):
                 lfs.remove(path)
@@ -98,6 +132,202 @@ class RWDatabaseTestCase(TestCase):
         self.assertEqual(lfs.exists('fables/database/31.txt'), True)
 
 
+    def test_commit_tree(self):
+        # Changes (copy&paste in a new folder)
+        fables = self.root
+        fable = fables.get_handler('30.txt')
+        fable = fable.clone()
+        fables.set_handler('agenda/31.txt', fable)
+        # Commit
+        database = self.database
+        database.save_changes()
+        # Test the tree, the index and the filesystem agree
+        worktree = database.worktree
+        entry = worktree.repo.revparse_single('HEAD').tree['agenda/31.txt']
+        data = open('fables/database/agenda/31.txt').read()
+        self.assertEqual(worktree.repo[entry.oid].data, data)
+        self.assertEqual(worktree.index['agenda/31.txt'].oid, entry.oid)
+        # The index has the stat data of the file
+        stat = lstat('fables/database/agenda/31.txt')
+        data = worktree._call(['git', 'ls-files', '--debug', 'agenda/31.txt'])
+        self.assertEqual('mtime: %d:' % stat.st_mtime in data, True)
+        self.assertEqual('ino: %d' % stat.st_ino in data, True)
+        self.assertEqual('size: %d' % stat.st_size in data, True)
+        self.assertEqual(worktree._call(['git', 'diff-files']), '')
+        # Timings
+        self.assertEqual(set(database.commit_timings), set(commit_phases))
+
+
+    def test_commit_save_state(self):
+        # A handler with its own 'save_state', not returning the data
+        fables = self.root
+        fables.set_handler('agenda/31.txt', OldStyleFile(data=u'Hello\n'))
+        self.database.save_changes()
+        worktree = self.database.worktree
+        entry = worktree.repo.revparse_single('HEAD').tree['agenda/31.txt']
+        self.assertEqual(worktree.repo[entry.oid].data, 'Hello\n')
+        self.assertEqual(OldStyleFile.saved, ['agenda/31.txt'])
+
+
+    def test_git_log(self):
+        database = self.database
+        fables = self.root
+        for i in range(3):
+            fables.set_handler('agenda/%d.txt' % i, TextFile(data=u'x'))
+            database.save_changes()
+        # With the history index
+        worktree = database.worktree
+        self.assertEqual(len(worktree.git_log(paths=['agenda'])), 3)
+        self.assertEqual(len(worktree.git_log(paths=['agenda/1.txt'])), 1)
+        self.assertEqual(len(worktree.git_log(paths=['30.txt'])), 1)
+        log = worktree.git_log(paths=['agenda', '30.txt'], n=2)
+        # Without
+        worktree.history.remove()
+        self.assertEqual(worktree.git_log(paths=['agenda', '30.txt'], n=2),
+                         log)
+
+
+    def commit(self, ref, message, names, parents, when):
+        repo = self.database.worktree.repo
+        builder = repo.TreeBuilder(repo[parents[0]].tree)
+        for name in names:
+            blob = repo.create_blob('%s %s' % (message, name))
+            builder.insert(name, blob, GIT_FILEMODE_BLOB)
+        signature = Signature('test', 'test@example.com', when, 0)
+        return repo.create_commit(ref, signature, signature, message,
+                                  builder.write(), parents)
+
+
+    def test_git_log_merge(self):
+        # Two branches merged: the topological order of the commits is not
+        # their order by time
+        worktree = self.database.worktree
+        base = worktree._resolve_reference('HEAD')
+        commit = self.commit
+        x = commit('HEAD', 'x', ['x.txt'], [base], 2000000000)
+        y = commit(None, 'y', ['y.txt'], [base], 2000000100)
+        commit('HEAD', 'merge', ['x.txt', 'y.txt'], [x, y], 2000000200)
+        # With the history index
+        worktree.update_history()
+        log = worktree.git_log(paths=['x.txt', 'y.txt'])
+        self.assertEqual([ c['message_short'] for c in log ],
+                         ['merge', 'y', 'x'])
+        # Without
+        worktree.history.remove()
+        self.assertEqual(worktree.git_log(paths=['x.txt', 'y.txt']), log)
+
+
+    def test_git_log_branch(self):
+        # A branch that forks before the last commit indexed, and older
+        worktree = self.database.worktree
+        base = worktree._resolve_reference('HEAD')
+        commit = self.commit
+        x = commit('HEAD', 'x', ['a.txt', 'x.txt'], [base], 2000000000)
+        worktree.update_history()
+        y = commit(None, 'y', ['a.txt', 'y.txt'], [base], 1999999900)
+        commit('HEAD', 'merge', ['a.txt', 'y.txt'], [x, y], 2000000200)
+        worktree.update_history()
+        # With the history index
+        log = worktree.git_log(paths=['y.txt'])
+        self.assertEqual([ c['message_short'] for c in log ], ['merge', 'y'])
+        log = worktree.git_log(paths=['a.txt'])
+        self.assertEqual([ c['message_short'] for c in log ],
+                         ['merge', 'x', 'y'])
+        self.assertEqual(worktree.git_log(paths=['a.txt'], n=1), log[:1])
+        # Without
+        worktree.history.remove()
+        self.assertEqual(worktree.git_log(paths=['a.txt']), log)
+
+
+    def test_lookup_cache(self):
+        worktree = self.database.worktree
+        head = worktree._resolve_reference('HEAD')
+        commit = worktree.lookup(head)
+        self.assertEqual(worktree.lookup(head.hex) is commit, True)
+        self.assertEqual(worktree.lookup(unicode(head.hex)) is commit, True)
+        stats = worktree.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        # Keep at most one blob
+        worktree.cache.budgets['blob'] = 1
+        tree = commit.tree
+        for name in ['00.txt', '01.txt', '02.txt']:
+            worktree.lookup(tree[name].oid)
+        stats = worktree.get_cache_stats()
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['blobs_bytes'],
+                         100 + worktree.lookup(tree['02.txt'].oid).size)
+
+
+    def test_git_diff(self):
+        # Changes (copy&paste)
+        fables = self.root
+        fable = fables.get_handler('30.txt')
+        fable = fable.clone()
+        fables.set_handler('agenda/31.txt', fable)
+        self.database.save_changes()
+        # Test
+        worktree = self.database.worktree
+        changes = worktree.get_changes('HEAD')
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['path'], 'agenda/31.txt')
+        self.assertEqual(changes[0]['status'], 'A')
+        self.assertEqual(changes[0]['removed'], 0)
+        self.assertEqual(worktree.get_files_changed('HEAD^', 'HEAD'),
+                         frozenset(['agenda/31.txt']))
+        # Same output as git
+        data = worktree._call(['git', 'show', 'HEAD', '--pretty=format:'])
+        self.assertEqual(worktree.git_diff('HEAD'), data[1:])
+        self.assertEqual(worktree.git_diff('HEAD', paths=['30.txt']), '')
+        self.assertEqual(worktree.git_stats('HEAD^', 'HEAD'),
+                         worktree._call(['git', 'diff', '--stat', 'HEAD^']))
+
+
+    def test_git_stats(self):
+        fables = self.root
+        database = self.database
+        fable = fables.get_handler('30.txt').clone()
+        fables.set_handler('agenda/31.txt', fable)
+        database.save_changes()
+        # An unbalanced change, a long path and a binary file
+        fable = fables.get_handler('agenda/31.txt')
+        fable.to_str()
+        fable.set_data(u'The end\n')
+        name = 'agenda/%s.txt' % ('long' * 20)
+        fables.set_handler(name, TextFile(data=u'x\n'))
+        fables.set_handler('agenda/data.bin', File(data='\0\1\2' * 50))
+        database.save_changes()
+        # Same output as git
+        worktree = database.worktree
+        data = worktree._call(['git', 'diff', '--stat', 'HEAD^', 'HEAD'])
+        self.assertEqual(worktree.git_stats('HEAD^', 'HEAD'), data)
+        data = worktree._call(['git', 'diff', 'HEAD^', 'HEAD'])
+        self.assertEqual(worktree.git_diff('HEAD^', 'HEAD'), data)
+        # Binary files
+        changes = worktree.get_changes('HEAD')
+        changes = dict([ (x['path'], x) for x in changes ])
+        change = changes['agenda/data.bin']
+        self.assertEqual(change['binary'], True)
+        self.assertEqual((change['old_size'], change['new_size']), (0, 150))
+
+
+    def test_shared_cache_version(self):
+        # The parses of another version of the parser are not used
+        database = RODatabase('fables', shared_cache=True)
+        path = '%s/cache/v%d' % (database.path, Metadata.cache_version)
+        self.assertEqual(database.blob_cache.path, path)
+
+
+    def test_shard_database(self):
+        # The workers of 'rebuild_catalog' open the database with the
+        # application's class
+        self.assertEqual(self.database.shard_database_cls, None)
+        _init_shard_worker({}, Lock())
+        job = (ShardDatabase, 'fables', 20, 20, False, 'tests/shard-0',
+               ['/01', '/02'], 10)
+        self.assertEqual(_index_shard(job), 0)
+        self.assertEqual(ShardDatabase.abspaths, ['/01', '/02'])
+
+
     def test_broken_commit(self):
         # Changes (copy&paste)
         fables = self.root
@@ -136,6 +366,28 @@ class RWDatabaseTestCase(TestCase):
         self.assertRaises(ValueError, fables.del_handler, '.git')
 
 
+    def test_cache_stats(self):
+        database = self.database
+        fables = self.root
+        stats = database.get_cache_stats()
+        misses, hits = stats['misses'], stats['hits']
+        # Load some fables
+        for name in ['10.txt', '11.txt', '12.txt']:
+            fables.get_handler(name).to_str()
+        fables.get_handler('10.txt')
+        stats = database.get_cache_stats()
+        self.assertEqual(stats['misses'] - misses, 3)
+        self.assertEqual(stats['hits'] - hits, 1)
+        self.assertNotEqual(stats['blobs_bytes'], 0)
+        # Lower the memory budget and make room
+        budget = stats['blobs_bytes'] / 2
+        database.cache.budgets['blob'] = budget
+        database.make_room()
+        stats = database.get_cache_stats()
+        self.assertNotEqual(stats['evictions'], 0)
+        self.assert_(stats['blobs_bytes'] <= budget)
+
+
 
 def split(field_cls, value, language='en'):
     xdoc = XapianDocument()
@@ -393,7 +645,9 @@ class CatalogTestCase(TestCase):
 
 
     def tearDown(self):
-        paths = ['fables/catalog', 'fables/database/.git']
+        paths = ['fables/catalog', 'fables/database/.git',
+                 'fables/database/agenda', 'tests/catalog',
+                 'tests/shard-0', 'tests/shard-1']
         for path in paths:
             if lfs.exists(path):
                 lfs.remove(path)
@@ -444,6 +698,50 @@ class CatalogTestCase(TestCase):
         self.assertEqual(len(results), 2)
 
 
+    def test_sync(self):
+        database = self.database
+        catalog = database.catalog
+        # A first commit
+        self.root.set_handler('agenda/tiger.txt',
+                              TextFile(data=u'The tiger and the wolf\n'))
+        database.save_changes()
+        abspath = lfs.get_absolute_path('fables/database/agenda/tiger.txt')
+        catalog.index_document(Document(abspath))
+        catalog.save_changes()
+        # The reader
+        ro = RODatabase('fables')
+        ro.catalog = Catalog('fables/catalog', Document.fields,
+                             read_only=True)
+        tiger = ro.get_handler('agenda/tiger.txt')
+        fable = ro.get_handler('03.txt')
+        self.assertEqual(tiger.to_str(), 'The tiger and the wolf\n')
+        self.assertEqual(len(ro.search(data=u'tiger')), 1)
+        self.assertEqual(len(ro.search(data=u'lion')), 5)
+        self.assertEqual(ro.sync(), False)
+        # Commit through the writer
+        handler = self.root.get_handler('agenda/tiger.txt')
+        handler.to_str()
+        handler.set_data(u'The tiger and the lion\n')
+        database.save_changes()
+        catalog.index_document(Document(abspath))
+        catalog.save_changes()
+        # Not seen until synced
+        self.assertEqual(len(ro.search(data=u'lion')), 5)
+        self.assertEqual(ro.sync(), True)
+        self.assertEqual(ro.generation, 1)
+        # The changed handler is reloaded, the others stay cached
+        handler = ro.get_handler('agenda/tiger.txt')
+        self.assertEqual(handler is tiger, False)
+        self.assertEqual(handler.to_str(), 'The tiger and the lion\n')
+        self.assertEqual(ro.get_handler('03.txt') is fable, True)
+        # The catalog is reopened
+        self.assertEqual(len(ro.search(data=u'lion')), 6)
+        self.assertEqual(len(ro.search(data=u'wolf', abspath='tiger.txt')), 0)
+        # Nothing new
+        self.assertEqual(ro.sync(), False)
+        self.assertEqual(ro.generation, 1)
+
+
     def test_AndQuery_empty(self):
         query = AndQuery()
         query.append(PhraseQuery('data', u'mouse'))
@@ -556,6 +854,193 @@ class CatalogTestCase(TestCase):
         self.assertEqual(doc.count, [1, 2, 11])
 
 
+    def test_brains(self):
+        results = self.database.search(lang='es')
+        doc = results.get_documents()[0]
+        brain = results.get_documents(fields=['count', 'title_es'])[0]
+        # Prefetched
+        self.assertEqual(brain.count, [1, 2, 11])
+        self.assertEqual(brain.title_es, doc.title_es)
+        # Not prefetched
+        self.assertEqual(brain.abspath, doc.abspath)
+        self.assertRaises(AttributeError, getattr, brain, 'data')
+
+
+    def test_brains_language(self):
+        catalog = self.database.catalog
+        catalog.index_document({
+            'abspath': 'bilingual', 'name': 'bilingual',
+            'title': {'en': u'Hello', 'fr': u'Bonjour'}})
+        catalog.save_changes()
+        # The same search (from the cache the second time) in two languages
+        try:
+            for language, title in [('en', u'Hello'), ('fr', u'Bonjour')]:
+                selector = lambda x, language=language: language
+                init_language_selector(selector)
+                results = self.database.search(name='bilingual')
+                brain = results.get_documents(fields=['abspath', 'title'])[0]
+                self.assertEqual(brain.title, title)
+        finally:
+            init_language_selector()
+
+
+    def test_search_cache(self):
+        database = self.database
+        catalog = database.catalog
+        query1 = AndQuery(PhraseQuery('data', u'mouse'),
+                          NotQuery(PhraseQuery('data', u'lion')))
+        query2 = AndQuery(NotQuery(PhraseQuery('data', u'lion')),
+                          PhraseQuery('data', u'mouse'))
+        # Equivalent queries share the cache
+        documents = database.search(query1).get_documents(sort_by='abspath')
+        generation = catalog.generation
+        results = database.search(query2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results.get_documents(sort_by='abspath'), documents)
+        # The cache is invalidated when the catalog changes
+        catalog.unindex_document(documents[0].abspath)
+        self.assertNotEqual(catalog.generation, generation)
+        self.assertEqual(len(database.search(query2)), 1)
+        catalog.abort_changes()
+        self.assertEqual(len(database.search(query1)), 2)
+
+
+    def test_iter_documents(self):
+        results = self.database.search(data=u'lion')
+        documents = results.get_documents(sort_by='abspath')
+        documents = [ x.abspath for x in documents ]
+        # All the documents, small pages
+        iterator = results.iter_documents(sort_by='abspath', page_size=2)
+        self.assertEqual([ x.abspath for x in iterator ], documents)
+        # A subset
+        iterator = results.iter_documents(sort_by='abspath', start=1, size=3,
+                                          page_size=2)
+        self.assertEqual([ x.abspath for x in iterator ], documents[1:4])
+        # Estimation
+        self.assertEqual(results.get_n_documents(check_at_least=10), 5)
+
+
+    def test_index_documents(self):
+        # Index the same documents in bulk, within small batches
+        catalog = make_catalog('tests/catalog', Document.fields)
+        fables = lfs.open('fables/database')
+        documents = (
+            Document(fables.get_absolute_path(name))
+            for name in fables.get_names()
+            if FileName.decode(name)[1] == 'txt')
+        n = catalog.index_documents(documents, batch_size=7)
+        # Test
+        reference = self.database.catalog
+        self.assertEqual(n, reference._db.get_doccount())
+        self.assertEqual(catalog._db.get_doccount(), n)
+        self.assertEqual(catalog.get_unique_values('title'),
+                         reference.get_unique_values('title'))
+
+
+    def test_merge_catalogs(self):
+        # Index the documents in two shards
+        fables = lfs.open('fables/database')
+        paths = [ fables.get_absolute_path(name)
+                  for name in fables.get_names()
+                  if FileName.decode(name)[1] == 'txt' ]
+        shards = ['tests/shard-0', 'tests/shard-1']
+        metadata, lock = {}, Lock()
+        for i, shard in enumerate(shards):
+            db = WritableDatabase(shard, DB_CREATE)
+            catalog = ShardCatalog(db, Document.fields, metadata, lock)
+            catalog.index_documents([ Document(x) for x in paths[i::2] ])
+            catalog.close()
+        # Merge
+        merge_catalogs(shards, 'tests/catalog')
+        # Test
+        catalog = Catalog('tests/catalog', Document.fields, read_only=True)
+        reference = self.database.catalog
+        self.assertEqual(catalog._db.get_doccount(), len(paths))
+        self.assertEqual(catalog.get_unique_values('title'),
+                         reference.get_unique_values('title'))
+
+
+
+class MetadataParserTestCase(TestCase):
+
+    data = (
+        'format;version=20090122:webpage\n'
+        'title;lang=en:Hello\\nworld\\\\n\n'
+        'tags;x="a;b",c;y=:Long value, folded\n'
+        '  on two lines\n'
+        'description;lang=fr;z="q\\"z":\n')
+
+
+    def test_parse_table(self):
+        expected = [
+            ('format', 'webpage', {'version': ['20090122']}),
+            ('title', 'Hello\nworld\\n', {'lang': ['en']}),
+            ('tags', 'Long value, folded on two lines',
+             {'x': ['a;b', 'c'], 'y': ['']}),
+            ('description', '', {'lang': ['fr'], 'z': ['q\\"z']})]
+        self.assertEqual(list(parse_table(self.data)), expected)
+
+
+    def test_fast_path(self):
+        # The fast path (regular expressions) and the slow path (state
+        # machine) must agree
+        for line in unfold_lines(self.data):
+            name, rest = read_name(line)
+            value, parameters = get_tokens(rest)
+            self.assertEqual(list(parse_table(line)),
+                             [(name, value, parameters)])
+
+
+    def test_syntax_error(self):
+        self.assertRaises(SyntaxError, list, parse_table('title;lang:x\n'))
+        self.assertRaises(SyntaxError, list, parse_table('title;a="b"c:x'))
+
+
+
+class BlobCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tearDown()
+        self.cache = BlobCache('tests/blobs')
+
+
+    def tearDown(self):
+        if lfs.exists('tests/blobs'):
+            lfs.remove('tests/blobs')
+
+
+    def test_blob_oid(self):
+        # Same as "git hash-object"
+        self.assertEqual(get_blob_oid('hello\n'),
+                         'ce013625030ba8dba906f756967f9e9ca394464a')
+
+
+    def test_get_set(self):
+        cache = self.cache
+        oid = get_blob_oid('hello\n')
+        self.assertEqual(cache.get(oid), None)
+        cache.set(oid, 'parsed')
+        self.assertEqual(cache.get(oid), 'parsed')
+        # Shared by other processes (or other instances)
+        self.assertEqual(BlobCache('tests/blobs').get(oid), 'parsed')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+    def test_prune(self):
+        cache = BlobCache('tests/blobs', max_size=None)
+        oids = [ get_blob_oid(str(i)) for i in range(5) ]
+        for i, oid in enumerate(oids):
+            cache.set(oid, 'x' * 300)
+            # From the oldest to the newest
+            path = cache._get_path(oid)
+            utime(path, (i, i))
+        # 1500 bytes, down to 800 (the oldest go first)
+        self.assertEqual(cache.prune(1000), 3)
+        self.assertEqual([ cache.get(x) is None for x in oids ],
+                         [True, True, True, False, False])
+        self.assertEqual(cache.prune(1000), 0)
+
+
 
 class BugXapianTestCase(TestCase):
 
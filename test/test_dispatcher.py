@@ -181,6 +181,49 @@ class DispatcherTestCase(TestCase):
 
 
 
+    def test_many_routes(self):
+        patterns = []
+        for i in range(100):
+            patterns.append(('/api/v%d/items' % i, 'LIST%d' % i))
+            patterns.append(('/api/v%d/items/{id:digits}' % i, 'ITEM%d' % i))
+            patterns.append(('/api/v%d/{name:any}' % i, 'ANY%d' % i))
+        # Register route patterns
+        self._register_routes(patterns)
+        # Check dispatcher route resolution
+        urls = [
+            ('/api/v0/items',       'LIST0'),
+            ('/api/v42/items/12',   'ITEM42'),
+            ('/api/v42/items/a',    'ANY42'),
+            ('/api/v99/items/1/2',  'ANY99'),
+        ]
+        self._check_matching_method(urls)
+        assert self.dispatcher.resolve('/api/v100/items') is None
+        assert self.dispatcher.resolve('/api/v1') is None
+        # Routes added after a resolution are taken into account
+        self.dispatcher.add('/api/v100/items', 'LIST100')
+        self._check_matching_method([('/api/v100/items', 'LIST100')])
+
+
+    def test_shared_patterns(self):
+        # The patterns are shared by the dispatchers (class attribute)
+        patterns = OrderedDict()
+        class Dispatcher(URIDispatcher):
+            pass
+        Dispatcher.patterns = patterns
+        a = Dispatcher()
+        b = Dispatcher()
+        a.add('/x', 'X')
+        self.assertEqual(a.resolve('/x'), ('X', {}))
+        self.assertEqual(b.resolve('/x'), ('X', {}))
+        # Added through another dispatcher
+        b.add('/y', 'Y')
+        self.assertEqual(a.resolve('/y'), ('Y', {}))
+        # Removed directly
+        patterns.pop('/x')
+        self.assertEqual(a.resolve('/x'), None)
+        self.assertEqual(b.resolve('/x'), None)
+
+
 if __name__ == '__main__':
     main()
 
@@ -15,10 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
+from datetime import datetime
 from unittest import TestCase, main
 
 # Import from itools
+from itools.core import SizedLRUCache
+from itools.i18n import AcceptLanguageType
+from itools.uri import get_reference
 from itools.web import BaseView, WebServer, Context
+from itools.web.router import RequestMethod
 from itools.web.static import StaticView
 
 
@@ -76,5 +81,127 @@ class RouterTestCase(TestCase):
 
 
 
+
+class PageView(BaseView):
+
+    cache_page = True
+
+
+
+class Stub(object):
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.server = Stub(page_cache=SizedLRUCache(10, 20))
+        self.database = Stub(generation=0)
+
+
+    def context(self, accept_language='en', view=PageView(), mtime=None):
+        accept_language = AcceptLanguageType.decode(accept_language)
+        return Stub(server=self.server, database=self.database, view=view,
+                    resource=None, user=None, mtime=mtime,
+                    uri=get_reference('http://localhost/page'),
+                    accept_language=accept_language, commit=False,
+                    status=None, content_type=None, entity=None,
+                    page_key=None, page_hit=False, response_headers=[])
+
+
+    def render(self, context, entity='Hello'):
+        RequestMethod.check_page_cache(context)
+        if not context.page_hit:
+            context.status = 200
+            context.content_type = 'text/plain'
+            context.entity = entity
+            RequestMethod.set_page_cache(context)
+        return context
+
+
+    def test_hit(self):
+        context = self.render(self.context())
+        self.assertEqual(context.page_hit, False)
+        context = self.render(self.context(), 'Bye')
+        self.assertEqual(context.page_hit, True)
+        self.assertEqual(context.status, 200)
+        self.assertEqual(context.content_type, 'text/plain')
+        self.assertEqual(context.entity, 'Hello')
+
+
+    def test_language(self):
+        self.render(self.context('fr, en;q=0.5'), 'Bonjour')
+        # The same languages
+        context = self.render(self.context('en;q=0.5,fr'))
+        self.assertEqual(context.entity, 'Bonjour')
+        # Another language
+        context = self.render(self.context('en'))
+        self.assertEqual(context.page_hit, False)
+        self.assertEqual(context.entity, 'Hello')
+
+
+    def test_generation(self):
+        self.render(self.context())
+        self.database.generation += 1
+        context = self.render(self.context(), 'Bye')
+        self.assertEqual(context.page_hit, False)
+        context = self.render(self.context())
+        self.assertEqual(context.entity, 'Bye')
+
+
+    def test_mtime(self):
+        self.render(self.context(mtime=datetime(2017, 1, 1)))
+        context = self.render(self.context(mtime=datetime(2017, 1, 2)),
+                              'Bye')
+        self.assertEqual(context.page_hit, False)
+        context = self.render(self.context(mtime=datetime(2017, 1, 2)))
+        self.assertEqual(context.entity, 'Bye')
+
+
+    def test_opt_out(self):
+        class View(PageView):
+            def get_page_cache_key(self, resource, context):
+                return False
+        self.render(self.context(view=View()))
+        self.assertEqual(len(self.server.page_cache), 0)
+        # Not asked for
+        self.render(self.context(view=BaseView()))
+        self.assertEqual(len(self.server.page_cache), 0)
+
+
+    def test_not_stored(self):
+        # Not 200
+        context = self.context()
+        RequestMethod.check_page_cache(context)
+        context.status = 404
+        context.entity = 'Not Found'
+        RequestMethod.set_page_cache(context)
+        # Not a string
+        context = self.context()
+        RequestMethod.check_page_cache(context)
+        context.status = 200
+        context.entity = ['Hello']
+        RequestMethod.set_page_cache(context)
+        # With headers
+        context = self.context()
+        RequestMethod.check_page_cache(context)
+        context.status = 200
+        context.entity = 'Hello'
+        context.response_headers.append('Set-Cookie')
+        RequestMethod.set_page_cache(context)
+        # Changes
+        context = self.context()
+        RequestMethod.check_page_cache(context)
+        context.status = 200
+        context.entity = 'Hello'
+        context.commit = True
+        RequestMethod.set_page_cache(context)
+        self.assertEqual(len(self.server.page_cache), 0)
+
+
+
 if __name__ == '__main__':
     main()
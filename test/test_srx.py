@@ -345,5 +345,23 @@ class SentenceTestCase(TestCase):
         self.assertEqual(segments, expected)
 
 
+    def test_language(self):
+        text = u'Bonjour Mme. Dupont. Au revoir.'
+        message = Message()
+        message.append_text(text)
+        # French
+        segments = [ seg for seg, context, offset
+                     in get_segments(message, language='fr') ]
+        expected = [((TEXT, u'Bonjour Mme. Dupont.'),),
+                    ((TEXT, u'Au revoir.'),)]
+        self.assertEqual(segments, expected)
+        # English
+        segments = [ seg for seg, context, offset
+                     in get_segments(message, language='en') ]
+        expected = [((TEXT, u'Bonjour Mme.'),), ((TEXT, u'Dupont.'),),
+                    ((TEXT, u'Au revoir.'),)]
+        self.assertEqual(segments, expected)
+
+
 if __name__ == '__main__':
     main()
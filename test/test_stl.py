@@ -21,8 +21,9 @@ from unittest import TestCase, main
 # Import from itools
 import itools.html
 from itools.stl import stl
+from itools.stl.compiler import get_compiled_template
 from itools.stl.stl import NamespaceStack, substitute, evaluate
-from itools.xml import stream_to_str
+from itools.xml import CompactEvents, XMLParser, stream_to_str
 from itools.xmlfile import XMLFile
 
 
@@ -121,6 +122,107 @@ class STLTestCase(TestCase):
         self.assertEqual(events, [])
 
 
+    def test_compact(self):
+        data = ('<ul xmlns="http://www.w3.org/1999/xhtml"'
+                ' xmlns:stl="http://www.hforge.org/xml-namespaces/stl">'
+                '<li stl:repeat="item items" class="${item/class}">'
+                '<b stl:if="item/bold">${item/name}</b>'
+                '<i stl:if="not item/bold">${item/name}</i>'
+                '</li></ul>')
+        namespace = {'items': [
+            {'name': 'a', 'class': 'first', 'bold': True},
+            {'name': 'b', 'class': None, 'bold': False}]}
+        events = list(XMLParser(data))
+        expected = stl(events=events, namespace=namespace, mode='xml')
+        compact = CompactEvents(events)
+        output = stl(events=compact, namespace=namespace, mode='xml')
+        self.assertEqual(output, expected)
+
+
+
+class CompilerTestCase(TestCase):
+
+    templates = [
+        '<p>Hello ${name}, <b title="a ${title} b">${title}</b></p>',
+        '<ul><li stl:repeat="item items" class="${repeat/item/even}">'
+        '${repeat/item/index} ${item}</li></ul>',
+        '<div><input type="checkbox" checked="${checked}" />'
+        '<span stl:omit-tag="omit">${name}</span>'
+        '<b stl:if="checked and not omit">x</b>'
+        '<stl:block stl:repeat="item items" stl:if="item">${item}'
+        '</stl:block></div>']
+
+    namespaces = [
+        {'name': u'World', 'title': 'T&T', 'items': ['a', '', 'c'],
+         'checked': True, 'omit': False},
+        {'name': None, 'title': None, 'items': [], 'checked': False,
+         'omit': True}]
+
+
+    def get_events(self, data):
+        data = ('<div xmlns="http://www.w3.org/1999/xhtml" xmlns:stl='
+                '"http://www.hforge.org/xml-namespaces/stl">%s</div>' % data)
+        return list(XMLParser(data))
+
+
+    def test_same_output(self):
+        for data in self.templates:
+            events = self.get_events(data)
+            for namespace in self.namespaces:
+                for mode in ['events', 'xml', 'xhtml', 'html']:
+                    expected = stl(events=events, namespace=namespace,
+                                   mode=mode)
+                    output = stl(events=events, namespace=namespace,
+                                 mode=mode, compiled=True)
+                    if mode == 'events':
+                        expected, output = list(expected), list(output)
+                    self.assertEqual(output, expected)
+
+
+    def test_content_type(self):
+        head = ('<html xmlns="http://www.w3.org/1999/xhtml" xmlns:stl='
+                '"http://www.hforge.org/xml-namespaces/stl"><head>%s</head>'
+                '<body>${body}</body></html>')
+        templates = [
+            '<title>${title}</title>',
+            '<meta http-equiv="Content-Type" content="text/plain" />',
+            '<meta http-equiv="${equiv}" content="text/plain" />']
+        body = list(XMLParser('<meta xmlns="http://www.w3.org/1999/xhtml" '
+                              'http-equiv="Content-Type" content="x" />'))
+        namespaces = [
+            {'title': 'Hello', 'equiv': 'Content-Type', 'body': 'World'},
+            {'title': 'Hello', 'equiv': 'refresh', 'body': body}]
+        for data in templates:
+            events = list(XMLParser(head % data))
+            for namespace in namespaces:
+                for mode in ['xhtml', 'html']:
+                    expected = stl(events=events, namespace=namespace,
+                                   mode=mode)
+                    output = stl(events=events, namespace=namespace,
+                                 mode=mode, compiled=True)
+                    self.assertEqual(output, expected)
+
+
+    def test_chunks(self):
+        events = self.get_events(self.templates[0])
+        namespace = self.namespaces[0]
+        for mode in ['xml', 'xhtml', 'html']:
+            expected = stl(events=events, namespace=namespace, mode=mode)
+            for compiled in [False, True]:
+                output = stl(events=events, namespace=namespace, mode=mode,
+                             compiled=compiled, chunks=True)
+                self.assertEqual(type(output), list)
+                self.assertEqual(''.join(output), expected)
+
+
+    def test_cache(self):
+        events = self.get_events(self.templates[0])
+        template = get_compiled_template(events=events)
+        self.assert_(get_compiled_template(events=events) is template)
+        self.assert_(get_compiled_template(events=list(events))
+                     is not template)
+
+
 
 if __name__ == '__main__':
     main()
@@ -15,14 +15,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
+from os import _exit, close, pipe, write
+from signal import SIGTERM
+from threading import Thread
+from time import sleep, time
 from unittest import TestCase, main
+from zlib import decompress, MAX_WBITS
 
 # Import from itools
-from itools.web import BaseView, WebServer
+from itools.web import BaseView, WebServer, get_context, set_context
 from itools.web import Cookie, SetCookieDataType
 from itools.web.headers import ContentType, ContentDisposition, CookieDataType
 from itools.web.headers import read_token, read_quoted_string, read_parameter
 from itools.web.headers import read_parameters
+from itools.web.multipart import MultipartParser, UploadFile
+from itools.web.prefork import PreforkServer, Worker
+from itools.web.compression import compress, get_accept_encoding
+from itools.web.compression import is_compressible, select_coding
+from itools.web.static import match_etag, parse_range
 
 
 class ParsingTestCase(TestCase):
@@ -166,6 +176,309 @@ class CookieTestCase(TestCase):
 
 
 
+class MultipartTestCase(TestCase):
+
+    body = ('preamble\r\n'
+            '--AaB03x\r\n'
+            'Content-Disposition: form-data; name="title"\r\n'
+            '\r\n'
+            'Hello\r\n'
+            '--AaB03x\r\n'
+            'Content-Disposition: form-data; name="tags"\r\n'
+            '\r\n'
+            'a\r\n'
+            '--AaB03x\r\n'
+            'Content-Disposition: form-data; name="tags"\r\n'
+            '\r\n'
+            'b\r\n'
+            '--AaB03x\r\n'
+            'Content-Disposition: form-data; name="file"; '
+            'filename="C:\\docs\\file.txt"\r\n'
+            'Content-Type: text/x-rst\r\n'
+            '\r\n'
+            '%s\r\n'
+            '--AaB03x\r\n'
+            'Content-Disposition: form-data; name="empty"; filename=""\r\n'
+            '\r\n'
+            '\r\n'
+            '--AaB03x--\r\n')
+
+    data = 'Title\r\n=====\r\n\r\n--AaB03 is not the boundary\r\n' * 10
+
+
+    def parse(self, chunk_size, spool_size=None):
+        parser = MultipartParser('AaB03x', spool_size)
+        body = self.body % self.data
+        for i in range(0, len(body), chunk_size):
+            parser.feed(body[i:i+chunk_size])
+        return parser.close()
+
+
+    def test_chunks(self):
+        expected = {
+            'title': 'Hello',
+            'tags': ['a', 'b'],
+            'file': ('file.txt', 'text/x-rst', self.data),
+            'empty': None}
+        for chunk_size in [1, 7, 100, 10000]:
+            self.assertEqual(self.parse(chunk_size), expected)
+
+
+    def test_spool(self):
+        form = self.parse(100, spool_size=100)
+        filename, mimetype, body = form['file']
+        self.assert_(isinstance(body, UploadFile))
+        self.assertEqual(len(body), len(self.data))
+        self.assertEqual(body.read(), self.data)
+        body.close()
+        # Small files and fields are kept in memory
+        form = self.parse(100, spool_size=len(self.data))
+        self.assertEqual(form['file'][2], self.data)
+
+
+    def test_malformed(self):
+        parser = MultipartParser('AaB03x')
+        parser.feed('--AaB03x\r\nContent-Type: text/plain\r\n\r\nx\r\n')
+        self.assertRaises(ValueError, parser.close)
+
+
+
+class ContextTestCase(TestCase):
+
+    def test_thread(self):
+        set_context('main')
+        seen = []
+        def handle_request():
+            seen.append(get_context())
+            set_context('thread')
+            seen.append(get_context())
+        thread = Thread(target=handle_request)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None, 'thread'])
+        self.assertEqual(get_context(), 'main')
+        set_context(None)
+
+
+
+class StaticTestCase(TestCase):
+
+    def test_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range('bytes=95-200', 100), [(95, 99)])
+        self.assertEqual(parse_range('bytes=0-1, 5-6', 100),
+                         [(0, 1), (5, 6)])
+
+
+    def test_range_unsatisfiable(self):
+        self.assertEqual(parse_range('bytes=100-', 100), [])
+        self.assertEqual(parse_range('bytes=200-300', 100), [])
+
+
+    def test_range_invalid(self):
+        self.assertEqual(parse_range('bytes=5-1', 100), None)
+        self.assertEqual(parse_range('items=0-1', 100), None)
+        self.assertEqual(parse_range('bytes=a-b', 100), None)
+
+
+    def test_accept_encoding(self):
+        codings = get_accept_encoding('gzip;q=0.5, br, identity;q=0')
+        self.assertEqual(codings, {'gzip': 0.5, 'br': 1.0, 'identity': 0.0})
+
+
+    def test_etag(self):
+        self.assertEqual(match_etag('"a", W/"b"', '"b"'), True)
+        self.assertEqual(match_etag('*', '"b"'), True)
+        self.assertEqual(match_etag('"a"', '"b"'), False)
+
+
+
+class CompressionTestCase(TestCase):
+
+    def test_select_coding(self):
+        self.assertEqual(select_coding(None), None)
+        self.assertEqual(select_coding('gzip, deflate'), 'gzip')
+        self.assertEqual(select_coding('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(select_coding('br'), None)
+        self.assertEqual(select_coding('*'), 'gzip')
+        self.assertEqual(select_coding('*, gzip;q=0'), 'deflate')
+
+
+    def test_is_compressible(self):
+        self.assertEqual(is_compressible('text/html; charset=UTF-8'), True)
+        self.assertEqual(is_compressible('application/json'), True)
+        self.assertEqual(is_compressible('image/png'), False)
+        self.assertEqual(is_compressible(None), False)
+
+
+    def test_compress(self):
+        data = 'Hello World ' * 100
+        self.assertEqual(decompress(compress(data, 'deflate')), data)
+        self.assertEqual(decompress(compress(data, 'gzip'), 16 + MAX_WBITS),
+                         data)
+        self.assertRaises(ValueError, compress, data, 'br')
+
+
+
+def make_server(read_only):
+    # Called in the worker: die at once
+    _exit(0)
+
+
+
+class PreforkTestCase(TestCase):
+
+    def setUp(self):
+        self.server = PreforkServer(make_server, None, 8080, workers=2)
+        self.server.socket = self.server.writer_socket = None
+
+
+    def tearDown(self):
+        server = self.server
+        server.stopping = True
+        for worker in server.workers.values():
+            if worker.pid < 0:
+                close(worker.fd)
+                del server.workers[worker.pid]
+        self.wait(lambda: not server.workers)
+
+
+    def wait(self, condition):
+        timeout = time() + 10
+        while not condition():
+            self.assertEqual(time() < timeout, True)
+            self.server.reap()
+            sleep(0.05)
+
+
+    def test_status(self):
+        server = self.server
+        # Fake workers, reporting their health through a pipe
+        for pid, role in (-2, 'reader'), (-1, 'writer'):
+            rfd, wfd = pipe()
+            server.workers[pid] = Worker(pid, role, rfd)
+            write(wfd, '{"requests": 1, "vmsize": 10}\n')
+            write(wfd, '{"requests": %d, "vmsize": 20}\n{"req' % -pid)
+            close(wfd)
+        server.read_health(0)
+        status = server.get_status()
+        self.assertEqual(status['requests'], 3)
+        workers = status['workers']
+        self.assertEqual([ x['pid'] for x in workers ], [-2, -1])
+        self.assertEqual([ x['role'] for x in workers ], ['reader', 'writer'])
+        self.assertEqual([ x['requests'] for x in workers ], [2, 1])
+        self.assertEqual([ x['vmsize'] for x in workers ], [20, 20])
+        # The incomplete line is kept for later
+        self.assertEqual(server.workers[-2].buffer, '{"req')
+
+
+    def test_respawn(self):
+        server = self.server
+        server.spawn_workers()
+        old = server.workers.keys()
+        self.assertEqual(len(old), 2)
+        # The workers die, they are replaced
+        for worker in server.workers.values():
+            worker.started = 0
+        self.wait(lambda: not set(old) & set(server.workers))
+        self.assertEqual(len(server.workers), 2)
+        roles = [ x.role for x in server.workers.values() ]
+        self.assertEqual(roles, ['reader', 'reader'])
+
+
+    def test_stop(self):
+        server = self.server
+        server.spawn_workers()
+        # Killed on purpose, not replaced
+        server.kill_workers(server.workers.keys())
+        self.wait(lambda: not server.workers)
+
+
+
+class FakePreforkServer(PreforkServer):
+    """The workers are not forked, their health is reported by hand.
+    """
+
+    def __init__(self, *args, **kw):
+        super(FakePreforkServer, self).__init__(*args, **kw)
+        self.writer_socket = None
+        self.pipes = {}
+        self.signals = []
+
+
+    def spawn(self, role, replaces=None):
+        pid = len(self.pipes) + 1
+        rfd, self.pipes[pid] = pipe()
+        self.workers[pid] = Worker(pid, role, rfd, replaces)
+        return pid
+
+
+    def signal_worker(self, pid, signum):
+        self.signals.append((pid, signum))
+
+
+    def report(self, *pids):
+        for pid in pids:
+            write(self.pipes[pid], '{"requests": 0, "vmsize": 0}\n')
+        self.read_health(0)
+
+
+
+class RestartTestCase(TestCase):
+
+    def setUp(self):
+        self.server = FakePreforkServer(make_server, None, 8080, workers=2)
+
+
+    def tearDown(self):
+        server = self.server
+        for fd in server.pipes.values():
+            close(fd)
+        for worker in server.workers.values():
+            close(worker.fd)
+
+
+    def test_restart(self):
+        server = self.server
+        server.spawn_workers()
+        server.report(1, 2)
+        # The new workers are started, the old ones go on
+        server.restart()
+        self.assertEqual(sorted(server.workers), [1, 2, 3, 4])
+        self.assertEqual(server.signals, [])
+        # Restart again while starting: nothing new
+        server.restart()
+        self.assertEqual(sorted(server.workers), [1, 2, 3, 4])
+        # A new worker is ready, the old one it replaces is drained
+        old = server.workers[3].replaces
+        server.report(3)
+        self.assertEqual(server.signals, [(old, server.drain_signal)])
+        self.assertEqual(server.workers[old].role, None)
+        # Only once
+        server.report(3)
+        self.assertEqual(len(server.signals), 1)
+        # An old worker reporting changes nothing
+        server.report(1, 2)
+        self.assertEqual(len(server.signals), 1)
+        # Both ready
+        server.report(4)
+        self.assertEqual(sorted(server.signals),
+                         [(1, server.drain_signal), (2, server.drain_signal)])
+
+
+    def test_stop(self):
+        server = self.server
+        server.spawn_workers()
+        server.restart()
+        # Stop before the new workers are ready: all are killed at once
+        server.on_stop(None, None)
+        self.assertEqual(sorted(server.signals),
+                         [ (x, SIGTERM) for x in 1, 2, 3, 4 ])
+
+
+
 #class MyRootView(BaseView):
 #    access = True
 #    def GET(self, resource, context):
@@ -24,6 +24,7 @@ from unittest import TestCase, main
 import itools.html
 from itools.xml import XMLParser, DocType, XMLError, XML_DECL, START_ELEMENT
 from itools.xml import TEXT, CDATA, get_doctype
+from itools.xml import CompactEvents, find_end, stream_to_str
 
 
 class ParserTestCase(TestCase):
@@ -159,5 +160,40 @@ class DocTypeTestCase(TestCase):
 
 
 
+class CompactEventsTestCase(TestCase):
+
+    data = ('<ul class="menu">\n'
+            '  <li class="item"><a href="/">Home</a></li>\n'
+            '  <li class="item"><a href="/about">About</a></li>\n'
+            '</ul>')
+
+    def test_sequence(self):
+        events = list(XMLParser(self.data))
+        compact = CompactEvents(events)
+        self.assertEqual(len(compact), len(events))
+        self.assertEqual(list(compact), events)
+        self.assertEqual(compact[3], events[3])
+        self.assertEqual(compact[-1], events[-1])
+        self.assertEqual(compact[2:5], events[2:5])
+        self.assertEqual(stream_to_str(compact), stream_to_str(events))
+
+
+    def test_find_end(self):
+        events = list(XMLParser(self.data))
+        compact = CompactEvents(events)
+        for i, (event, value, line) in enumerate(events):
+            if event == START_ELEMENT:
+                self.assertEqual(find_end(compact, i), find_end(events, i))
+
+
+    def test_shared_values(self):
+        compact = CompactEvents(XMLParser(self.data))
+        items = [ value for event, value, line in compact
+                  if event == START_ELEMENT and value[1] == 'li' ]
+        self.assertEqual(len(items), 2)
+        self.assert_(items[0] is items[1])
+
+
+
 if __name__ == '__main__':
     main()
@@ -18,12 +18,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
+from os import remove
 from unittest import TestCase, main
 
 # Import from itools
 import itools.html
+from itools.handlers import ro_database
 from itools.srx import TEXT as srx_TEXT
-from itools.xml import XMLParser
+from itools.xml import XMLParser, stream_to_str
 from itools.xmlfile import XMLFile
 
 
@@ -103,5 +105,55 @@ class TranslatableTestCase(TestCase):
 
 
 
+class LazyXMLFile(XMLFile):
+
+    lazy_events = True
+
+
+
+class LazyTestCase(TestCase):
+
+    def test_string(self):
+        data = '<p>Hello <em>World</em>. Goodbye.</p>'
+        handler = LazyXMLFile(string=data)
+        self.assertEqual('events' in handler.__dict__, False)
+        # Every access returns a new iterator
+        self.assertEqual(list(handler.events), list(XMLParser(data)))
+        self.assertEqual(list(handler.events), list(XMLParser(data)))
+        self.assertEqual(cmp(XMLFile(string=data), handler), 0)
+        self.assertEqual(list(handler.get_units()),
+                         list(XMLFile(string=data).get_units()))
+
+
+    def test_file(self):
+        key = 'tests/sample-rss-2.xml'
+        handler = ro_database.get_handler(key, LazyXMLFile)
+        expected = XMLFile(string=open(key).read())
+        self.assertEqual(stream_to_str(handler.events), expected.to_str())
+        self.assertEqual(handler.to_text(), expected.to_text())
+        self.assertEqual('events' in handler.__dict__, False)
+        self.assertEqual('data' in handler.__dict__, False)
+
+
+    def test_file_changed(self):
+        # The events match the data loaded, not the file changed since
+        key = 'tests/lazy.xml'
+        open(key, 'w').write('<p>Hello</p>')
+        try:
+            handler = ro_database.get_handler(key, LazyXMLFile)
+            expected = list(handler.events)
+            open(key, 'w').write('<p>Bye</p>')
+            self.assertEqual(list(handler.events), expected)
+        finally:
+            remove(key)
+
+
+    def test_set_events(self):
+        handler = LazyXMLFile(string='<p>Hello</p>')
+        events = list(XMLParser('<p>Bye</p>'))
+        handler.set_events(events)
+        self.assertEqual(handler.events, events)
+
+
 if __name__ == '__main__':
     main()